@@ -15,7 +15,6 @@ import beeline
 from beeline.middleware.flask import HoneyMiddleware
 from pg_to_evalscript import list_supported_processes
 from werkzeug.exceptions import HTTPException
-from urllib.parse import urlparse, parse_qs
 
 import globalmaptiles
 from logs.logging import with_logging
@@ -31,7 +30,6 @@ from schemas import (
 from dynamodb import JobsPersistence, ProcessGraphsPersistence, ServicesPersistence
 from processing.processing import (
     check_process_graph_conversion_validity,
-    get_batch_job_estimate,
     process_data_synchronously,
     create_batch_job,
     start_batch_job,
@@ -39,10 +37,23 @@ from processing.processing import (
     modify_batch_job,
     get_batch_job_status,
     create_or_get_estimate_values_from_db,
+    start_batch_job_estimation,
+    get_reset_estimate_fields,
+    update_batch_request_id,
+)
+from processing.const import (
+    SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE,
+    JOB_RESULTS_CACHE_MIN_VALIDITY,
+    JOB_RESULTS_CACHE_MAX_SIZE,
+    BATCH_ESTIMATE_CHECK_INTERVAL,
+    SERVICE_RECORDS_CACHE_TTL,
+    SERVICE_RECORDS_CACHE_MAX_SIZE,
+)
+from processing.utils import (
+    inject_variables_in_process_graph,
+    overwrite_spatial_extent_without_parameters,
+    get_spatial_extent_geometry,
 )
-from processing.const import SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE
-from post_processing.post_processing import parse_sh_gtiff_to_format
-from processing.utils import inject_variables_in_process_graph, overwrite_spatial_extent_without_parameters
 from processing.openeo_process_errors import OpenEOProcessError
 from authentication.authentication import authentication_provider
 from openeoerrors import (
@@ -50,18 +61,29 @@ from openeoerrors import (
     ProcessUnsupported,
     JobNotFinished,
     JobNotFound,
+    AssetNotFound,
     JobLocked,
     CollectionNotFound,
     ServiceNotFound,
     Internal,
     BadRequest,
     ProcessGraphNotFound,
+    ItemNotFound,
     SHOpenEOError,
+    EstimateNotReady,
 )
 from authentication.user import User
 from const import openEOBatchJobStatus, optional_process_parameters, SentinelHubBillingPlan
-from utils import get_all_process_definitions, convert_timestamp_to_simpler_format, get_roles, ISO8601_UTC_FORMAT
-from buckets import get_bucket
+from utils import (
+    get_all_process_definitions,
+    convert_timestamp_to_simpler_format,
+    get_roles,
+    get_zarr_store_key,
+    ISO8601_UTC_FORMAT,
+    TTLCache,
+)
+from buckets import get_bucket, start_results_purge
+from post_processing.manifest import ManifestStatus, load_manifest, get_manifest_result_keys, is_manifest_key
 
 from openeo_collections.collections import collections
 
@@ -97,16 +119,209 @@ if HONEYCOMP_APM_API_KEY:
 
 STAC_VERSION = "1.0.0"
 
+# results of finished jobs don't change, entries expire once their presigned URLs are close to expiring
+job_results_cache = TTLCache(ttl=JOB_RESULTS_CACHE_MIN_VALIDITY, max_size=JOB_RESULTS_CACHE_MAX_SIZE)
 
-def update_batch_request_id(job_id, job, new_batch_request_id):
-    JobsPersistence.update_key(job_id, "batch_request_id", new_batch_request_id)
-    JobsPersistence.update_key(
-        job_id,
-        "previous_batch_request_ids",
-        [*json.loads(job["previous_batch_request_ids"]), job["batch_request_id"]],
+# tiles of XYZ services are requested many at a time, records of services (None for unknown ids) are cached
+service_records_cache = TTLCache(ttl=SERVICE_RECORDS_CACHE_TTL, max_size=SERVICE_RECORDS_CACHE_MAX_SIZE)
+
+
+def get_job_results_cache_key(job):
+    # results of restarted or modified jobs are cached separately
+    return (
+        job["id"],
+        job["batch_request_id"],
+        job.get("title"),
+        job.get("estimated_platform_credits"),
+        job.get("estimated_sentinelhub_pu"),
     )
 
 
+def get_job_results_cache_ttl(bucket):
+    return bucket.PRESIGNED_URL_EXPIRATION - JOB_RESULTS_CACHE_MIN_VALIDITY
+
+
+def get_job_results_error_response(job):
+    """
+    Returns the error response of a failed job or None if the job finished successfully.
+    """
+    status, error = get_batch_job_status(job)
+
+    if status not in [
+        openEOBatchJobStatus.FINISHED,
+        openEOBatchJobStatus.ERROR,
+    ]:
+        raise JobNotFinished()
+
+    if status == openEOBatchJobStatus.ERROR:
+        return flask.make_response(jsonify(id=job["id"], code=424, level="error", message=error, links=[]), 424)
+    return None
+
+
+def get_job_results(job, bucket):
+    """
+    Returns (cached) results of the job: a list of asset keys and keys of their objects (None for Zarr stores, which
+    are opened through the API), presigned URLs of the objects which were already signed and the time they are
+    valid until. Results are only listed once per job, objects are only signed once they are on a requested page.
+    """
+    cache_key = get_job_results_cache_key(job)
+    job_results = job_results_cache.get(cache_key)
+    if job_results is None:
+        time_valid = datetime.utcnow() + timedelta(seconds=bucket.PRESIGNED_URL_EXPIRATION)
+        job_results = {
+            "assets": list_job_result_assets(job, bucket),
+            "presigned_urls": {},
+            # URLs which are signed later are valid for longer, all of them are valid at least until then
+            "expires": time_valid.strftime(ISO8601_UTC_FORMAT),
+        }
+        job_results_cache.set(cache_key, job_results, ttl=get_job_results_cache_ttl(bucket))
+    return job_results
+
+
+def get_presigned_url(job_results, bucket, object_key):
+    presigned_url = job_results["presigned_urls"].get(object_key)
+    if presigned_url is None:
+        presigned_url = bucket.generate_presigned_url(object_key=object_key)
+        job_results["presigned_urls"][object_key] = presigned_url
+    return presigned_url
+
+
+def list_job_result_assets(job, bucket):
+    """
+    Returns a list of asset keys of job results and keys of their objects (None for Zarr stores).
+    """
+    # gtiffs are post-processed to appropriate formats in the background (post_processing.post_process_batch_job),
+    # job is reported as finished only once that is done, keys of all results are then recorded in the manifest
+    manifest = load_manifest(bucket, job["batch_request_id"])
+    if manifest is not None and manifest["status"] == ManifestStatus.DONE.value:
+        result_keys = get_manifest_result_keys(manifest)
+    else:
+        # results which were post-processed before manifests were written are listed
+        result_keys = [
+            result["Key"]
+            for result in bucket.get_data_from_bucket(prefix=job["batch_request_id"])
+            if not is_manifest_key(result["Key"])
+        ]
+    log(INFO, f"Fetched all results: {str(result_keys)}")
+
+    result_assets = {}
+    for object_key in result_keys:
+        # do not add json file created by SH batch job API and our metadata.json to the list of assets
+        if object_key.endswith(f"/request-{job['batch_request_id']}.json") or object_key.endswith("/metadata.json"):
+            continue
+
+        # Zarr stores are written directly to the bucket, clients open them object by object through the API
+        zarr_store_key = get_zarr_store_key(object_key)
+        if zarr_store_key is not None:
+            result_assets[zarr_store_key] = None
+        else:
+            result_assets[object_key] = object_key
+
+    return list(result_assets.items())
+
+
+def create_job_result_assets(job_id, bucket, job_results, result_assets):
+    """
+    Creates STAC assets of (a page of) job results, only their objects are signed.
+    """
+    assets = {}
+    for asset_key, object_key in result_assets:
+        if object_key is None:
+            assets[asset_key] = {
+                "href": f"{flask.request.url_root}jobs/{job_id}/results/assets/{asset_key}",
+                "roles": ["data"],
+                "type": "application/vnd+zarr",
+            }
+        else:
+            assets[asset_key] = {
+                "href": get_presigned_url(job_results, bucket, object_key),
+                "roles": get_roles(object_key),
+                "expires": job_results["expires"],
+            }
+    return assets
+
+
+def get_job_result_item_id(batch_request_id, asset_key):
+    """
+    Results of each tile (subfolder of the batch request) are one item, outputs which don't belong to a tile
+    (e.g. mosaics) are items of their own.
+    """
+    path = asset_key[len(batch_request_id) + 1 :]
+    if "/" in path:
+        return path.split("/")[0]
+    return path.split(".")[0]
+
+
+def group_job_result_items(batch_request_id, result_assets):
+    items = {}
+    for asset_key, object_key in result_assets:
+        items.setdefault(get_job_result_item_id(batch_request_id, asset_key), []).append((asset_key, object_key))
+    return items
+
+
+def create_job_result_item(job_id, item_id, assets, time_valid_iso8601, geometry=None, bbox=None):
+    """
+    Creates a STAC item of job results. Items cover (a part of) the spatial extent of the job, `geometry` and `bbox`.
+    """
+    item = {
+        "type": "Feature",
+        "stac_version": STAC_VERSION,
+        "id": item_id,
+        "geometry": geometry,
+        "properties": {
+            "datetime": datetime.utcnow().strftime(ISO8601_UTC_FORMAT),
+            "expires": time_valid_iso8601,
+        },
+        "links": [
+            {
+                "rel": "self",
+                "href": f"{flask.request.url_root}jobs/{job_id}/results/items/{item_id}",
+                "type": "application/geo+json",
+            },
+        ],
+        "assets": assets,
+    }
+    if bbox is not None:
+        item["bbox"] = bbox
+    return item
+
+
+def get_limit_parameter():
+    """
+    Returns `limit` query parameter (None if results are not paginated).
+    """
+    limit = flask.request.args.get("limit")
+    if limit is not None and (not limit.isdigit() or int(limit) < 1):
+        raise BadRequest("limit must be a positive integer")
+    return int(limit) if limit is not None else None
+
+
+def get_page_parameters():
+    """
+    Returns `limit` (None if results are not paginated) and `offset` query parameters.
+    """
+    offset = flask.request.args.get("offset", "0")
+    if not offset.isdigit():
+        raise BadRequest("offset must be a non-negative integer")
+    return get_limit_parameter(), int(offset)
+
+
+def get_page(elements, limit, offset):
+    return elements[offset : None if limit is None else offset + limit]
+
+
+def get_page_links(limit, offset, n_elements, media_type="application/json"):
+    if limit is None or offset + limit >= n_elements:
+        return []
+    return [
+        {
+            "rel": "next",
+            "href": f"{flask.request.base_url}?limit={limit}&offset={offset + limit}",
+            "type": media_type,
+        }
+    ]
+
+
 @app.before_request
 def add_uuid_to_request():
     flask.request.req_id = uuid.uuid4()
@@ -131,7 +346,10 @@ def handle_exception(e):
     if not issubclass(type(e), (OpenEOError, OpenEOProcessError, SHOpenEOError)):
         e = Internal(str(e))
 
-    return flask.make_response(jsonify(id=e.record_id, code=e.error_code, message=e.message, links=[]), e.http_code)
+    response = flask.make_response(jsonify(id=e.record_id, code=e.error_code, message=e.message, links=[]), e.http_code)
+    if getattr(e, "retry_after", None) is not None:
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response
 
 
 @app.route("/", methods=["GET"])
@@ -415,8 +633,13 @@ def api_jobs():
         jobs = []
         links = []
 
-        for record in JobsPersistence.query_by_user_id(g.user.user_id):
-            status, _ = get_batch_job_status(record["batch_request_id"], record["deployment_endpoint"])
+        # jobs are paginated by the id of the last job of the previous page
+        limit = get_limit_parameter()
+        records, last_job_id = JobsPersistence.query_list_by_user_id(
+            g.user.user_id, limit=limit, after_job_id=flask.request.args.get("after")
+        )
+        for record in records:
+            status, _ = get_batch_job_status(record, post_process=False)
 
             jobs.append(
                 {
@@ -435,6 +658,15 @@ def api_jobs():
                 link_to_job["title"] = record["title"]
             links.append(link_to_job)
 
+        if last_job_id is not None:
+            links.append(
+                {
+                    "rel": "next",
+                    "href": f"{flask.request.base_url}?limit={limit}&after={last_job_id}",
+                    "type": "application/json",
+                }
+            )
+
         return {
             "jobs": jobs,
             "links": links,
@@ -464,6 +696,8 @@ def api_jobs():
         data["deployment_endpoint"] = deployment_endpoint
 
         record_id = JobsPersistence.create(data)
+        # Sentinel Hub analysis of the batch request takes a while, so the estimation is started right away
+        start_batch_job_estimation(record_id)
 
         # add requested headers to 201 response:
         response = flask.make_response("", 201)
@@ -481,7 +715,7 @@ def api_batch_job(job_id):
         raise JobNotFound()
 
     if flask.request.method == "GET":
-        status, error = get_batch_job_status(job["batch_request_id"], job["deployment_endpoint"])
+        status, error = get_batch_job_status(job)
         data_to_jsonify = {
             "id": job_id,
             "title": job.get("title", None),
@@ -511,7 +745,7 @@ def api_batch_job(job_id):
         )
 
     elif flask.request.method == "PATCH":
-        status, _ = get_batch_job_status(job["batch_request_id"], job["deployment_endpoint"])
+        status, _ = get_batch_job_status(job, post_process=False)
 
         if status in [openEOBatchJobStatus.QUEUED, openEOBatchJobStatus.RUNNING]:
             raise JobLocked()
@@ -524,37 +758,29 @@ def api_batch_job(job_id):
                     jsonify(id=None, code=400, message=errors.get("process").get("process_graph")[0], links=[]), 400
                 )
 
+        # all changes of the job are saved at once
+        process_changed = False
         if data.get("process"):
             new_batch_request_id, deployment_endpoint = modify_batch_job(data["process"])
-            update_batch_request_id(job_id, job, new_batch_request_id)
             data["deployment_endpoint"] = deployment_endpoint
 
-            if json.dumps(data.get("process"), sort_keys=True) != json.dumps(
+            process_changed = json.dumps(data.get("process"), sort_keys=True) != json.dumps(
                 json.loads(job.get("process")), sort_keys=True
-            ):
-                estimated_sentinelhub_pu, estimated_file_size = get_batch_job_estimate(
-                    new_batch_request_id, data.get("process"), deployment_endpoint
-                )
-                estimated_platform_credits = round(
-                    estimated_sentinelhub_pu * SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE, 3
-                )
-                JobsPersistence.update_key(
-                    job["id"], "estimated_sentinelhub_pu", str(round(estimated_sentinelhub_pu, 3))
-                )
-                JobsPersistence.update_key(job["id"], "estimated_platform_credits", str(estimated_platform_credits))
-                JobsPersistence.update_key(job["id"], "estimated_file_size", str(estimated_file_size))
+            )
+            if process_changed:
+                data.update(get_reset_estimate_fields())
+            update_batch_request_id(job_id, job, new_batch_request_id, fields=data)
+        else:
+            JobsPersistence.update_fields(job_id, data)
 
-        for key in data:
-            JobsPersistence.update_key(job_id, key, data[key])
+        if process_changed:
+            start_batch_job_estimation(job_id)
 
         return flask.make_response("Changes to the job applied successfully.", 204)
 
     elif flask.request.method == "DELETE":
-        bucket = get_bucket(job["deployment_endpoint"])
-        results = bucket.get_data_from_bucket(prefix=job["batch_request_id"])
-        bucket.delete_objects(results)
-
-        JobsPersistence.delete(job_id)
+        # results (of all batch requests of the job) are deleted in the background, the job once they are deleted
+        start_results_purge(job)
         return flask.make_response("The job has been successfully deleted.", 204)
 
 
@@ -573,6 +799,9 @@ def add_job_to_queue(job_id):
 
         if new_batch_request_id and new_batch_request_id != job["batch_request_id"]:
             update_batch_request_id(job_id, job, new_batch_request_id)
+            # Sentinel Hub analyses the new batch request before processing it, so its estimate is saved later
+            # (unless the job already has one), once the job references the new batch request
+            start_batch_job_estimation(job_id, delay=BATCH_ESTIMATE_CHECK_INTERVAL)
 
         # can we create a /results_metadata.json file already here?
         # we don't have the contents of the folder yet to create presigned URLs
@@ -581,64 +810,32 @@ def add_job_to_queue(job_id):
         return flask.make_response("The creation of the resource has been queued successfully.", 202)
 
     elif flask.request.method == "GET":
-        status, error = get_batch_job_status(job["batch_request_id"], job["deployment_endpoint"])
-
-        if status not in [
-            openEOBatchJobStatus.FINISHED,
-            openEOBatchJobStatus.ERROR,
-        ]:
-            raise JobNotFinished()
-
-        if status == openEOBatchJobStatus.ERROR:
-            return flask.make_response(jsonify(id=job_id, code=424, level="error", message=error, links=[]), 424)
+        error_response = get_job_results_error_response(job)
+        if error_response is not None:
+            return error_response
 
+        limit, offset = get_page_parameters()
         bucket = get_bucket(job["deployment_endpoint"])
+        job_results = get_job_results(job, bucket)
+        result_assets = job_results["assets"]
+        time_valid_iso8601 = job_results["expires"]
 
-        # naively generate dummy metadata.json in the bucket so that it will already be
-        # in the response of first bucket.get_data_from_bucket() call
-        # and the code for generating presigned urls can stay the same
-        metadata_filename = "metadata.json"
-        bucket.put_file_to_bucket("", prefix=job["batch_request_id"], file_name=metadata_filename)
-
-        # START OF POST_PROCESSING
-        # post-process gtiffs to appropriate formats
-
-        parse_sh_gtiff_to_format(job, bucket)
-
-        # END OF POST_PROCESSING
-
-        results = bucket.get_data_from_bucket(prefix=job["batch_request_id"])
-        log(INFO, f"Fetched all results: {str(results)}")
-
-        assets = {}
-        links = []
-        metadata_valid = None
-        for result in results:
-            # do not add json file created by SH batch job API to the list of assets
-            sh_batch_job_json_filename = f"request-{job['batch_request_id']}.json"
-            if sh_batch_job_json_filename in result["Key"]:
-                continue
-
-            # create signed url:
-            object_key = result["Key"]
-            url = bucket.generate_presigned_url(object_key=object_key)
-
-            parsed_url = urlparse(url)
-            parsed_query = parse_qs(parsed_url.query)
-            time_url_generated = datetime.strptime(parsed_query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ")
-            time_expires = timedelta(seconds=int(parsed_query["X-Amz-Expires"][0]))
-            time_valid = time_url_generated + time_expires
-            time_valid_iso8601 = time_valid.strftime(ISO8601_UTC_FORMAT)
+        # only assets of the requested page are signed
+        assets = create_job_result_assets(job_id, bucket, job_results, get_page(result_assets, limit, offset))
+        links = [
+            {
+                "rel": "items",
+                "href": f"{flask.request.url_root}jobs/{job_id}/results/items",
+                "type": "application/json",
+            },
+            *get_page_links(limit, offset, len(result_assets)),
+        ]
 
+        metadata_filename = "metadata.json"
+        if limit is None:
             # add signed url (that links to metadata) to links with rel type "canonical"
-            if metadata_filename in result["Key"]:
-                metadata_valid = time_valid_iso8601
-                links.append(
-                    {"href": url, "rel": "canonical", "type": "application/json", "expires": time_valid_iso8601}
-                )
-            else:
-                roles = get_roles(object_key)
-                assets[object_key] = {"href": url, "roles": roles, "expires": time_valid_iso8601}
+            url = get_presigned_url(job_results, bucket, f"{job['batch_request_id']}/{metadata_filename}")
+            links.append({"href": url, "rel": "canonical", "type": "application/json", "expires": time_valid_iso8601})
 
         # we can create a /results_metadata.json file here
         # the contents of the batch job folder in the bucket isn't revealed anywhere else anyway
@@ -655,7 +852,7 @@ def add_job_to_queue(job_id):
             "properties": {
                 "title": job.get("title", None),
                 "datetime": metadata_creation_time,
-                "expires": metadata_valid,
+                "expires": time_valid_iso8601,
                 "usage": {
                     "Platform credits": {"unit": "credits", "value": job.get("estimated_platform_credits", 0)},
                     "Sentinel Hub": {
@@ -669,11 +866,13 @@ def add_job_to_queue(job_id):
             "assets": assets,
         }
 
-        # boto3 put_object() used in this method simply overwrites existing file
-        # no need to check if file already exists
-        bucket.put_file_to_bucket(
-            json.dumps(batch_job_metadata), prefix=job["batch_request_id"], file_name=metadata_filename
-        )
+        if limit is None and not job_results.get("metadata_saved"):
+            # boto3 put_object() used in this method simply overwrites existing file
+            # no need to check if file already exists
+            bucket.put_file_to_bucket(
+                json.dumps(batch_job_metadata), prefix=job["batch_request_id"], file_name=metadata_filename
+            )
+            job_results["metadata_saved"] = True
 
         return flask.make_response(jsonify(batch_job_metadata), 200)
 
@@ -682,13 +881,103 @@ def add_job_to_queue(job_id):
             job["batch_request_id"], json.loads(job["process"]), job["deployment_endpoint"]
         )
         if new_batch_request_id:
-            JobsPersistence.update_key(job_id, "batch_request_id", new_batch_request_id)
-            JobsPersistence.update_key(
+            update_batch_request_id(job_id, job, new_batch_request_id)
+        return flask.make_response("Processing the job has been successfully canceled.", 204)
+
+
+@app.route("/jobs/<job_id>/results/items", methods=["GET"])
+@authentication_provider.with_bearer_auth
+@with_logging
+def get_job_result_items(job_id):
+    """
+    Lists results of the job as STAC items, one per tile. Items can be paginated with `limit` and `offset`.
+    """
+    job = JobsPersistence.get_by_id(job_id)
+    if job is None or job["user_id"] != g.user.user_id:
+        raise JobNotFound()
+
+    error_response = get_job_results_error_response(job)
+    if error_response is not None:
+        return error_response
+
+    limit, offset = get_page_parameters()
+    bucket = get_bucket(job["deployment_endpoint"])
+    job_results = get_job_results(job, bucket)
+    items = list(group_job_result_items(job["batch_request_id"], job_results["assets"]).items())
+    geometry, bbox = get_spatial_extent_geometry(json.loads(job["process"])["process_graph"])
+    job_result_items = {
+        "type": "FeatureCollection",
+        "features": [
+            create_job_result_item(
                 job_id,
-                "previous_batch_request_ids",
-                [*json.loads(job["previous_batch_request_ids"]), job["batch_request_id"]],
+                item_id,
+                create_job_result_assets(job_id, bucket, job_results, item_assets),
+                job_results["expires"],
+                geometry=geometry,
+                bbox=bbox,
             )
-        return flask.make_response("Processing the job has been successfully canceled.", 204)
+            for item_id, item_assets in get_page(items, limit, offset)
+        ],
+        "links": get_page_links(limit, offset, len(items), media_type="application/geo+json"),
+    }
+    return flask.make_response(jsonify(job_result_items), 200)
+
+
+@app.route("/jobs/<job_id>/results/items/<item_id>", methods=["GET"])
+@authentication_provider.with_bearer_auth
+@with_logging
+def get_job_result_item(job_id, item_id):
+    job = JobsPersistence.get_by_id(job_id)
+    if job is None or job["user_id"] != g.user.user_id:
+        raise JobNotFound()
+
+    error_response = get_job_results_error_response(job)
+    if error_response is not None:
+        return error_response
+
+    bucket = get_bucket(job["deployment_endpoint"])
+    job_results = get_job_results(job, bucket)
+    items = group_job_result_items(job["batch_request_id"], job_results["assets"])
+    if item_id not in items:
+        raise ItemNotFound()
+
+    geometry, bbox = get_spatial_extent_geometry(json.loads(job["process"])["process_graph"])
+    job_result_item = create_job_result_item(
+        job_id,
+        item_id,
+        create_job_result_assets(job_id, bucket, job_results, items[item_id]),
+        job_results["expires"],
+        geometry=geometry,
+        bbox=bbox,
+    )
+    return flask.make_response(jsonify(job_result_item), 200)
+
+
+@app.route("/jobs/<job_id>/results/assets/<path:object_key>", methods=["GET"])
+@authentication_provider.with_bearer_auth
+@with_logging
+def get_job_results_asset(job_id, object_key):
+    """
+    Redirects to a signed URL of an object of job results. Zarr stores are listed as single assets, so that
+    clients can open them lazily and read objects (metadata and chunks) of the stores one by one.
+    """
+    job = JobsPersistence.get_by_id(job_id)
+    if job is None or job["user_id"] != g.user.user_id:
+        raise JobNotFound()
+
+    # only objects of the job's own results can be signed
+    if not object_key.startswith(f"{job['batch_request_id']}/") or any(
+        part in ["", ".", ".."] for part in object_key.split("/")
+    ):
+        raise AssetNotFound()
+
+    # results can only be downloaded once they are complete, as with /results
+    error_response = get_job_results_error_response(job)
+    if error_response is not None:
+        return error_response
+
+    bucket = get_bucket(job["deployment_endpoint"])
+    return flask.redirect(bucket.generate_presigned_url(object_key=object_key), code=302)
 
 
 @app.route("/jobs/<job_id>/estimate", methods=["GET"])
@@ -699,9 +988,14 @@ def estimate_job_cost(job_id):
     if job is None:
         raise JobNotFound()
 
-    estimated_sentinelhub_pu, _, estimated_file_size = create_or_get_estimate_values_from_db(
-        job, job["batch_request_id"]
-    )
+    try:
+        estimated_sentinelhub_pu, _, estimated_file_size = create_or_get_estimate_values_from_db(
+            job, job["batch_request_id"]
+        )
+    except EstimateNotReady as e:
+        response = flask.make_response(jsonify(id=job_id, message=e.message), e.http_code)
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
 
     return flask.make_response(
         jsonify(costs=estimated_sentinelhub_pu, size=estimated_file_size),
@@ -828,20 +1122,32 @@ def api_service(service_id):
                 data["process"]["process_graph"]
             )
 
-        for key in data:
-            ServicesPersistence.update_key(service_id, key, data[key])
+        ServicesPersistence.update_fields(service_id, data)
+        service_records_cache.delete(service_id)
 
         return flask.make_response("Changes to the service applied successfully.", 204)
 
     elif flask.request.method == "DELETE":
         ServicesPersistence.delete(service_id)
+        service_records_cache.delete(service_id)
         return flask.make_response("The service has been successfully deleted.", 204)
 
 
+def get_service_record(service_id):
+    """
+    Returns the record of the service (None if it doesn't exist) from the cache of service records.
+    """
+    record = service_records_cache.get(service_id, False)
+    if record is False:
+        record = ServicesPersistence.get_by_id(service_id)
+        service_records_cache.set(service_id, record)
+    return record
+
+
 @app.route("/service/xyz/<service_id>/<int:zoom>/<int:tx>/<int:ty>", methods=["GET"])
 @with_logging
 def api_execute_service(service_id, zoom, tx, ty):
-    record = ServicesPersistence.get_by_id(service_id)
+    record = get_service_record(service_id)
     if record is None or record["service_type"].lower() != "xyz":
         raise ServiceNotFound(service_id)
 
@@ -0,0 +1,102 @@
+"""
+Batch jobs poller periodically checks the statuses of all batch jobs which haven't reached a final state yet
+and saves them (together with errors) to the job records. With BATCH_JOBS_POLLER_ENABLED set to "true", the
+API then reads job statuses from the job records instead of asking Sentinel Hub on every request.
+Once a batch job is done, the poller also post-processes its results. It also resumes purges of results of deleted
+jobs which were interrupted.
+
+Run it as a separate process next to the API:
+    $ python batch_jobs_poller.py
+"""
+import time
+import traceback
+from collections import defaultdict
+from datetime import timedelta, timezone
+from logging import log, INFO, ERROR
+
+from sentinelhub.exceptions import DownloadFailedException
+from sentinelhub.time_utils import parse_time
+
+from authentication.user import User
+from buckets import resume_results_purges
+from const import openEOBatchJobStatus
+from dynamodb import JobsPersistence
+from processing.const import BATCH_JOBS_POLLER_INTERVAL
+from processing.processing import (
+    get_status_from_batch_request_info,
+    save_batch_job_status,
+    get_status_after_post_processing,
+)
+from processing.sentinel_hub import SentinelHub
+
+
+# batch requests are listed back to the creation of the oldest job, its batch request was created just before it
+BATCH_REQUEST_CREATED_MARGIN = timedelta(minutes=10)
+
+
+def get_batch_requests(sentinel_hub, jobs):
+    """
+    Returns a dict of batch requests of given jobs. Batch requests are listed in bulk, those which can't be listed
+    (e.g. because they were created by Sentinel Hub users with their own accounts) are fetched one by one.
+    """
+    batch_request_ids = [job["batch_request_id"] for job in jobs]
+    oldest_job_created = min(parse_time(job["created"]) for job in jobs)
+    if oldest_job_created.tzinfo is None:
+        oldest_job_created = oldest_job_created.replace(tzinfo=timezone.utc)
+    created_after = oldest_job_created - BATCH_REQUEST_CREATED_MARGIN
+
+    batch_requests = {}
+    try:
+        for batch_request in sentinel_hub.iter_batch_requests(batch_request_ids, created_after=created_after):
+            batch_requests[batch_request.request_id] = batch_request
+    except DownloadFailedException:
+        log(ERROR, f"Listing batch requests failed: {traceback.format_exc()}")
+
+    for batch_request_id in batch_request_ids:
+        if batch_request_id not in batch_requests:
+            batch_requests[batch_request_id] = sentinel_hub.get_batch_request_info(batch_request_id)
+
+    return batch_requests
+
+
+def poll_batch_jobs():
+    jobs_by_deployment = defaultdict(list)
+    for job in JobsPersistence.scan_jobs_without_final_status():
+        jobs_by_deployment[job["deployment_endpoint"]].append(job)
+
+    for deployment_endpoint, jobs in jobs_by_deployment.items():
+        sentinel_hub = SentinelHub(user=User(), service_base_url=deployment_endpoint)
+        batch_requests = get_batch_requests(sentinel_hub, jobs)
+
+        for job in jobs:
+            batch_request_info = batch_requests[job["batch_request_id"]]
+            # we can't tell a deleted batch request apart from a failed request, so we leave such jobs to the API
+            if batch_request_info is None:
+                continue
+
+            status, error, is_final = get_status_from_batch_request_info(batch_request_info)
+            save_batch_job_status(job, status, error, is_final)
+
+            if status == openEOBatchJobStatus.FINISHED and is_final:
+                get_status_after_post_processing(job)
+
+        log(INFO, f"Polled {len(jobs)} batch jobs on {deployment_endpoint}.")
+
+
+def run():
+    log(INFO, f"Starting batch jobs poller (interval: {BATCH_JOBS_POLLER_INTERVAL}s).")
+    while True:
+        started = time.monotonic()
+        try:
+            poll_batch_jobs()
+        except Exception:
+            log(ERROR, f"Polling batch jobs failed: {traceback.format_exc()}")
+        try:
+            resume_results_purges()
+        except Exception:
+            log(ERROR, f"Resuming purges of results failed: {traceback.format_exc()}")
+        time.sleep(max(0, BATCH_JOBS_POLLER_INTERVAL - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    run()
@@ -1 +1,2 @@
 from .utils import get_bucket, BUCKET_NAMES
+from .purge import start_results_purge, resume_results_purges
@@ -0,0 +1,84 @@
+import datetime
+import json
+import os
+from logging import log, INFO, ERROR
+
+from dynamodb import JobsPersistence
+from utils import BackgroundTasks
+from .utils import get_bucket
+
+
+# Number of threads which delete results of deleted jobs in the background
+PURGE_WORKERS = int(os.environ.get("PURGE_WORKERS", "2"))
+# Number of delete requests (of up to 1000 objects each) which are sent for the same job at the same time
+PURGE_DELETE_CONCURRENCY = int(os.environ.get("PURGE_DELETE_CONCURRENCY", "8"))
+# Purges of results which couldn't be deleted completely are run again after this many seconds
+PURGE_RETRY_DELAY = int(os.environ.get("PURGE_RETRY_DELAY", "300"))
+
+purge_tasks = BackgroundTasks(max_workers=PURGE_WORKERS)
+
+
+def get_job_batch_request_ids(job):
+    """
+    Returns ids of all batch requests of the job, results of earlier runs are kept under their own prefixes.
+    """
+    return [*json.loads(job.get("previous_batch_request_ids") or "[]"), job["batch_request_id"]]
+
+
+def purge_results(deployment_endpoint, batch_request_ids):
+    """
+    Deletes results of the batch requests. Returns the number of objects which couldn't be deleted.
+    """
+    bucket = get_bucket(deployment_endpoint)
+    n_failed = 0
+    for batch_request_id in batch_request_ids:
+        results = bucket.get_data_from_bucket(prefix=f"{batch_request_id}/")
+        n_failed_of_batch_request = bucket.delete_objects(results, max_workers=PURGE_DELETE_CONCURRENCY)
+        n_failed += n_failed_of_batch_request
+        log(
+            INFO,
+            f"Purged {len(results) - n_failed_of_batch_request} of {len(results)} objects of results of batch request "
+            f"{batch_request_id}.",
+        )
+    return n_failed
+
+
+def purge_job(job_id, deployment_endpoint, batch_request_ids):
+    """
+    Purges results of the deleted job and deletes the job once all of them are deleted. Results which couldn't
+    be deleted are purged again later.
+    """
+    n_failed = purge_results(deployment_endpoint, batch_request_ids)
+    if n_failed > 0:
+        log(ERROR, f"{n_failed} objects of results of job {job_id} couldn't be deleted, retrying later.")
+        return PURGE_RETRY_DELAY
+
+    JobsPersistence.delete(job_id)
+
+
+def submit_results_purge(job):
+    purge_tasks.submit(
+        f"purge-{job['id']}", purge_job, job["id"], job["deployment_endpoint"], get_job_batch_request_ids(job)
+    )
+
+
+def start_results_purge(job):
+    """
+    Deletes the job and results of all of its batch requests in the background. Until all results are deleted,
+    the job is only hidden from its user, so that the purge can be resumed (see `resume_results_purges`).
+    """
+    JobsPersistence.mark_purge_pending(job["id"])
+    submit_results_purge(job)
+
+
+def resume_results_purges():
+    """
+    Resumes purges of deleted jobs which were interrupted (e.g. because the process which ran them stopped).
+    Jobs deleted less than PURGE_RETRY_DELAY ago are left to the process which deleted them.
+    """
+    deleted_before = (
+        datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=PURGE_RETRY_DELAY)
+    ).isoformat()
+    for job in JobsPersistence.query_purge_pending():
+        if job["last_updated"] < deleted_before:
+            submit_results_purge(job)
@@ -1,32 +1,83 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from logging import log, ERROR
+from urllib.parse import urlparse
+
 import boto3
 from botocore.client import Config
 
+# Maximum number of connections which the S3 client of a bucket keeps open (shared by all threads)
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "50"))
+# Maximum number of attempts of S3 requests, with adaptive retries (client-side rate limiting when throttled)
+S3_MAX_ATTEMPTS = int(os.environ.get("S3_MAX_ATTEMPTS", "5"))
+# Objects which couldn't be deleted are deleted again with exponential backoff, up to this many attempts in total
+DELETE_MAX_ATTEMPTS = int(os.environ.get("S3_DELETE_MAX_ATTEMPTS", "4"))
+DELETE_RETRY_DELAY = 1  # seconds
+
+# buckets restored in other processes (e.g. conversion processes) are reused by all tasks of the process
+restored_buckets = {}
+restored_buckets_lock = threading.Lock()
+
+
+def restore_bucket(bucket_class, init_args):
+    with restored_buckets_lock:
+        key = (bucket_class, init_args)
+        if key not in restored_buckets:
+            restored_buckets[key] = bucket_class(*init_args)
+        return restored_buckets[key]
+
 
 class ResultsBucket:
+    # equals 7 days, part of federation agreement
+    PRESIGNED_URL_EXPIRATION = 604800  # seconds
+    # S3 deletes at most this many objects in one request
+    MAX_DELETE_OBJECTS = 1000
+
     def __init__(self, bucket_name, region_name, endpoint_url, access_key_id, secret_access_key):
+        self.init_args = (bucket_name, region_name, endpoint_url, access_key_id, secret_access_key)
         self.bucket_name = bucket_name
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
         self.client = s3 = boto3.client(
             "s3",
             region_name=region_name,
             endpoint_url=endpoint_url,
             aws_access_key_id=access_key_id,
             aws_secret_access_key=secret_access_key,
-            config=Config(signature_version="s3v4"),
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+            ),
         )
 
+    def __reduce__(self):
+        # boto3 clients can't be pickled, bucket is created again (e.g. when it is passed to another process)
+        return (restore_bucket, (self.__class__, self.init_args))
+
     def put_file_to_bucket(self, content_as_string, prefix=None, file_name="file"):
         file_path = prefix + "/" + file_name if prefix else file_name
 
         self.client.put_object(Bucket=self.bucket_name, Key=file_path, Body=content_as_string)
 
-    def upload_file_to_bucket(self, local_file_path, prefix=None, file_name="file"):
+    def upload_file_to_bucket(self, local_file_path, prefix=None, file_name="file", transfer_config=None):
         s3_file_path = prefix + "/" + file_name if prefix else file_name
 
-        self.client.upload_file(local_file_path, self.bucket_name, s3_file_path)
+        self.client.upload_file(local_file_path, self.bucket_name, s3_file_path, Config=transfer_config)
 
-    def get_data_from_bucket(self, prefix=None):
+    def get_data_from_bucket(self, prefix=None, max_keys=None):
+        """
+        Lists objects under `prefix`, only the first page of (at most `max_keys`) objects if `max_keys` is given.
+        """
         continuation_token = None
         results = []
+        page_options = {} if max_keys is None else {"MaxKeys": max_keys}
 
         while True:
             if continuation_token:
@@ -34,21 +85,52 @@ class ResultsBucket:
                     Bucket=self.bucket_name, Prefix=prefix, ContinuationToken=continuation_token
                 )
             else:
-                response = self.client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
+                response = self.client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix, **page_options)
             if response.get("Contents"):
                 results.extend(response["Contents"])
-            if response["IsTruncated"]:
+            if response["IsTruncated"] and max_keys is None:
                 continuation_token = response["NextContinuationToken"]
             else:
                 break
 
         return results
 
-    def delete_objects(self, objects_to_delete):
-        if len(objects_to_delete) == 0:
-            return
-        object_keys_to_delete = {"Objects": [{"Key": obj["Key"]} for obj in objects_to_delete]}
-        self.client.delete_objects(Bucket=self.bucket_name, Delete=object_keys_to_delete)
+    def delete_objects(self, objects_to_delete, max_workers=1, max_attempts=DELETE_MAX_ATTEMPTS):
+        """
+        Deletes objects in requests of at most MAX_DELETE_OBJECTS objects, `max_workers` requests at the same time.
+        Objects which couldn't be deleted are retried, `max_attempts` times in total. Returns the number of objects
+        which couldn't be deleted.
+        """
+        for attempt in range(max_attempts):
+            if len(objects_to_delete) == 0:
+                return 0
+            if attempt > 0:
+                time.sleep(DELETE_RETRY_DELAY * 2 ** (attempt - 1))
+            batches = [
+                objects_to_delete[i : i + self.MAX_DELETE_OBJECTS]
+                for i in range(0, len(objects_to_delete), self.MAX_DELETE_OBJECTS)
+            ]
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                objects_to_delete = [
+                    obj for failed in executor.map(self._delete_objects_batch, batches) for obj in failed
+                ]
+        return len(objects_to_delete)
+
+    def _delete_objects_batch(self, objects_to_delete):
+        """
+        Returns objects which couldn't be deleted.
+        """
+        object_keys_to_delete = {"Objects": [{"Key": obj["Key"]} for obj in objects_to_delete], "Quiet": True}
+        try:
+            response = self.client.delete_objects(Bucket=self.bucket_name, Delete=object_keys_to_delete)
+        except Exception:
+            log(ERROR, f"Deleting {len(objects_to_delete)} objects failed: {traceback.format_exc()}")
+            return objects_to_delete
+
+        errors = response.get("Errors", [])
+        if errors:
+            log(ERROR, f"Deleting {len(errors)} objects failed, e.g. {errors[0]['Key']}: {errors[0]['Message']}")
+        return [{"Key": error["Key"]} for error in errors]
 
     def generate_presigned_url(self, object_key=None):
         return self.client.generate_presigned_url(
@@ -57,9 +139,38 @@ class ResultsBucket:
                 "Bucket": self.bucket_name,
                 "Key": object_key,
             },
-            ExpiresIn=604800,  # equals 7 days, part of federation agreement
+            ExpiresIn=self.PRESIGNED_URL_EXPIRATION,
         )
 
+    def get_json_object(self, object_key):
+        response = self.client.get_object(Bucket=self.bucket_name, Key=object_key)
+        return json.loads(response["Body"].read())
+
+    def get_gdal_path(self, object_key):
+        return f"/vsis3/{self.bucket_name}/{object_key}"
+
+    def get_gdal_config(self):
+        """
+        Returns GDAL config options for reading objects of the bucket through GDAL's S3 virtual file system
+        (paths from `get_gdal_path`), which fetches only the needed parts of files with ranged requests.
+        """
+        config = {
+            "AWS_ACCESS_KEY_ID": self.access_key_id,
+            "AWS_SECRET_ACCESS_KEY": self.secret_access_key,
+            "AWS_REGION": self.region_name,
+            # don't list the "directory" of the file when opening it
+            "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+            "GDAL_HTTP_MULTIRANGE": "YES",
+            "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+            "VSI_CACHE": "TRUE",
+        }
+        if self.endpoint_url:
+            endpoint_url = urlparse(self.endpoint_url)
+            config["AWS_S3_ENDPOINT"] = endpoint_url.netloc
+            config["AWS_HTTPS"] = "YES" if endpoint_url.scheme == "https" else "NO"
+            config["AWS_VIRTUAL_HOSTING"] = "FALSE"
+        return {key: value for key, value in config.items() if value is not None}
+
 
 class CreodiasResultsBucket(ResultsBucket):
     def __init__(self, bucket_name, region_name, endpoint_url, access_key_id, secret_access_key):
@@ -1,4 +1,5 @@
 import os
+import threading
 import warnings
 
 from const import SentinelhubDeployments
@@ -37,7 +38,19 @@ BUCKET_SECRET_ACCESS_KEYS = {
 }
 
 
+# boto3 clients are thread-safe, buckets (and their pools of connections) are shared by all threads
+buckets = {}
+buckets_lock = threading.Lock()
+
+
 def get_bucket(deployment_endpoint):
+    with buckets_lock:
+        if deployment_endpoint not in buckets:
+            buckets[deployment_endpoint] = create_bucket(deployment_endpoint)
+        return buckets[deployment_endpoint]
+
+
+def create_bucket(deployment_endpoint):
     bucket_name = BUCKET_NAMES[deployment_endpoint]
     region_name = BUCKET_REGION_NAMES[deployment_endpoint]
     endpoint_url = BUCKET_ENDPOINT_URLS[deployment_endpoint]
@@ -0,0 +1,105 @@
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+
+class BucketZarrStore(MutableMapping):
+    """
+    Zarr store which writes directly to the results bucket, under `prefix`. Objects are uploaded by `max_workers`
+    threads in the background and served from memory until they are uploaded. `flush` has to be called once the
+    store is written, it waits for all uploads.
+    """
+
+    def __init__(self, bucket, prefix, max_workers=8):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        # values which haven't been uploaded yet
+        self._pending = {}
+        # the same object can be written again (e.g. when a chunk is written in parts) before it is uploaded,
+        # uploads of the same object are serialized so that the last value wins
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        # bounds the memory used by values waiting to be uploaded
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}"
+
+    def _upload(self, key):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                with self._lock:
+                    value = self._pending.get(key)
+                # newer value was already uploaded by the previous upload of the same object
+                if value is None:
+                    return
+                self.bucket.client.put_object(Bucket=self.bucket.bucket_name, Key=self._object_key(key), Body=value)
+                with self._lock:
+                    if self._pending.get(key) is value:
+                        del self._pending[key]
+        finally:
+            self._slots.release()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+        try:
+            response = self.bucket.client.get_object(Bucket=self.bucket.bucket_name, Key=self._object_key(key))
+        except self.bucket.client.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return response["Body"].read()
+
+    def __setitem__(self, key, value):
+        self._slots.acquire()
+        with self._lock:
+            self._pending[key] = bytes(value)
+            self._futures.append(self._executor.submit(self._upload, key))
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+        self.bucket.client.delete_object(Bucket=self.bucket.bucket_name, Key=self._object_key(key))
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._pending:
+                return True
+        try:
+            self.bucket.client.head_object(Bucket=self.bucket.bucket_name, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                return False
+            raise
+
+    def __iter__(self):
+        with self._lock:
+            keys = set(self._pending)
+        for result in self.bucket.get_data_from_bucket(prefix=f"{self.prefix}/"):
+            keys.add(result["Key"][len(self.prefix) + 1 :])
+        return iter(keys)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def flush(self):
+        """
+        Waits for all uploads and raises the error of the first one which failed.
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
@@ -1 +1,7 @@
-from .dynamodb import JobsPersistence, ProcessGraphsPersistence, ServicesPersistence
+from .dynamodb import (
+    JobsPersistence,
+    ProcessGraphsPersistence,
+    ServicesPersistence,
+    PostProcessingStatus,
+    PostProcessingTasksPersistence,
+)
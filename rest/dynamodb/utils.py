@@ -1,8 +1,25 @@
+import copy
+import os
+from functools import lru_cache
+
 from flask import g
+from pg_to_evalscript import list_supported_processes
 
+from utils import TTLCache
 from .dynamodb import ProcessGraphsPersistence
 
 
+# Entries of the cache of user-defined processes are valid until user's processes change, TTL is just a safety net
+USER_DEFINED_PROCESSES_CACHE_TTL = int(os.environ.get("USER_DEFINED_PROCESSES_CACHE_TTL", "600"))
+USER_DEFINED_PROCESSES_CACHE_MAX_SIZE = int(os.environ.get("USER_DEFINED_PROCESSES_CACHE_MAX_SIZE", "1000"))
+
+# user-defined processes of each user by their ids (None for ids which aren't user's processes),
+# cached under the version of user's processes
+user_defined_processes_cache = TTLCache(
+    ttl=USER_DEFINED_PROCESSES_CACHE_TTL, max_size=USER_DEFINED_PROCESSES_CACHE_MAX_SIZE
+)
+
+
 def get_all_user_defined_processes():
     all_user_defined_processes = []
     if "user" in g:
@@ -11,9 +28,81 @@ def get_all_user_defined_processes():
     return all_user_defined_processes
 
 
-def get_user_defined_processes_graphs():
+@lru_cache(maxsize=None)
+def get_predefined_process_ids():
+    return frozenset(list_supported_processes())
+
+
+def get_process_ids(value):
+    """
+    Returns ids of all processes used in the process graph (or any part of it), including processes of callbacks.
+    """
+    process_ids = set()
+    if isinstance(value, dict):
+        if isinstance(value.get("process_id"), str):
+            process_ids.add(value["process_id"])
+        for nested_value in value.values():
+            process_ids.update(get_process_ids(nested_value))
+    elif isinstance(value, list):
+        for nested_value in value:
+            process_ids.update(get_process_ids(nested_value))
+    return process_ids
+
+
+def get_cached_user_defined_processes(user_id):
+    """
+    Returns the cache of user's user-defined processes for the current version of them. The version is read
+    once per request.
+    """
+    if "user_defined_processes_version" not in g:
+        g.user_defined_processes_version = ProcessGraphsPersistence.get_version(user_id)
+
+    cache_key = (user_id, g.user_defined_processes_version)
+    cached_processes = user_defined_processes_cache.get(cache_key)
+    if cached_processes is None:
+        cached_processes = {}
+        user_defined_processes_cache.set(cache_key, cached_processes)
+    return cached_processes
+
+
+def get_user_defined_processes(process_graph):
+    """
+    Returns the user's user-defined processes which are used by the process graph, directly or through other
+    user-defined processes. Only processes which are not predefined are looked up, processes which are not cached
+    yet are read with one batch read per level of nesting.
+    """
+    user_defined_processes = {}
+    if "user" not in g:
+        return []
+
+    user_id = g.user.user_id
+    cached_processes = get_cached_user_defined_processes(user_id)
+    looked_up_process_ids = set()
+    process_ids = get_process_ids(process_graph) - get_predefined_process_ids()
+    while process_ids:
+        looked_up_process_ids.update(process_ids)
+        missing_process_ids = [process_id for process_id in process_ids if process_id not in cached_processes]
+        if missing_process_ids:
+            records = {record["id"]: record for record in ProcessGraphsPersistence.batch_get(missing_process_ids)}
+            for process_id in missing_process_ids:
+                record = records.get(process_id)
+                # records of other users are ignored, even if the process graph refers to their ids
+                cached_processes[process_id] = record if record is not None and record["user_id"] == user_id else None
+
+        used_process_ids = set()
+        for process_id in process_ids:
+            record = cached_processes[process_id]
+            if record is not None:
+                user_defined_processes[process_id] = record
+                used_process_ids.update(get_process_ids(record["process_graph"]))
+        process_ids = used_process_ids - get_predefined_process_ids() - looked_up_process_ids
+
+    # callers modify process graphs, cached records must stay intact
+    return copy.deepcopy(list(user_defined_processes.values()))
+
+
+def get_user_defined_processes_graphs(process_graph):
     user_defined_processes_graphs = dict()
-    all_user_defined_processes = get_all_user_defined_processes()
-    for user_defined_process in all_user_defined_processes:
+    for user_defined_process in get_user_defined_processes(process_graph):
         user_defined_processes_graphs[user_defined_process["id"]] = user_defined_process["process_graph"]
     return user_defined_processes_graphs
@@ -48,6 +48,12 @@ class JobNotFound(OpenEOError):
     message = "The job does not exist."
 
 
+class AssetNotFound(OpenEOError):
+    error_code = "AssetNotFound"
+    http_code = 404
+    message = "The asset of job results does not exist."
+
+
 class JobLocked(OpenEOError):
     error_code = "JobLocked"
     http_code = 400
@@ -119,6 +125,12 @@ class ProcessGraphNotFound(SHOpenEOError):
     message = "Process graph does not exist."
 
 
+class ItemNotFound(SHOpenEOError):
+    error_code = "ItemNotFound"
+    http_code = 404
+    message = "Item of job results does not exist."
+
+
 class UnsupportedGeometry(SHOpenEOError):
     error_code = "UnsupportedGeometry"
     http_code = 400
@@ -171,3 +183,13 @@ class DataFusionNotPossibleDifferentSpatialExtents(SHOpenEOError):
     error_code = "DataFusionNotPossibleDifferentSpatialExtents"
     http_code = 400
     message = "Data fusion is possible only if all load_collection processes have the same spatial extent."
+
+
+class EstimateNotReady(SHOpenEOError):
+    # the estimate is being computed, clients should ask again after `retry_after` seconds (Retry-After header)
+    error_code = "EstimateNotReady"
+    http_code = 202
+    message = "The cost estimate of the batch job is not available yet. Please try again later."
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
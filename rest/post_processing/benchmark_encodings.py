@@ -0,0 +1,98 @@
+"""
+Benchmark of encodings of NetCDF and Zarr outputs. Converts the GeoTIFF of a batch request tile with each of
+the encoding profiles and reports size of the output, time of the conversion and time of reading one timestamp
+(spatial access) and all timestamps of a block of pixels (time series access).
+
+Run it from the `rest` folder (with env vars of the API set):
+    $ python -m post_processing.benchmark_encodings default.tif userdata.json
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import xarray as xr
+
+from processing.const import CustomMimeType
+from post_processing.const import parsed_output_file_name
+from post_processing.gtiff_parser import OUTPUT_VARIABLE_NAME, parse_multitemporal_gtiff_to_format
+
+
+ENCODING_PROFILES = {
+    "default": None,
+    "zlib-spatial": {"compression": "zlib", "compression_level": 4, "shuffle": True, "chunking": "spatial"},
+    "zlib-time-series": {"compression": "zlib", "compression_level": 4, "shuffle": True, "chunking": "time_series"},
+    "zstd-spatial": {"compression": "zstd", "compression_level": 4, "shuffle": True, "chunking": "spatial"},
+    "zstd-time-series": {"compression": "zstd", "compression_level": 4, "shuffle": True, "chunking": "time_series"},
+}
+# side of the block of pixels whose time series is read
+TIME_SERIES_BLOCK_SIZE = 16
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def open_output(path, output_format):
+    if output_format == CustomMimeType.ZARR:
+        return xr.open_zarr(path)[OUTPUT_VARIABLE_NAME]
+    return xr.open_dataset(path)[OUTPUT_VARIABLE_NAME]
+
+
+def time_read(array, **indexers):
+    start = time.perf_counter()
+    array.isel(**{dim: index for dim, index in indexers.items() if dim in array.dims}).values
+    return time.perf_counter() - start
+
+
+def benchmark(input_tiff, datacube_metadata, output_format, encoding_options, output_dir):
+    output_name = parsed_output_file_name[output_format]
+    start = time.perf_counter()
+    parse_multitemporal_gtiff_to_format(
+        input_tiff, datacube_metadata, output_dir, output_name, output_format, output_options=encoding_options
+    )
+    conversion_time = time.perf_counter() - start
+
+    # local Zarr stores are zipped, but the store is still in the output folder
+    output_path = os.path.join(output_dir, f"{output_name['name']}{output_name['ext']}")
+    array = open_output(output_path, output_format)
+    block = slice(0, TIME_SERIES_BLOCK_SIZE)
+    return {
+        "size": get_size(output_path),
+        "conversion": conversion_time,
+        "spatial read": time_read(array, t=0),
+        "time series read": time_read(array, y=block, x=block),
+    }
+
+
+def run():
+    arg_parser = argparse.ArgumentParser(description="Benchmark of encodings of NetCDF and Zarr outputs.")
+    arg_parser.add_argument("input_tiff", help="GeoTIFF of a batch request tile (default.tif)")
+    arg_parser.add_argument("metadata", help="metadata of the batch request tile (userdata.json)")
+    args = arg_parser.parse_args()
+
+    with open(args.metadata) as f:
+        datacube_metadata = json.load(f)
+
+    print(
+        f"{'format':8} {'profile':18} {'size [MB]':>10} {'conversion [s]':>15} {'spatial [s]':>12} {'series [s]':>11}"
+    )
+    for output_format in [CustomMimeType.NETCDF, CustomMimeType.ZARR]:
+        for profile, encoding_options in ENCODING_PROFILES.items():
+            output_dir = tempfile.mkdtemp(prefix="benchmark-encodings-")
+            try:
+                result = benchmark(args.input_tiff, datacube_metadata, output_format, encoding_options, output_dir)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            print(
+                f"{output_format.value:8} {profile:18} {result['size'] / 1024**2:10.1f} {result['conversion']:15.2f} "
+                f"{result['spatial read']:12.3f} {result['time series read']:11.3f}"
+            )
+
+
+if __name__ == "__main__":
+    run()
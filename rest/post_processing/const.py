@@ -1,3 +1,5 @@
+import os
+
 from sentinelhub import MimeType
 from processing.const import CustomMimeType
 
@@ -8,3 +10,35 @@ parsed_output_file_name = {
     CustomMimeType.ZARR: {"name": "output", "ext": ".zarr"},
     CustomMimeType.NETCDF: {"name": "output", "ext": ".nc"},
 }
+
+# Number of threads which post-process results of finished batch jobs in the background
+POST_PROCESSING_WORKERS = int(os.environ.get("POST_PROCESSING_WORKERS", "2"))
+# If post-processing doesn't report progress for this long (e.g. because its process died), it can be claimed again
+POST_PROCESSING_LEASE_DURATION = int(os.environ.get("POST_PROCESSING_LEASE_DURATION", "600"))  # seconds
+# While tiles are being converted or uploaded, the lease is extended this often (also when no tile completes)
+POST_PROCESSING_HEARTBEAT_INTERVAL = POST_PROCESSING_LEASE_DURATION / 4  # seconds
+# Number of processes which convert tiles of batch job results (shared by all post-processing threads)
+POST_PROCESSING_PROCESSES = int(os.environ.get("POST_PROCESSING_PROCESSES", str(os.cpu_count() or 1)))
+# Number of threads which write GeoTIFFs of different timestamps of the same tile
+GTIFF_WRITE_THREADS = int(os.environ.get("GTIFF_WRITE_THREADS", "4"))
+# With the queue enabled, tiles of finished batch jobs are only queued by the API / poller and converted by
+# post-processing workers (post_processing_worker.py), which can run on several nodes
+POST_PROCESSING_QUEUE_ENABLED = os.environ.get("POST_PROCESSING_QUEUE_ENABLED", "false").lower() == "true"
+# Number of attempts to post-process a queued tile before post-processing of the job fails
+POST_PROCESSING_TASK_MAX_ATTEMPTS = int(os.environ.get("POST_PROCESSING_TASK_MAX_ATTEMPTS", "3"))
+# How long post-processing workers wait before checking an empty queue again
+POST_PROCESSING_WORKER_POLL_INTERVAL = int(os.environ.get("POST_PROCESSING_WORKER_POLL_INTERVAL", "5"))  # seconds
+# Approximate amount of memory which converting a tile may use. NetCDF / Zarr data is written in windows of a quarter
+# of this size (a window is held in memory several times while it is being encoded) and GDAL caches at most a quarter
+POST_PROCESSING_MEMORY_BUDGET = int(os.environ.get("POST_PROCESSING_MEMORY_BUDGET", str(256 * 1024 * 1024)))  # bytes
+# Number of threads which write tiles into a mosaic (of the same datacube) at the same time
+MOSAIC_THREADS = int(os.environ.get("MOSAIC_THREADS", "4"))
+# Number of threads which upload chunks of a Zarr store (written directly to the results bucket)
+ZARR_UPLOAD_THREADS = int(os.environ.get("ZARR_UPLOAD_THREADS", "8"))
+# Number of threads which upload converted tiles (shared by all post-processing threads), while next tiles are converted
+POST_PROCESSING_UPLOAD_THREADS = int(os.environ.get("POST_PROCESSING_UPLOAD_THREADS", "4"))
+# Files larger than this are uploaded in parts of this size, UPLOAD_CONCURRENCY parts of a file at the same time
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", str(32 * 1024 * 1024)))  # bytes
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+# Manifest of post-processing (per-tile status and output keys), written next to the results of the batch request
+POST_PROCESSING_MANIFEST_FILE_NAME = "post_processing_manifest.json"
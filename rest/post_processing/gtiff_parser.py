@@ -1,14 +1,40 @@
+import math
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import log, WARNING
+from boto3.s3.transfer import TransferConfig
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.session import AWSSession
 import rioxarray
 from dateutil import parser
 import pandas as pd
 import xarray as xr
-import requests
+import netCDF4
+import numpy as np
+import zarr
+from numcodecs import Blosc
 from sentinelhub import MimeType
 
 from processing.const import CustomMimeType
 from openeoerrors import Internal
+from buckets.zarr_store import BucketZarrStore
+from post_processing.const import (
+    GTIFF_WRITE_THREADS,
+    POST_PROCESSING_MEMORY_BUDGET,
+    ZARR_UPLOAD_THREADS,
+    UPLOAD_PART_SIZE,
+    UPLOAD_CONCURRENCY,
+)
+
+
+# name of the data variable, as it was named by xarray when the datacube was combined from timestamp arrays
+OUTPUT_VARIABLE_NAME = "__xarray_dataarray_variable__"
+# approximate size of chunks of chunking profiles (in bytes)
+OUTPUT_CHUNK_SIZE = 4 * 1024**2
 
 
 # assume it's only 1 time and 1 bands dimension
@@ -52,8 +78,8 @@ def get_timestamps_arrays(datacube_time_as_bands, time_dimensions, bands_dimensi
             else:
                 timestamp_array = timestamp_array.drop_vars("band")
             if time_dimension:
+                # time dimension is added when the arrays are written, expanding dimensions here would load them
                 timestamp_array = timestamp_array.assign_coords(t=pd.to_datetime(parser.parse(date)))
-                timestamp_array = timestamp_array.expand_dims(dim="t")
 
         list_of_timestamps.append(date)
         list_of_timestamp_arrays.append(timestamp_array)
@@ -61,59 +87,496 @@ def get_timestamps_arrays(datacube_time_as_bands, time_dimensions, bands_dimensi
     return list_of_timestamps, list_of_timestamp_arrays
 
 
-def save_as_gtiff(list_of_timestamps, list_of_timestamp_arrays, output_dir, output_name):
+def get_upload_transfer_config():
+    return TransferConfig(
+        multipart_threshold=UPLOAD_PART_SIZE, multipart_chunksize=UPLOAD_PART_SIZE, max_concurrency=UPLOAD_CONCURRENCY
+    )
+
+
+def upload_output_file(output_file_path, output_bucket, output_prefix):
+    """
+    Uploads the output file to the results bucket (under `output_prefix`) and removes it.
+    """
+    output_bucket.upload_file_to_bucket(
+        output_file_path,
+        output_prefix,
+        os.path.basename(output_file_path),
+        transfer_config=get_upload_transfer_config(),
+    )
+    os.remove(output_file_path)
+
+
+def get_gtiff_creation_options(gtiff_options):
+    creation_options = {}
+    if gtiff_options["compression"] is not None:
+        creation_options["compress"] = gtiff_options["compression"].upper()
+        creation_options["predictor"] = gtiff_options["predictor"]
+    return creation_options
+
+
+def build_overviews(file_path, factors):
+    with rasterio.open(file_path, "r+") as dataset:
+        dataset.build_overviews(factors, Resampling.average)
+
+
+def write_cog(array, file_path, gtiff_options):
+    """
+    COGs can't be written window by window, so a tiled GeoTIFF (with overviews) is written first and then copied
+    into the COG layout (overviews and headers before the data), one block at a time.
+    """
+    intermediate_file_path = f"{file_path}.intermediate.tif"
+    try:
+        array.rio.to_raster(intermediate_file_path, tiled=True, windowed=True)
+        if gtiff_options["overviews"]:
+            build_overviews(intermediate_file_path, gtiff_options["overviews"])
+
+        # COG driver compresses with LZW by default and names predictors instead of numbering them
+        creation_options = {"compress": "NONE"}
+        for key, value in get_gtiff_creation_options(gtiff_options).items():
+            creation_options[key] = (
+                {1: "NO", 2: "STANDARD", 3: "FLOATING_POINT"}[value] if key == "predictor" else value
+            )
+        rasterio.shutil.copy(
+            intermediate_file_path,
+            file_path,
+            driver="COG",
+            overviews="FORCE_USE_EXISTING" if gtiff_options["overviews"] else "AUTO",
+            resampling="AVERAGE",
+            **creation_options,
+        )
+    finally:
+        if os.path.exists(intermediate_file_path):
+            os.remove(intermediate_file_path)
+
+
+def save_as_gtiff(
+    list_of_timestamps,
+    list_of_timestamp_arrays,
+    output_dir,
+    output_name,
+    gtiff_options=None,
+    output_bucket=None,
+    output_prefix=None,
+):
     output_file_paths = []
-    for array, date in zip(list_of_timestamp_arrays, list_of_timestamps):
+    for date in list_of_timestamps:
         date_string = f"_{date}" if date else ""
         file_name = f"{output_name['name']}{date_string}{output_name['ext']}"
-        file_path = os.path.join(output_dir, file_name)
-        output_file_paths.append(file_path)
+        output_file_paths.append(os.path.join(output_dir, file_name))
 
+    def write_tiled_gtiff(array, file_path):
         array.rio.to_raster(
             file_path,
             tiled=True,  # GDAL: By default striped TIFF files are created. This option can be used to force creation of tiled TIFF files.
             windowed=True,  # rioxarray: read & write one window at a time
+            **(get_gtiff_creation_options(gtiff_options) if gtiff_options is not None else {}),
         )
+        if gtiff_options is not None and gtiff_options["overviews"]:
+            build_overviews(file_path, gtiff_options["overviews"])
+
+    def write_gtiff(array, file_path):
+        if gtiff_options is not None and gtiff_options["cog"]:
+            write_cog(array, file_path, gtiff_options)
+        else:
+            write_tiled_gtiff(array, file_path)
+
+        # file is uploaded while GeoTIFFs of other timestamps are being written
+        if output_bucket is not None:
+            upload_output_file(file_path, output_bucket, output_prefix)
+
+    # reading (and fetching) windows of the input file, encoding and writing of different files release the GIL
+    # and can run concurrently
+    with ThreadPoolExecutor(max_workers=GTIFF_WRITE_THREADS) as executor:
+        list(executor.map(write_gtiff, list_of_timestamp_arrays, output_file_paths))
+
+    if output_bucket is not None:
+        return []
     return output_file_paths
 
 
-def save_as_netcdf(list_of_timestamp_arrays, output_dir, output_name):
-    datacube_with_time_dimension = xr.combine_by_coords(list_of_timestamp_arrays)
+def get_window_rows(timestamp_array, window_size=POST_PROCESSING_MEMORY_BUDGET // 4):
+    """
+    Returns the number of rows of a timestamp array which fit into a window of given size (in bytes).
+    """
+    row_size = timestamp_array.dtype.itemsize * timestamp_array.size // len(timestamp_array["y"])
+    return max(1, min(len(timestamp_array["y"]), window_size // row_size))
+
+
+def get_output_dims(list_of_timestamp_arrays):
+    timestamp_array = list_of_timestamp_arrays[0]
+    if "t" in timestamp_array.coords:
+        return ("t", *timestamp_array.dims)
+    return timestamp_array.dims
+
+
+def get_output_shape(list_of_timestamp_arrays, height=None, width=None):
+    timestamp_array = list_of_timestamp_arrays[0]
+    shape = tuple(
+        height if dim == "y" and height else width if dim == "x" and width else size
+        for dim, size in zip(timestamp_array.dims, timestamp_array.shape)
+    )
+    if "t" in timestamp_array.coords:
+        return (len(list_of_timestamp_arrays), *shape)
+    return shape
+
+
+def create_output_template(list_of_timestamp_arrays, x=None, y=None):
+    """
+    Returns a dataset with coordinates (and the CRS) of the output datacube, but without its data. Spatial
+    coordinates of the timestamp arrays can be replaced with `x` and `y`.
+    """
+    timestamp_array = list_of_timestamp_arrays[0]
+    coords = {name: coord.variable for name, coord in timestamp_array.coords.items() if name != "t"}
+    if x is not None:
+        coords["x"] = xr.Variable("x", x, attrs=timestamp_array["x"].attrs)
+    if y is not None:
+        coords["y"] = xr.Variable("y", y, attrs=timestamp_array["y"].attrs)
+    template = xr.Dataset(coords=coords)
+    if "t" in timestamp_array.coords:
+        template = template.assign_coords(t=[array["t"].values for array in list_of_timestamp_arrays])
+    if x is not None or y is not None:
+        template = template.rio.write_transform(template.rio.transform(recalc=True))
+    # spatial_ref is saved as a data variable, as it was when the datacube was combined from timestamp arrays
+    return template.reset_coords()
+
+
+def encode_output_variable(timestamp_array):
+    return xr.conventions.encode_cf_variable(timestamp_array.variable, name=OUTPUT_VARIABLE_NAME)
+
+
+def get_output_variable_encoding(timestamp_array):
+    """
+    Returns dtype, fill value and attributes of the encoded output variable.
+    """
+    encoded_variable = encode_output_variable(timestamp_array.isel(y=slice(0, 1)))
+    attrs = dict(encoded_variable.attrs)
+    fill_value = attrs.pop("_FillValue", None)
+    return encoded_variable.dtype, fill_value, attrs
+
+
+def iterate_output_windows(
+    list_of_timestamp_arrays,
+    window_size=POST_PROCESSING_MEMORY_BUDGET // 4,
+    y_offset=0,
+    x_offset=0,
+    row_step=1,
+    column_step=None,
+    across_time=False,
+):
+    """
+    Yields indices (in the output datacube, where the timestamp arrays start at `y_offset` and `x_offset`)
+    and encoded data of windows of timestamp arrays. Only one window is read into memory at a time.
+    Windows start at multiples of `row_step` rows and span all timestamps if `across_time` is set. If `row_step`
+    rows don't fit into a window, windows are split into multiples of `column_step` columns (if it's given).
+    """
+    has_time_dimension = "t" in list_of_timestamp_arrays[0].coords
+    across_time = across_time and has_time_dimension
+    if across_time:
+        groups_of_timestamp_arrays = [list_of_timestamp_arrays]
+    else:
+        groups_of_timestamp_arrays = [[timestamp_array] for timestamp_array in list_of_timestamp_arrays]
+
+    for i, timestamp_arrays in enumerate(groups_of_timestamp_arrays):
+        n_rows = len(timestamp_arrays[0]["y"])
+        n_columns = len(timestamp_arrays[0]["x"])
+        group_window_size = window_size // len(timestamp_arrays)
+        window_rows = get_window_rows(timestamp_arrays[0], group_window_size)
+        window_columns = n_columns
+        if window_rows < row_step and column_step is not None:
+            pixel_size = timestamp_arrays[0].dtype.itemsize * timestamp_arrays[0].size // (n_rows * n_columns)
+            window_columns = group_window_size // (row_step * pixel_size) // column_step * column_step
+            window_columns = min(n_columns, max(column_step, window_columns))
+        window_rows = max(row_step, window_rows // row_step * row_step)
+
+        for row in range(0, n_rows, window_rows):
+            for column in range(0, n_columns, window_columns):
+                windows = [
+                    timestamp_array.isel(y=slice(row, row + window_rows), x=slice(column, column + window_columns))
+                    for timestamp_array in timestamp_arrays
+                ]
+                dim_indices = {
+                    "y": slice(y_offset + row, y_offset + min(row + window_rows, n_rows)),
+                    "x": slice(x_offset + column, x_offset + min(column + window_columns, n_columns)),
+                }
+                index = tuple(dim_indices.get(dim, slice(None)) for dim in windows[0].dims)
+                if across_time:
+                    data = np.stack([encode_output_variable(window).values for window in windows])
+                    yield (slice(None), *index), data
+                elif has_time_dimension:
+                    yield (i, *index), encode_output_variable(windows[0]).values
+                else:
+                    yield index, encode_output_variable(windows[0]).values
+
+
+def iterate_output_chunk_windows(list_of_timestamp_arrays, dims, chunks, **kwargs):
+    """
+    Yields windows (as `iterate_output_windows`) which are aligned with chunks, so that each chunk is written once.
+    """
+    chunk_sizes = dict(zip(dims, chunks))
+    return iterate_output_windows(
+        list_of_timestamp_arrays,
+        row_step=chunk_sizes["y"],
+        column_step=chunk_sizes["x"],
+        across_time=chunk_sizes.get("t", 1) > 1,
+        **kwargs,
+    )
+
+
+def get_output_chunks(dims, shape, itemsize, chunking):
+    """
+    Returns chunks of the chunking profile, which hold about OUTPUT_CHUNK_SIZE bytes of a square block of pixels
+    of one timestamp ("spatial") or of all timestamps ("time_series").
+    """
+    sizes = dict(zip(dims, shape))
+    n_timestamps = sizes.get("t", 1) if chunking == "time_series" else 1
+    pixel_size = itemsize * sizes.get("band", 1) * n_timestamps
+    side = max(16, math.isqrt(OUTPUT_CHUNK_SIZE // pixel_size))
+    chunk_sizes = {"t": n_timestamps, "y": min(side, sizes["y"]), "x": min(side, sizes["x"])}
+    return tuple(chunk_sizes.get(dim, size) for dim, size in zip(dims, shape))
+
+
+def get_netcdf_compression(encoding_options):
+    if encoding_options is None or encoding_options["compression"] in [None, "none"]:
+        return {}
+    return {
+        "compression": encoding_options["compression"],
+        "complevel": encoding_options["compression_level"],
+        "shuffle": encoding_options["shuffle"],
+    }
+
+
+def get_zarr_compressor(encoding_options):
+    if encoding_options is None or encoding_options["compression"] is None:
+        return "default"
+    if encoding_options["compression"] == "none":
+        return None
+    return Blosc(
+        cname=encoding_options["compression"],
+        clevel=encoding_options["compression_level"],
+        shuffle=Blosc.SHUFFLE if encoding_options["shuffle"] else Blosc.NOSHUFFLE,
+    )
+
+
+@contextmanager
+def open_netcdf_output(output_file_path, template, dims, shape, timestamp_array, chunks=None, **compression):
+    """
+    Writes the template of the output datacube and yields its (empty) data variable, which data can be written to.
+    Data is stored contiguously, unless `chunks` are given.
+    """
+    template.to_netcdf(output_file_path)
+    dtype, fill_value, attrs = get_output_variable_encoding(timestamp_array)
+
+    with netCDF4.Dataset(output_file_path, "a") as dataset:
+        for dim, size in zip(dims, shape):
+            if dim not in dataset.dimensions:
+                dataset.createDimension(dim, size)
+        if compression.get("compression") == "zstd" and not dataset.has_zstd_filter():
+            # zstd filter isn't available in all builds of the netCDF library
+            log(WARNING, "Zstandard filter is not available, NetCDF output is compressed with zlib instead.")
+            compression = {**compression, "compression": "zlib"}
+        variable = dataset.createVariable(
+            OUTPUT_VARIABLE_NAME, dtype, dims, fill_value=fill_value, chunksizes=chunks, **compression
+        )
+        variable.setncatts(attrs)
+        # data is already encoded by xarray
+        variable.set_auto_maskandscale(False)
+        yield variable
+
+
+def create_zarr_output(
+    store, template, dims, shape, chunks, timestamp_array, default_fill_value=None, compressor="default", **kwargs
+):
+    """
+    Writes the template of the output datacube to the store (a path or a mapping) and returns its (empty) data
+    array, which data can be written to. Objects of a previous (interrupted) write of the output are removed.
+    """
+    template.to_zarr(store, mode="w")
+    dtype, fill_value, attrs = get_output_variable_encoding(timestamp_array)
+
+    if fill_value is None:
+        fill_value = default_fill_value
+
+    group = zarr.open_group(store, mode="a", **kwargs)
+    array = group.create(
+        OUTPUT_VARIABLE_NAME, shape=shape, chunks=chunks, dtype=dtype, fill_value=fill_value, compressor=compressor
+    )
+    array.attrs.update(
+        {
+            "_ARRAY_DIMENSIONS": list(dims),
+            **{key: xr.backends.zarr.encode_zarr_attr_value(value) for key, value in attrs.items()},
+        }
+    )
+    return array
+
+
+def finish_zarr_output(store, output_file_path):
+    """
+    Consolidates metadata of the written store. Local stores are zipped to avoid listing a bunch of files, stores
+    in the bucket are left as they are. Returns paths of files which still need to be uploaded.
+    """
+    if isinstance(store, BucketZarrStore):
+        # consolidated metadata is uploaded last, once all objects it lists are uploaded
+        store.flush()
+        zarr.consolidate_metadata(store)
+        store.close()
+        return []
+
+    zarr.consolidate_metadata(store)
+
+    shutil.make_archive(output_file_path, "zip", output_file_path)
+    return [f"{output_file_path}.zip"]
+
+
+def open_zarr_store(output_file_path, output_bucket=None, output_prefix=None):
+    """
+    Returns the store which Zarr output is written to: the results bucket (under `output_prefix`) if it's given,
+    otherwise the local output file path.
+    """
+    if output_bucket is None:
+        return output_file_path
+    return BucketZarrStore(
+        output_bucket, f"{output_prefix}/{os.path.basename(output_file_path)}", max_workers=ZARR_UPLOAD_THREADS
+    )
+
+
+def save_as_netcdf(list_of_timestamp_arrays, output_dir, output_name, encoding_options=None):
     output_file_path = os.path.join(output_dir, f"{output_name['name']}{output_name['ext']}")
-    datacube_with_time_dimension.to_netcdf(output_file_path)
+    template = create_output_template(list_of_timestamp_arrays)
+    dims = get_output_dims(list_of_timestamp_arrays)
+    shape = get_output_shape(list_of_timestamp_arrays)
+    compression = get_netcdf_compression(encoding_options)
+    # compressed data has to be chunked
+    chunking = (encoding_options or {}).get("chunking") or ("spatial" if compression else None)
+    chunks = None
+    if chunking is not None:
+        chunks = get_output_chunks(dims, shape, list_of_timestamp_arrays[0].dtype.itemsize, chunking)
+
+    with open_netcdf_output(
+        output_file_path, template, dims, shape, list_of_timestamp_arrays[0], chunks=chunks, **compression
+    ) as variable:
+        if chunks is None:
+            windows = iterate_output_windows(list_of_timestamp_arrays)
+        else:
+            windows = iterate_output_chunk_windows(list_of_timestamp_arrays, dims, chunks)
+        for index, data in windows:
+            variable[index] = data
+
     return [output_file_path]
 
 
-def save_as_zarr(list_of_timestamp_arrays, output_dir, output_name):
-    datacube_with_time_dimension = xr.combine_by_coords(list_of_timestamp_arrays)
+def save_as_zarr(
+    list_of_timestamp_arrays, output_dir, output_name, output_bucket=None, output_prefix=None, encoding_options=None
+):
     output_file_path = os.path.join(output_dir, f"{output_name['name']}{output_name['ext']}")
-    datacube_with_time_dimension.to_zarr(output_file_path)
-    # zip the zarr folder to avoid listing a bunch of files
-    shutil.make_archive(output_file_path, "zip", output_file_path)
-    output_file_path = f"{output_file_path}.zip"
-    return [output_file_path]
+    store = open_zarr_store(output_file_path, output_bucket, output_prefix)
+    template = create_output_template(list_of_timestamp_arrays)
+    dims = get_output_dims(list_of_timestamp_arrays)
+    shape = get_output_shape(list_of_timestamp_arrays)
+    chunking = (encoding_options or {}).get("chunking")
+    if chunking is not None:
+        chunks = get_output_chunks(dims, shape, list_of_timestamp_arrays[0].dtype.itemsize, chunking)
+    else:
+        # each window is written to its own chunks
+        chunks = tuple(
+            get_window_rows(list_of_timestamp_arrays[0]) if dim == "y" else 1 if dim == "t" else size
+            for dim, size in zip(dims, shape)
+        )
+
+    array = create_zarr_output(
+        store,
+        template,
+        dims,
+        shape,
+        chunks,
+        list_of_timestamp_arrays[0],
+        compressor=get_zarr_compressor(encoding_options),
+    )
+    for index, data in iterate_output_chunk_windows(list_of_timestamp_arrays, dims, chunks):
+        array[index] = data
+
+    return finish_zarr_output(store, output_file_path)
 
 
-def parse_multitemporal_gtiff_to_format(input_tiff, input_metadata, output_dir, output_name, output_format):
-    datacube_time_as_bands = rioxarray.open_rasterio(input_tiff)
-    datacube_metadata = requests.get(input_metadata).json()
+def get_gdal_env(gdal_config):
+    """
+    rasterio doesn't allow AWS credentials to be set as GDAL config options, so they are passed in a session.
+    """
+    options = dict(gdal_config or {})
+    if "AWS_ACCESS_KEY_ID" not in options:
+        return rasterio.Env(**options)
+
+    session = AWSSession(
+        aws_access_key_id=options.pop("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=options.pop("AWS_SECRET_ACCESS_KEY", None),
+        region_name=options.pop("AWS_REGION", None),
+        endpoint_url=options.pop("AWS_S3_ENDPOINT", None),
+    )
+    return rasterio.Env(session=session, **options)
+
+
+def get_gdal_cache_max():
+    # GDAL caches blocks of input files, it mustn't use more than its share of the memory budget (in MB)
+    return max(1, POST_PROCESSING_MEMORY_BUDGET // 4 // 1024**2)
+
+
+def open_multitemporal_gtiff(input_tiff, datacube_metadata, output_format):
+    """
+    Opens the GeoTIFF of a batch request tile lazily and splits it into timestamps.
+    """
+    # without a lock, windows can be read by several threads (which write GeoTIFFs) at the same time
+    # without caching, only the windows which are being written are kept in memory
+    datacube_time_as_bands = rioxarray.open_rasterio(input_tiff, lock=False, cache=False)
 
     time_dimensions = [dim for dim in datacube_metadata["outputDimensions"] if dim["type"] == "temporal"]
     bands_dimensions = [dim for dim in datacube_metadata["outputDimensions"] if dim["type"] == "bands"]
 
     check_dimensions(time_dimensions, bands_dimensions)
 
-    list_of_timestamps, list_of_timestamp_arrays = get_timestamps_arrays(
-        datacube_time_as_bands, time_dimensions, bands_dimensions, output_format
-    )
+    return get_timestamps_arrays(datacube_time_as_bands, time_dimensions, bands_dimensions, output_format)
+
+
+def parse_multitemporal_gtiff_to_format(
+    input_tiff,
+    datacube_metadata,
+    output_dir,
+    output_name,
+    output_format,
+    gdal_config=None,
+    output_bucket=None,
+    output_prefix=None,
+    output_options=None,
+):
+    """
+    Converts the GeoTIFF of a batch request tile to the output format. The GeoTIFF is read lazily, one window
+    at a time, so with `input_tiff` being a path in GDAL's S3 virtual file system (and `gdal_config` its
+    credentials) only the needed parts of the file are fetched while the rest is being converted.
+    If `output_bucket` is given, Zarr is written directly to it (under `output_prefix`) and GeoTIFFs are uploaded
+    to it as soon as each of them is written, other formats are written to `output_dir`. Outputs are written with
+    `output_options` (see `processing.utils.get_output_options`). Returns paths of the files in `output_dir` which
+    still need to be uploaded.
+    """
+    with get_gdal_env({"GDAL_CACHEMAX": get_gdal_cache_max(), **(gdal_config or {})}):
+        list_of_timestamps, list_of_timestamp_arrays = open_multitemporal_gtiff(
+            input_tiff, datacube_metadata, output_format
+        )
 
-    if output_format == MimeType.TIFF:
-        return save_as_gtiff(list_of_timestamps, list_of_timestamp_arrays, output_dir, output_name)
+        if output_format == MimeType.TIFF:
+            return save_as_gtiff(
+                list_of_timestamps,
+                list_of_timestamp_arrays,
+                output_dir,
+                output_name,
+                output_options,
+                output_bucket,
+                output_prefix,
+            )
 
-    if output_format == CustomMimeType.NETCDF:
-        return save_as_netcdf(list_of_timestamp_arrays, output_dir, output_name)
+        if output_format == CustomMimeType.NETCDF:
+            return save_as_netcdf(list_of_timestamp_arrays, output_dir, output_name, output_options)
 
-    if output_format == CustomMimeType.ZARR:
-        return save_as_zarr(list_of_timestamp_arrays, output_dir, output_name)
+        if output_format == CustomMimeType.ZARR:
+            return save_as_zarr(
+                list_of_timestamp_arrays, output_dir, output_name, output_bucket, output_prefix, output_options
+            )
 
     raise Internal(f"Parsing to format {output_format} is not supported")
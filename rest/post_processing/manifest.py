@@ -0,0 +1,141 @@
+"""
+Post-processing manifest is an object in the results bucket (next to the results of the batch request) which records
+keys of the results of the batch request and the status and output keys of post-processing of each of its tiles:
+
+{
+    "batch_request_id": "...",
+    "status": "running" | "done",
+    "keys": [keys of results of the batch request],
+    "tiles": {
+        "<subfolder_id>": {"data_key": "...", "metadata_key": "...", "status": "pending" | "done", "output_keys": []}
+    },
+    "output_keys": [keys of outputs which don't belong to a single tile (mosaics)]
+}
+
+Zarr stores are recorded with keys of their consolidated metadata, which are written last.
+"""
+import json
+from enum import Enum
+
+from processing.const import ShBatchResponseOutput
+from post_processing.const import POST_PROCESSING_MANIFEST_FILE_NAME, parsed_output_file_name
+from utils import get_zarr_store_key
+
+
+class ManifestStatus(Enum):
+    RUNNING = "running"
+    PENDING = "pending"
+    DONE = "done"
+
+
+def get_manifest_key(batch_request_id):
+    return f"{batch_request_id}/{POST_PROCESSING_MANIFEST_FILE_NAME}"
+
+
+def is_manifest_key(object_key):
+    return object_key.endswith(f"/{POST_PROCESSING_MANIFEST_FILE_NAME}")
+
+
+def is_output_key(object_key):
+    """
+    Checks if the object is (a part of) an output of a converted tile.
+    """
+    # GeoTIFFs of timestamps are named output_<timestamp>.tif, Zarr stores are folders
+    return any(
+        part.startswith(output_name["name"]) and part.endswith(output_name["ext"])
+        for part in object_key.split("/")[1:]
+        for output_name in parsed_output_file_name.values()
+    )
+
+
+def get_existing_tile_output_keys(batch_request_id, results):
+    """
+    Returns keys of outputs of tiles which were already converted (by versions which didn't write manifests), grouped
+    by tiles. Zarr stores are only complete once their consolidated metadata is written.
+    """
+    output_keys = {}
+    for result in results:
+        if is_output_key(result["Key"]) and (
+            get_zarr_store_key(result["Key"]) is None or result["Key"].endswith("/.zmetadata")
+        ):
+            subfolder_id = result["Key"][len(batch_request_id) + 1 :].split("/")[0]
+            output_keys.setdefault(subfolder_id, []).append(result["Key"])
+    return output_keys
+
+
+def create_manifest(batch_request_id, results, subfolder_groups):
+    """
+    Creates the manifest from the listed results of the batch request. Tiles whose outputs already exist are done.
+    """
+    existing_output_keys = get_existing_tile_output_keys(batch_request_id, results)
+    return {
+        "batch_request_id": batch_request_id,
+        "status": ManifestStatus.RUNNING.value,
+        "keys": [
+            result["Key"]
+            for result in results
+            if not is_manifest_key(result["Key"]) and not is_output_key(result["Key"])
+        ],
+        "tiles": {
+            subfolder_id: {
+                "data_key": subfolder_group[ShBatchResponseOutput.DATA.value],
+                "metadata_key": subfolder_group[ShBatchResponseOutput.METADATA.value],
+                "status": (
+                    ManifestStatus.DONE.value if subfolder_id in existing_output_keys else ManifestStatus.PENDING.value
+                ),
+                "output_keys": existing_output_keys.get(subfolder_id, []),
+            }
+            for subfolder_id, subfolder_group in subfolder_groups.items()
+        },
+        "output_keys": [],
+    }
+
+
+def load_manifest(bucket, batch_request_id):
+    try:
+        return bucket.get_json_object(get_manifest_key(batch_request_id))
+    except bucket.client.exceptions.NoSuchKey:
+        return None
+
+
+def save_manifest(bucket, manifest):
+    bucket.put_file_to_bucket(
+        json.dumps(manifest), prefix=manifest["batch_request_id"], file_name=POST_PROCESSING_MANIFEST_FILE_NAME
+    )
+
+
+def get_pending_tiles(manifest):
+    return {
+        subfolder_id: tile
+        for subfolder_id, tile in manifest["tiles"].items()
+        if tile["status"] != ManifestStatus.DONE.value
+    }
+
+
+def complete_tile(manifest, subfolder_id, output_keys):
+    manifest["tiles"][subfolder_id]["status"] = ManifestStatus.DONE.value
+    manifest["tiles"][subfolder_id]["output_keys"] = output_keys
+
+
+def complete_manifest(manifest, output_keys=()):
+    manifest["status"] = ManifestStatus.DONE.value
+    manifest["output_keys"].extend(output_keys)
+
+
+def get_manifest_result_keys(manifest):
+    """
+    Returns keys of all results of the batch request, including outputs of post-processing.
+    """
+    output_keys = [key for tile in manifest["tiles"].values() for key in tile["output_keys"]]
+    return [*manifest["keys"], *output_keys, *manifest["output_keys"]]
+
+
+def list_output_keys(bucket, prefix, output_name):
+    """
+    Lists keys of outputs of post-processing (named `output_name`) under `prefix`.
+    """
+    output_keys = []
+    for result in bucket.get_data_from_bucket(prefix=f"{prefix}/{output_name['name']}"):
+        if get_zarr_store_key(result["Key"]) is None or result["Key"].endswith("/.zmetadata"):
+            output_keys.append(result["Key"])
+    return output_keys
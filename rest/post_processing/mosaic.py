@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import zarr
+
+from processing.const import CustomMimeType
+from openeoerrors import Internal
+from post_processing.const import MOSAIC_THREADS, POST_PROCESSING_MEMORY_BUDGET
+from post_processing.gtiff_parser import (
+    get_gdal_env,
+    get_gdal_cache_max,
+    open_multitemporal_gtiff,
+    create_output_template,
+    get_output_dims,
+    get_output_shape,
+    iterate_output_windows,
+    get_output_chunks,
+    get_netcdf_compression,
+    get_zarr_compressor,
+    open_netcdf_output,
+    create_zarr_output,
+    open_zarr_store,
+    finish_zarr_output,
+    upload_output_file,
+)
+
+
+class MosaicGrid:
+    """
+    Grid of the mosaic of tiles in the same CRS. Tiles of Sentinel Hub tiling grids have the same resolution
+    and are aligned to each other, so each of them covers a block of pixels of the mosaic.
+    """
+
+    def __init__(self, tiles):
+        self.res_x, self.res_y = tiles[0][0].rio.resolution()
+        bounds = [tile[0].rio.bounds() for tile in tiles]
+        self.left = min(bound[0] for bound in bounds)
+        self.right = max(bound[2] for bound in bounds)
+        self.bottom = min(bound[1] for bound in bounds)
+        self.top = max(bound[3] for bound in bounds)
+
+        self.width = round((self.right - self.left) / abs(self.res_x))
+        self.height = round((self.top - self.bottom) / abs(self.res_y))
+        self.x = self.left + (np.arange(self.width) + 0.5) * abs(self.res_x)
+        self.y = self.top - (np.arange(self.height) + 0.5) * abs(self.res_y)
+
+    def get_tile_offset(self, tile):
+        left, _, _, top = tile[0].rio.bounds()
+        return round((self.top - top) / abs(self.res_y)), round((left - self.left) / abs(self.res_x))
+
+
+def get_crs_name(crs, i):
+    epsg = crs.to_epsg()
+    return str(epsg) if epsg is not None else f"crs{i}"
+
+
+def get_aligned_chunk_size(tile_size, chunk_size):
+    """
+    Returns the largest chunk size (up to `chunk_size`) which tiles can be split into.
+    """
+    chunk_size = min(tile_size, chunk_size)
+    divisor = next(size for size in range(chunk_size, 0, -1) if tile_size % size == 0)
+    # chunks of tiles with no suitable divisor are written in parts
+    return divisor if divisor * 2 > chunk_size else chunk_size
+
+
+def get_mosaic_chunks(tiles, dims, shape, chunking):
+    """
+    Returns chunks of the chunking profile which are aligned with tiles, so that each chunk is written by one thread.
+    """
+    chunks = get_output_chunks(dims, shape, tiles[0][0].dtype.itemsize, chunking)
+    tile_sizes = {"y": len(tiles[0][0]["y"]), "x": len(tiles[0][0]["x"])}
+    return tuple(
+        get_aligned_chunk_size(tile_sizes[dim], size) if dim in tile_sizes else size for dim, size in zip(dims, chunks)
+    )
+
+
+def write_tiles(tiles, grid, write_window, dims=None, chunks=None):
+    """
+    Writes windows of tiles in parallel threads, each thread writes its own tile. Windows are aligned with `chunks`
+    if they are given.
+    """
+    window_size = POST_PROCESSING_MEMORY_BUDGET // 4 // MOSAIC_THREADS
+    window_options = {}
+    if chunks is not None:
+        chunk_sizes = dict(zip(dims, chunks))
+        window_options = {
+            "row_step": chunk_sizes["y"],
+            "column_step": chunk_sizes["x"],
+            "across_time": chunk_sizes.get("t", 1) > 1,
+        }
+
+    def write_tile(tile):
+        y_offset, x_offset = grid.get_tile_offset(tile)
+        for index, data in iterate_output_windows(
+            tile, window_size, y_offset=y_offset, x_offset=x_offset, **window_options
+        ):
+            write_window(index, data)
+
+    with ThreadPoolExecutor(max_workers=MOSAIC_THREADS) as executor:
+        list(executor.map(write_tile, tiles))
+
+
+def save_mosaic_as_netcdf(tiles, grid, output_file_path, encoding_options=None):
+    template = create_output_template(tiles[0], x=grid.x, y=grid.y)
+    dims = get_output_dims(tiles[0])
+    shape = get_output_shape(tiles[0], height=grid.height, width=grid.width)
+    compression = get_netcdf_compression(encoding_options)
+    # compressed data has to be chunked
+    chunking = (encoding_options or {}).get("chunking") or ("spatial" if compression else None)
+    chunks = get_mosaic_chunks(tiles, dims, shape, chunking) if chunking is not None else None
+
+    # netCDF4 isn't thread-safe, windows are read and encoded in parallel, but written one at a time
+    lock = threading.Lock()
+    with open_netcdf_output(
+        output_file_path, template, dims, shape, tiles[0][0], chunks=chunks, **compression
+    ) as variable:
+
+        def write_window(index, data):
+            with lock:
+                variable[index] = data
+
+        write_tiles(tiles, grid, write_window, dims, chunks)
+
+    return output_file_path
+
+
+def save_mosaic_as_zarr(tiles, grid, output_file_path, output_bucket=None, output_prefix=None, encoding_options=None):
+    template = create_output_template(tiles[0], x=grid.x, y=grid.y)
+    dims = get_output_dims(tiles[0])
+    shape = get_output_shape(tiles[0], height=grid.height, width=grid.width)
+    chunks = get_mosaic_chunks(tiles, dims, shape, (encoding_options or {}).get("chunking") or "spatial")
+
+    # parts of the mosaic which aren't covered by any tile are filled with zeros if data has no fill value
+    store = open_zarr_store(output_file_path, output_bucket, output_prefix)
+    array = create_zarr_output(
+        store,
+        template,
+        dims,
+        shape,
+        chunks,
+        tiles[0][0],
+        default_fill_value=0,
+        compressor=get_zarr_compressor(encoding_options),
+        synchronizer=zarr.ThreadSynchronizer(),
+    )
+
+    def write_window(index, data):
+        array[index] = data
+
+    write_tiles(tiles, grid, write_window, dims, chunks)
+    return finish_zarr_output(store, output_file_path)
+
+
+def mosaic_multitemporal_gtiffs_to_format(
+    input_tiffs,
+    datacube_metadata,
+    output_dir,
+    output_name,
+    output_format,
+    gdal_config=None,
+    output_bucket=None,
+    output_prefix=None,
+    output_options=None,
+):
+    """
+    Writes GeoTIFFs of all tiles of a batch request into one spatially mosaicked datacube per CRS (tiles of
+    UTM tiling grids are in different CRSs). Tiles are read and written window by window, in parallel.
+    Outputs are written as in `parse_multitemporal_gtiff_to_format`.
+    """
+    if output_format not in [CustomMimeType.NETCDF, CustomMimeType.ZARR]:
+        raise Internal(f"Mosaicking to format {output_format} is not supported")
+
+    with get_gdal_env({"GDAL_CACHEMAX": get_gdal_cache_max(), **(gdal_config or {})}):
+        tiles_by_crs = defaultdict(list)
+        for input_tiff in input_tiffs:
+            _, list_of_timestamp_arrays = open_multitemporal_gtiff(input_tiff, datacube_metadata, output_format)
+            tiles_by_crs[list_of_timestamp_arrays[0].rio.crs.to_wkt()].append(list_of_timestamp_arrays)
+
+        output_file_paths = []
+        uploads = []
+        # mosaic of a CRS is uploaded while the mosaic of the next one is being written
+        with ThreadPoolExecutor(max_workers=1) as upload_executor:
+            for i, tiles in enumerate(tiles_by_crs.values()):
+                crs_name = get_crs_name(tiles[0][0].rio.crs, i)
+                grid = MosaicGrid(tiles)
+                # named like outputs of tiles (output_<crs>.<ext>), so that they are recorded as outputs in the manifest
+                output_file_path = os.path.join(output_dir, f"{output_name['name']}_{crs_name}{output_name['ext']}")
+                if output_format == CustomMimeType.NETCDF:
+                    save_mosaic_as_netcdf(tiles, grid, output_file_path, output_options)
+                    if output_bucket is None:
+                        output_file_paths.append(output_file_path)
+                    else:
+                        uploads.append(
+                            upload_executor.submit(upload_output_file, output_file_path, output_bucket, output_prefix)
+                        )
+                else:
+                    output_file_paths.extend(
+                        save_mosaic_as_zarr(tiles, grid, output_file_path, output_bucket, output_prefix, output_options)
+                    )
+
+            for upload in uploads:
+                upload.result()
+
+    return output_file_paths
@@ -1,73 +1,456 @@
 import os
 import json
+import multiprocessing
 import shutil
+import tempfile
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from logging import log, INFO, ERROR
 
+from buckets import get_bucket
+from dynamodb import JobsPersistence, PostProcessingStatus, PostProcessingTasksPersistence
 from processing.const import ShBatchResponseOutput, ProcessingRequestTypes
-from processing.processing import new_process
-from post_processing.gtiff_parser import parse_multitemporal_gtiff_to_format
-from post_processing.const import TMP_FOLDER, parsed_output_file_name
+from processing.utils import get_node_by_process_id, get_output_options
+from post_processing.gtiff_parser import parse_multitemporal_gtiff_to_format, get_upload_transfer_config
+from post_processing.mosaic import mosaic_multitemporal_gtiffs_to_format
+from post_processing.manifest import (
+    ManifestStatus,
+    create_manifest,
+    load_manifest,
+    save_manifest,
+    get_pending_tiles,
+    complete_tile,
+    complete_manifest,
+    list_output_keys,
+    is_output_key,
+)
+from post_processing.const import (
+    TMP_FOLDER,
+    parsed_output_file_name,
+    POST_PROCESSING_WORKERS,
+    POST_PROCESSING_HEARTBEAT_INTERVAL,
+    POST_PROCESSING_LEASE_DURATION,
+    POST_PROCESSING_PROCESSES,
+    POST_PROCESSING_QUEUE_ENABLED,
+    POST_PROCESSING_UPLOAD_THREADS,
+)
+from utils import BackgroundTasks
 
 
-def check_if_already_parsed(results, output_format):
-    for result in results:
-        if (
-            parsed_output_file_name[output_format]["name"] in result["Key"]
-            and parsed_output_file_name[output_format]["ext"] in result["Key"]
-        ):
-            return True
+post_processing_tasks = BackgroundTasks(max_workers=POST_PROCESSING_WORKERS)
+# converted tiles of all post-processed jobs are uploaded in the same pool of threads
+upload_pool = ThreadPoolExecutor(max_workers=POST_PROCESSING_UPLOAD_THREADS)
+
+conversion_pool = None
+conversion_pool_lock = threading.Lock()
+
+
+def get_conversion_pool():
+    """
+    Tiles of all post-processed jobs are converted in the same pool of processes, so that the number of
+    conversions running at the same time is bounded. Processes are spawned rather than forked, because
+    the pool is used from the threads of the API.
+    """
+    global conversion_pool
+    with conversion_pool_lock:
+        if conversion_pool is None:
+            conversion_pool = ProcessPoolExecutor(
+                max_workers=POST_PROCESSING_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        return conversion_pool
+
+
+def reset_conversion_pool():
+    global conversion_pool
+    with conversion_pool_lock:
+        conversion_pool = None
+
+
+def get_output_format(process):
+    """
+    Output format is read directly from the save_result node, so that post-processing doesn't need
+    the user of the request (which is needed to create a Process).
+    """
+    save_result_node = get_node_by_process_id(process["process_graph"], "save_result")
+    output_format = save_result_node["arguments"]["format"].lower()
+    return ProcessingRequestTypes.BATCH.get_supported_mime_types()[output_format]
 
-    return False
 
+def get_process_output_options(process):
+    return get_output_options(process["process_graph"], get_output_format(process))
 
-def generate_subfolder_groups(batch_request_id, bucket, results):
+
+def is_mosaic_requested(process):
+    save_result_node = get_node_by_process_id(process["process_graph"], "save_result")
+    options = save_result_node["arguments"].get("options") or {}
+    return bool(options.get("mosaic", False))
+
+
+def generate_subfolder_groups(batch_request_id, results):
+    """
+    Groups keys of data and metadata objects of batch request results by tiles (subfolders).
+    """
     subfolder_groups = {}
     for result in results:
         for output in [ShBatchResponseOutput.DATA, ShBatchResponseOutput.METADATA]:
             if output.value in result["Key"]:
-                url = bucket.generate_presigned_url(object_key=result["Key"])
                 subfolder_name = (
                     result["Key"].replace(f"{batch_request_id}", "").replace("/", "").split(output.value)[0]
                 )
                 if subfolder_name not in subfolder_groups:
                     subfolder_groups[subfolder_name] = {}
-                subfolder_groups[subfolder_name][output.value] = url
+                subfolder_groups[subfolder_name][output.value] = result["Key"]
 
     return subfolder_groups
 
 
-def upload_output_to_bucket(local_file_paths, bucket):
+def get_or_create_manifest(bucket, batch_request_id):
+    """
+    Loads the post-processing manifest of the batch request. Results of the batch request are only listed (once)
+    when the manifest doesn't exist yet.
+    """
+    manifest = load_manifest(bucket, batch_request_id)
+    if manifest is None:
+        results = bucket.get_data_from_bucket(prefix=batch_request_id)
+        manifest = create_manifest(batch_request_id, results, generate_subfolder_groups(batch_request_id, results))
+        save_manifest(bucket, manifest)
+    return manifest
+
+
+def upload_output_to_bucket(local_file_paths, bucket, local_dir, prefix):
     for path in local_file_paths:
-        s3_path = path[len(f"{TMP_FOLDER}") :]
-        bucket.upload_file_to_bucket(path, None, s3_path)
+        bucket.upload_file_to_bucket(
+            path, prefix, os.path.relpath(path, local_dir), transfer_config=get_upload_transfer_config()
+        )
+
+
+def parse_sh_gtiff_to_format(job, bucket, on_tile_parsed=None):
+    """
+    Converts tiles which haven't been converted yet according to the post-processing manifest, so that interrupted
+    post-processing continues where it stopped. The manifest is updated after each tile.
+    """
+    batch_request_id = job["batch_request_id"]
+    manifest = get_or_create_manifest(bucket, batch_request_id)
+    if manifest["status"] == ManifestStatus.DONE.value:
+        return
+
+    process = json.loads(job["process"])
+    output_format = get_output_format(process)
+    output_options = get_process_output_options(process)
+
+    if is_mosaic_requested(process):
+        mosaic_sh_gtiff_to_format(
+            batch_request_id, bucket, manifest["tiles"], output_format, output_options, on_tile_parsed
+        )
+        complete_manifest(manifest, list_output_keys(bucket, batch_request_id, parsed_output_file_name[output_format]))
+        save_manifest(bucket, manifest)
+        return
+
+    # each tile is converted in its own workspace, so that tiles (and jobs) don't interfere with each other
+    conversion_pool = get_conversion_pool()
+    workspaces = {}
+    futures = {}
+    uploads = {}
+    try:
+        for subfolder_id, tile in get_pending_tiles(manifest).items():
+            workspace = tempfile.mkdtemp(prefix=f"{batch_request_id}-{subfolder_id}-", dir=TMP_FOLDER)
+            workspaces[subfolder_id] = workspace
+            future = conversion_pool.submit(
+                parse_multitemporal_gtiff_to_format,
+                bucket.get_gdal_path(tile["data_key"]),
+                bucket.get_json_object(tile["metadata_key"]),
+                workspace,
+                parsed_output_file_name[output_format],
+                output_format,
+                gdal_config=bucket.get_gdal_config(),
+                output_bucket=bucket,
+                output_prefix=f"{batch_request_id}/{subfolder_id}",
+                output_options=output_options,
+            )
+            futures[future] = subfolder_id
+
+        # tiles are uploaded as soon as they are converted, while the process converts the next tile
+        n_tiles = len(manifest["tiles"])
+        n_tiles_done = n_tiles - len(futures)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=POST_PROCESSING_HEARTBEAT_INTERVAL, return_when=FIRST_COMPLETED)
+            if not done and on_tile_parsed is not None:
+                # tiles are still being converted or uploaded, progress is reported again so that the lease is extended
+                on_tile_parsed(n_tiles_done, n_tiles)
+            for future in done:
+                if future in futures:
+                    subfolder_id = futures[future]
+                    upload = upload_pool.submit(
+                        upload_output_to_bucket,
+                        future.result(),
+                        bucket,
+                        workspaces[subfolder_id],
+                        f"{batch_request_id}/{subfolder_id}",
+                    )
+                    uploads[upload] = subfolder_id
+                    pending.add(upload)
+                    continue
+
+                future.result()
+                subfolder_id = uploads[future]
+                shutil.rmtree(workspaces.pop(subfolder_id))
+                complete_tile(
+                    manifest,
+                    subfolder_id,
+                    list_output_keys(
+                        bucket, f"{batch_request_id}/{subfolder_id}", parsed_output_file_name[output_format]
+                    ),
+                )
+                save_manifest(bucket, manifest)
+                n_tiles_done += 1
+                if on_tile_parsed is not None:
+                    on_tile_parsed(n_tiles_done, n_tiles)
+
+        complete_manifest(manifest)
+        save_manifest(bucket, manifest)
+    except BrokenProcessPool:
+        reset_conversion_pool()
+        raise
+    finally:
+        for future in [*futures, *uploads]:
+            future.cancel()
+        # workspaces can't be removed while their files are being uploaded
+        wait(uploads)
+        for workspace in workspaces.values():
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def mosaic_sh_gtiff_to_format(batch_request_id, bucket, tiles, output_format, output_options=None, on_tile_parsed=None):
+    """
+    Writes all tiles into one mosaicked datacube per CRS (in one of the conversion processes). The mosaic counts
+    as a single tile, whose progress is reported regularly while it is being written, so that the lease is extended.
+    """
+    if len(tiles) == 0:
+        return
+
+    workspace = tempfile.mkdtemp(prefix=f"{batch_request_id}-mosaic-", dir=TMP_FOLDER)
+    try:
+        # all tiles have the same output dimensions
+        datacube_metadata = bucket.get_json_object(next(iter(tiles.values()))["metadata_key"])
+        future = get_conversion_pool().submit(
+            mosaic_multitemporal_gtiffs_to_format,
+            [bucket.get_gdal_path(tile["data_key"]) for tile in tiles.values()],
+            datacube_metadata,
+            workspace,
+            parsed_output_file_name[output_format],
+            output_format,
+            gdal_config=bucket.get_gdal_config(),
+            output_bucket=bucket,
+            output_prefix=batch_request_id,
+            output_options=output_options,
+        )
+        heartbeat = (lambda: on_tile_parsed(0, 1)) if on_tile_parsed is not None else None
+        output_file_paths = wait_with_heartbeat(future, heartbeat)
+        wait_with_heartbeat(
+            upload_pool.submit(upload_output_to_bucket, output_file_paths, bucket, workspace, batch_request_id),
+            heartbeat,
+        )
+        if on_tile_parsed is not None:
+            on_tile_parsed(1, 1)
+    except BrokenProcessPool:
+        reset_conversion_pool()
+        raise
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
 
 
-def parse_sh_gtiff_to_format(job, bucket):
+def wait_with_heartbeat(future, heartbeat=None):
+    """
+    Waits for the future and returns its result. Meanwhile `heartbeat` is called regularly, so that the lease is
+    extended while the work is still in progress.
+    """
+    while not wait([future], timeout=POST_PROCESSING_HEARTBEAT_INTERVAL).done:
+        if heartbeat is not None:
+            heartbeat()
+    return future.result()
+
+
+def convert_tile(
+    bucket,
+    batch_request_id,
+    subfolder_id,
+    data_key,
+    metadata_key,
+    output_format,
+    output_options=None,
+    heartbeat=None,
+):
+    """
+    Converts a single tile of batch request results (used by post-processing workers) and uploads it to the bucket.
+    Returns keys of the outputs. `heartbeat` is called regularly while the tile is being converted and uploaded.
+    """
+    workspace = tempfile.mkdtemp(prefix=f"{batch_request_id}-{subfolder_id}-", dir=TMP_FOLDER)
+    try:
+        future = get_conversion_pool().submit(
+            parse_multitemporal_gtiff_to_format,
+            bucket.get_gdal_path(data_key),
+            bucket.get_json_object(metadata_key),
+            workspace,
+            parsed_output_file_name[output_format],
+            output_format,
+            gdal_config=bucket.get_gdal_config(),
+            output_bucket=bucket,
+            output_prefix=f"{batch_request_id}/{subfolder_id}",
+            output_options=output_options,
+        )
+        output_file_paths = wait_with_heartbeat(future, heartbeat)
+        wait_with_heartbeat(
+            upload_pool.submit(
+                upload_output_to_bucket, output_file_paths, bucket, workspace, f"{batch_request_id}/{subfolder_id}"
+            ),
+            heartbeat,
+        )
+        return list_output_keys(bucket, f"{batch_request_id}/{subfolder_id}", parsed_output_file_name[output_format])
+    except BrokenProcessPool:
+        reset_conversion_pool()
+        raise
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def enqueue_tiles(job, bucket):
+    """
+    Adds tiles of the job's batch request results to the post-processing queue and returns their number.
+    """
     batch_request_id = job["batch_request_id"]
-    results = bucket.get_data_from_bucket(prefix=batch_request_id)
+    manifest = get_or_create_manifest(bucket, batch_request_id)
+    if manifest["status"] == ManifestStatus.DONE.value:
+        return 0
+
+    # tiles which were already converted before post-processing was interrupted are not queued again
+    tiles = get_pending_tiles(manifest)
+    if len(tiles) == 0:
+        complete_manifest(manifest)
+        save_manifest(bucket, manifest)
+        return 0
+
+    PostProcessingTasksPersistence.create_tasks(
+        job["id"],
+        batch_request_id,
+        {
+            subfolder_id: {"data_key": tile["data_key"], "metadata_key": tile["metadata_key"]}
+            for subfolder_id, tile in tiles.items()
+        },
+    )
+    return len(tiles)
 
-    process = new_process(json.loads(job["process"]), request_type=ProcessingRequestTypes.BATCH)
-    output_format = process.get_mimetype()
 
-    if check_if_already_parsed(results, output_format):
+def complete_queued_manifest(job_id, batch_request_id, tasks):
+    """
+    Records output keys of the queued tiles (reported by post-processing workers) in the post-processing manifest.
+    """
+    job = JobsPersistence.get_by_id(job_id)
+    if JobsPersistence.is_deleted(job) or job["batch_request_id"] != batch_request_id:
         return
 
-    subfolder_groups = generate_subfolder_groups(batch_request_id, bucket, results)
+    bucket = get_bucket(job["deployment_endpoint"])
+    manifest = get_or_create_manifest(bucket, batch_request_id)
+    for task in tasks:
+        if task["subfolder_id"] in manifest["tiles"]:
+            complete_tile(manifest, task["subfolder_id"], task.get("output_keys", []))
+    complete_manifest(manifest)
+    save_manifest(bucket, manifest)
 
-    for subfolder_id, subfolder_group in subfolder_groups.items():
-        input_tiff = subfolder_group[ShBatchResponseOutput.DATA.value]
-        input_metadata = subfolder_group[ShBatchResponseOutput.METADATA.value]
 
-        # preventively remove directory and create it again
-        batch_request_dir = f"{TMP_FOLDER}{batch_request_id}"
-        batch_subfolder = f"{batch_request_dir}/{subfolder_id}/"
-        if os.path.exists(batch_request_dir):
-            shutil.rmtree(batch_request_dir)
-        os.makedirs(batch_subfolder)
+def update_queued_post_processing(job_id, batch_request_id):
+    """
+    Checks the queued tiles of the batch request and marks post-processing as done once all of them are done
+    (or as failed if any of them failed).
+    """
+    tasks = list(PostProcessingTasksPersistence.query_by_batch_request_id(batch_request_id))
+    failed_tasks = [task for task in tasks if task["task_status"] == PostProcessingStatus.ERROR.value]
+    n_tiles_done = len([task for task in tasks if task["task_status"] == PostProcessingStatus.DONE.value])
 
-        output_file_paths = parse_multitemporal_gtiff_to_format(
-            input_tiff, input_metadata, batch_subfolder, parsed_output_file_name[output_format], output_format
+    JobsPersistence.update_post_processing_progress(job_id, n_tiles_done, len(tasks), POST_PROCESSING_LEASE_DURATION)
+    if failed_tasks:
+        JobsPersistence.update_post_processing_status(
+            job_id,
+            batch_request_id,
+            PostProcessingStatus.ERROR,
+            error_msg=f"Post-processing of results failed: {failed_tasks[0].get('error_msg')}",
         )
-        upload_output_to_bucket(output_file_paths, bucket)
+    elif n_tiles_done == len(tasks):
+        complete_queued_manifest(job_id, batch_request_id, tasks)
+        JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+        log(INFO, f"Post-processing results of job {job_id} done.")
+
+
+def has_legacy_outputs(job):
+    """
+    Checks if results of the job were converted before post-processing was recorded in job records (earlier versions
+    converted all tiles, in the order they are listed in, when results were first requested). Outputs of the first
+    tile are among the first listed results, so only the first page of results is listed.
+    """
+    bucket = get_bucket(job["deployment_endpoint"])
+    results = bucket.get_data_from_bucket(prefix=f"{job['batch_request_id']}/", max_keys=1000)
+    return any(is_output_key(result["Key"]) for result in results)
+
+
+def get_post_processing_status(job):
+    """
+    Returns the status of post-processing of the job's current batch request or None if it hasn't been started yet.
+    """
+    if job.get("post_processing_batch_request_id") != job["batch_request_id"]:
+        return None
+    return PostProcessingStatus(job["post_processing_status"])
+
+
+def post_process_batch_job(job_id):
+    """
+    Converts the results of the job's batch request to the requested format and records the progress in the job
+    record. Only one worker (in any of the processes) post-processes the same batch request at a time. With the
+    post-processing queue enabled, tiles are only queued here and converted by post-processing workers.
+    """
+    job = JobsPersistence.get_by_id(job_id)
+    # results of deleted jobs are being purged
+    if JobsPersistence.is_deleted(job):
+        return
+
+    batch_request_id = job["batch_request_id"]
+    if get_post_processing_status(job) == PostProcessingStatus.QUEUED:
+        update_queued_post_processing(job_id, batch_request_id)
+        return
+
+    if not JobsPersistence.claim_post_processing(job_id, batch_request_id, POST_PROCESSING_LEASE_DURATION):
+        return
+
+    log(INFO, f"Post-processing results of job {job_id} (batch request {batch_request_id}).")
+    try:
+        bucket = get_bucket(job["deployment_endpoint"])
+        # mosaic is written by a single worker, it can't be split into tiles
+        if POST_PROCESSING_QUEUE_ENABLED and not is_mosaic_requested(json.loads(job["process"])):
+            n_tiles = enqueue_tiles(job, bucket)
+            if n_tiles > 0:
+                JobsPersistence.update_post_processing_progress(job_id, 0, n_tiles, POST_PROCESSING_LEASE_DURATION)
+                JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.QUEUED)
+                log(INFO, f"Queued {n_tiles} tiles of job {job_id} for post-processing.")
+                return
+        else:
+            parse_sh_gtiff_to_format(
+                job,
+                bucket,
+                on_tile_parsed=lambda n_tiles_done, n_tiles: JobsPersistence.update_post_processing_progress(
+                    job_id, n_tiles_done, n_tiles, POST_PROCESSING_LEASE_DURATION
+                ),
+            )
+    except Exception as e:
+        log(ERROR, f"Post-processing results of job {job_id} failed: {traceback.format_exc()}")
+        JobsPersistence.update_post_processing_status(
+            job_id, batch_request_id, PostProcessingStatus.ERROR, error_msg=f"Post-processing of results failed: {e}"
+        )
+        return
+
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+    log(INFO, f"Post-processing results of job {job_id} done.")
+
 
-        # remove folder after the folder/file has been uploaded
-        shutil.rmtree(batch_request_dir)
+def start_post_processing(job):
+    post_processing_tasks.submit(f"post-process-{job['id']}", post_process_batch_job, job["id"])
@@ -0,0 +1,99 @@
+"""
+Post-processing worker converts tiles of batch job results which were queued for post-processing (with
+POST_PROCESSING_QUEUE_ENABLED set to "true" for the API and the batch jobs poller). Any number of workers can run
+on several nodes, each tile is claimed by one of them for the duration of a lease. Post-processing of a job is done
+once all of its tiles are done.
+
+Run it as a separate process:
+    $ python post_processing_worker.py
+"""
+import json
+import threading
+import time
+import traceback
+from logging import log, INFO, ERROR
+
+from buckets import get_bucket
+from dynamodb import JobsPersistence, PostProcessingTasksPersistence
+from post_processing.const import (
+    POST_PROCESSING_LEASE_DURATION,
+    POST_PROCESSING_PROCESSES,
+    POST_PROCESSING_TASK_MAX_ATTEMPTS,
+    POST_PROCESSING_WORKER_POLL_INTERVAL,
+)
+from post_processing.post_processing import (
+    convert_tile,
+    get_output_format,
+    get_process_output_options,
+    update_queued_post_processing,
+)
+
+
+def process_task(task):
+    """
+    Converts the tile of the task. Returns False if the tile isn't needed anymore.
+    """
+    job = JobsPersistence.get_by_id(task["job_id"])
+    # job was deleted or restarted in the meantime, its results are not needed anymore
+    if JobsPersistence.is_deleted(job) or job["batch_request_id"] != task["batch_request_id"]:
+        PostProcessingTasksPersistence.complete_task(task["id"])
+        return False
+
+    process = json.loads(job["process"])
+    output_keys = convert_tile(
+        get_bucket(job["deployment_endpoint"]),
+        task["batch_request_id"],
+        task["subfolder_id"],
+        task["data_key"],
+        task["metadata_key"],
+        get_output_format(process),
+        output_options=get_process_output_options(process),
+        heartbeat=lambda: PostProcessingTasksPersistence.extend_lease(task["id"], POST_PROCESSING_LEASE_DURATION),
+    )
+    PostProcessingTasksPersistence.complete_task(task["id"], output_keys)
+    return True
+
+
+def process_next_task():
+    """
+    Claims a tile from the queue and post-processes it. Returns False if there was nothing to do.
+    """
+    task = PostProcessingTasksPersistence.claim_task(POST_PROCESSING_LEASE_DURATION)
+    if task is None:
+        return False
+
+    try:
+        if not process_task(task):
+            return True
+    except Exception as e:
+        log(ERROR, f"Post-processing tile {task['id']} failed: {traceback.format_exc()}")
+        PostProcessingTasksPersistence.fail_task(task["id"], e, POST_PROCESSING_TASK_MAX_ATTEMPTS)
+
+    update_queued_post_processing(task["job_id"], task["batch_request_id"])
+    return True
+
+
+def run_worker():
+    while True:
+        try:
+            had_task = process_next_task()
+        except Exception:
+            log(ERROR, f"Post-processing worker failed: {traceback.format_exc()}")
+            had_task = False
+
+        if not had_task:
+            time.sleep(POST_PROCESSING_WORKER_POLL_INTERVAL)
+
+
+def run():
+    log(INFO, f"Starting post-processing worker ({POST_PROCESSING_PROCESSES} threads).")
+    # each thread waits for its tile to be converted in the (shared) pool of conversion processes
+    threads = [threading.Thread(target=run_worker, daemon=True) for _ in range(POST_PROCESSING_PROCESSES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,5 +1,6 @@
 from enum import Enum
 import mimetypes
+import os
 from sentinelhub import MimeType
 
 
@@ -94,3 +95,28 @@ supported_mime_types_error_msg = {
 }
 
 SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE = 0.15  # platform credits === SH PU's * 0.15
+
+# Batch request info of jobs which are not in a final state yet is cached for a short time,
+# as the same batch request is usually looked up several times in a row (listing, polling, ...)
+BATCH_REQUEST_INFO_CACHE_TTL = int(os.environ.get("BATCH_REQUEST_INFO_CACHE_TTL", "5"))  # seconds
+
+# Results (STAC item) of finished batch jobs are cached until their presigned URLs expire in less than this
+JOB_RESULTS_CACHE_MIN_VALIDITY = int(os.environ.get("JOB_RESULTS_CACHE_MIN_VALIDITY", str(24 * 60 * 60)))  # seconds
+# Results of at most this many jobs are cached by each process
+JOB_RESULTS_CACHE_MAX_SIZE = int(os.environ.get("JOB_RESULTS_CACHE_MAX_SIZE", "1000"))
+
+# Records of XYZ services are cached by each process, changes made through other processes are seen after this long
+SERVICE_RECORDS_CACHE_TTL = int(os.environ.get("SERVICE_RECORDS_CACHE_TTL", "10"))  # seconds
+SERVICE_RECORDS_CACHE_MAX_SIZE = int(os.environ.get("SERVICE_RECORDS_CACHE_MAX_SIZE", "10000"))
+
+# Batch jobs poller (batch_jobs_poller.py) periodically saves statuses of all unfinished batch jobs to job records.
+# When it is enabled, the API reads job statuses from job records instead of asking Sentinel Hub.
+BATCH_JOBS_POLLER_ENABLED = os.environ.get("BATCH_JOBS_POLLER_ENABLED", "false").lower() == "true"
+BATCH_JOBS_POLLER_INTERVAL = int(os.environ.get("BATCH_JOBS_POLLER_INTERVAL", "30"))  # seconds
+
+# Number of threads which run background tasks (e.g. waiting for the batch cost estimates) in the API process
+BACKGROUND_TASKS_WORKERS = int(os.environ.get("BACKGROUND_TASKS_WORKERS", "4"))
+
+# Batch cost estimates are computed in the background once Sentinel Hub finishes the analysis of the batch request
+BATCH_ESTIMATE_CHECK_INTERVAL = int(os.environ.get("BATCH_ESTIMATE_CHECK_INTERVAL", "5"))  # seconds
+BATCH_ESTIMATE_TIMEOUT = int(os.environ.get("BATCH_ESTIMATE_TIMEOUT", "600"))  # seconds
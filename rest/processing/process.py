@@ -44,6 +44,7 @@ from processing.utils import (
     parse_geojson,
     get_spatial_info_from_partial_processes,
     get_node_by_process_id,
+    get_output_options,
 )
 from authentication.user import User
 
@@ -81,6 +82,8 @@ class Process:
         self.width = width or self.get_dimensions()[0]
         self.height = height or self.get_dimensions()[1]
         self.sample_type = self.get_sample_type()
+        # options are used in post-processing, they are validated here so that invalid jobs aren't created
+        self.output_options = get_output_options(self.process_graph, self.mimetype)
         self.evalscript = self.get_evalscript()
 
     def convert_to_sh_bbox(self):
@@ -305,6 +308,28 @@ class Process:
 
         return temporal_intervals
 
+    def get_number_of_acquisitions(self):
+        """
+        Returns the expected number of acquisitions in the temporal extent of each load_collection node,
+        based on the temporal step of the collection (3 days if the step is unknown).
+        """
+        temporal_intervals = self.get_temporal_intervals()
+        n_acquisitions = {}
+        for node_id, temporal_interval in temporal_intervals.items():
+            if temporal_interval is None:
+                n_seconds_per_day = 86400
+                default_temporal_interval = 3
+                temporal_interval = default_temporal_interval * n_seconds_per_day
+
+            collection = self.collections[f"node_{node_id}"]
+            from_time = collection["from_time"]
+            to_time = collection["to_time"]
+
+            date_diff = (to_time - from_time).total_seconds()
+            n_acquisitions[node_id] = math.ceil(date_diff / temporal_interval) + 1
+
+        return n_acquisitions
+
     def get_maximum_temporal_extent_for_collection(self, load_collection_node):
         openeo_collection = collections.get_collection(load_collection_node["arguments"]["id"])
         from_time, to_time = openeo_collection.get("extent").get("temporal")["interval"][0]
@@ -514,22 +539,7 @@ class Process:
                 n_output_bands *= output_dimension["size"]
 
         if n_original_temporal_dimensions > 0:
-            temporal_intervals = self.get_temporal_intervals()
-
-            n_dates = 0
-            for node_id, temporal_interval in temporal_intervals.items():
-                if temporal_interval is None:
-                    n_seconds_per_day = 86400
-                    default_temporal_interval = 3
-                    temporal_interval = default_temporal_interval * n_seconds_per_day
-
-                collection = self.collections[f"node_{node_id}"]
-                from_time = collection["from_time"]
-                to_time = collection["to_time"]
-
-                date_diff = (to_time - from_time).total_seconds()
-                n_dates += math.ceil(date_diff / temporal_interval) + 1
-
+            n_dates = sum(self.get_number_of_acquisitions().values())
             n_output_bands *= n_dates * n_original_temporal_dimensions
 
         if self.mimetype == MimeType.PNG:
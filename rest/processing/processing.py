@@ -2,17 +2,36 @@ import json
 import time
 
 from pg_to_evalscript import convert_from_process_graph
-from flask import g
+from flask import current_app, g, has_app_context
 from sentinelhub import BatchRequestStatus, BatchUserAction, SentinelHubBatch
 
-from processing.const import ProcessingRequestTypes, SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE
+from processing.const import (
+    ProcessingRequestTypes,
+    SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE,
+    BATCH_REQUEST_INFO_CACHE_TTL,
+    BATCH_JOBS_POLLER_ENABLED,
+    BACKGROUND_TASKS_WORKERS,
+    BATCH_ESTIMATE_CHECK_INTERVAL,
+    BATCH_ESTIMATE_TIMEOUT,
+)
 from processing.process import Process
+from processing.pu_estimator import estimate_processing_units, estimate_processing_units_uncalibrated, pu_calibration
 from processing.sentinel_hub import SentinelHub
 from processing.partially_supported_processes import partially_supported_processes
 from dynamodb.utils import get_user_defined_processes_graphs
-from dynamodb import JobsPersistence
+from dynamodb import JobsPersistence, PostProcessingStatus
+from post_processing.post_processing import get_post_processing_status, start_post_processing, has_legacy_outputs
 from const import openEOBatchJobStatus
-from openeoerrors import InsufficientCredits, JobNotFound, Timeout
+from openeoerrors import EstimateNotReady, InsufficientCredits, JobNotFound
+from utils import BackgroundTasks, TTLCache
+
+
+# Batch requests in these states can't change anymore (unless they are restarted, which creates a new batch request)
+FINAL_BATCH_REQUEST_STATUSES = [BatchRequestStatus.DONE, BatchRequestStatus.FAILED, BatchRequestStatus.CANCELED]
+
+batch_request_info_cache = TTLCache(ttl=BATCH_REQUEST_INFO_CACHE_TTL)
+
+background_tasks = BackgroundTasks(max_workers=BACKGROUND_TASKS_WORKERS)
 
 
 def check_process_graph_conversion_validity(process_graph):
@@ -24,14 +43,14 @@ def check_process_graph_conversion_validity(process_graph):
     partially_supported_processes_as_udp = {
         partially_supported_process.process_id: {} for partially_supported_process in partially_supported_processes
     }
-    user_defined_processes_graphs = get_user_defined_processes_graphs()
+    user_defined_processes_graphs = get_user_defined_processes_graphs(process_graph)
     user_defined_processes_graphs.update(partially_supported_processes_as_udp)
     results = convert_from_process_graph(process_graph, user_defined_processes=user_defined_processes_graphs)
     return results[0]["invalid_node_id"]
 
 
 def new_process(process, width=None, height=None, request_type=None):
-    user_defined_processes_graphs = get_user_defined_processes_graphs()
+    user_defined_processes_graphs = get_user_defined_processes_graphs(process["process_graph"])
     return Process(
         process,
         width=width,
@@ -46,36 +65,65 @@ def new_sentinel_hub(deployment_endpoint=None):
     return SentinelHub(user=g.get("user"), service_base_url=deployment_endpoint)
 
 
+def run_in_background(key, func, *args, delay=0):
+    """
+    Runs the function in a background thread, with the app context and the user of the current request.
+    """
+    app = current_app._get_current_object()
+    user = g.get("user")
+
+    def run_with_request_user(*args):
+        with app.app_context():
+            g.user = user
+            return func(*args)
+
+    return background_tasks.submit(key, run_with_request_user, *args, delay=delay)
+
+
 def process_data_synchronously(process, width=None, height=None):
     p = new_process(process, width=width, height=height, request_type=ProcessingRequestTypes.SYNC)
 
-    # As we don't know before the execution of a sync job how much it will cost, we can check
-    # if the user has X amount of credits that will most likely cover the execution costs
+    # As we don't know before the execution of a sync job exactly how much it will cost, we check if the user
+    # has enough credits to cover the local estimate, but at least X amount of credits
+    estimated_pu = estimate_processing_units_uncalibrated(p)
     ten_credits_as_pu = 10 / SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE
-    check_leftover_credits(ten_credits_as_pu)
+    check_leftover_credits(max(estimated_pu * pu_calibration.factor, ten_credits_as_pu))
 
-    return p.execute_sync(), p.mimetype.get_string()
+    result = p.execute_sync()
+    pu_calibration.update(estimated_pu, g.get("processing_units_spent"))
+    return result, p.mimetype.get_string()
 
 
 def create_batch_job(process):
     return new_process(process, request_type=ProcessingRequestTypes.BATCH).create_batch_job()
 
 
-def start_new_batch_job(sentinel_hub, process, job_id):
-    new_batch_request_id, _ = create_batch_job(process)
-
+def start_new_batch_job(sentinel_hub, process, job_id, batch_request_info=None):
     job = JobsPersistence.get_by_id(job_id)
     if job is None:
         raise JobNotFound()
 
-    estimated_sentinelhub_pu, _, _ = create_or_get_estimate_values_from_db(job, new_batch_request_id)
+    # the process of the job doesn't change, so the estimate of the previous batch request can be used
+    estimate_values = get_estimate_values_from_db(job)
+    if estimate_values is None and batch_request_info is not None and batch_request_info.value_estimate is not None:
+        estimate_values = save_estimate_values(job, compute_batch_job_estimate(batch_request_info, process))
+
+    if estimate_values is not None:
+        estimated_sentinelhub_pu, _, _ = estimate_values
+    else:
+        estimated_sentinelhub_pu = estimate_processing_units(
+            new_process(process, request_type=ProcessingRequestTypes.BATCH)
+        )
 
     check_leftover_credits(estimated_sentinelhub_pu)
 
+    new_batch_request_id, _ = create_batch_job(process)
+
     JobsPersistence.update_key(
         job["id"], "sum_costs", str(round(float(job.get("sum_costs", 0)) + estimated_sentinelhub_pu, 3))
     )
     sentinel_hub.start_batch_job(new_batch_request_id)
+    JobsPersistence.update_status(job_id, openEOBatchJobStatus.QUEUED.value, batch_request_id=new_batch_request_id)
     g.user.report_usage(estimated_sentinelhub_pu, job_id)
     return new_batch_request_id
 
@@ -99,7 +147,7 @@ def start_batch_job(batch_request_id, process, deployment_endpoint, job_id):
     PROCESSING: we don't do anything
     """
     sentinel_hub = new_sentinel_hub(deployment_endpoint=deployment_endpoint)
-    batch_request_info = sentinel_hub.get_batch_request_info(batch_request_id)
+    batch_request_info = get_batch_request_info(batch_request_id, deployment_endpoint)
 
     if batch_request_info is None:
         return start_new_batch_job(sentinel_hub, process, job_id)
@@ -108,7 +156,13 @@ def start_batch_job(batch_request_id, process, deployment_endpoint, job_id):
         if job is None:
             raise JobNotFound()
 
-        estimated_sentinelhub_pu, _, _ = create_or_get_estimate_values_from_db(job, job["batch_request_id"])
+        try:
+            estimated_sentinelhub_pu, _, _ = create_or_get_estimate_values_from_db(job, job["batch_request_id"])
+        except EstimateNotReady:
+            # the job doesn't wait for Sentinel Hub analysis, local estimate is used instead
+            estimated_sentinelhub_pu = estimate_processing_units(
+                new_process(process, request_type=ProcessingRequestTypes.BATCH)
+            )
 
         check_leftover_credits(estimated_sentinelhub_pu)
 
@@ -116,26 +170,54 @@ def start_batch_job(batch_request_id, process, deployment_endpoint, job_id):
             job["id"], "sum_costs", str(round(float(job.get("sum_costs", 0)) + estimated_sentinelhub_pu, 3))
         )
         sentinel_hub.start_batch_job(batch_request_id)
+        invalidate_batch_request_info(batch_request_id)
+        JobsPersistence.update_status(job_id, openEOBatchJobStatus.QUEUED.value, batch_request_id=batch_request_id)
         g.user.report_usage(estimated_sentinelhub_pu, job_id)
     elif batch_request_info.status == BatchRequestStatus.PARTIAL:
         sentinel_hub.restart_batch_job(batch_request_id)
-    elif batch_request_info.status in [
-        BatchRequestStatus.DONE,
-        BatchRequestStatus.FAILED,
-        BatchRequestStatus.CANCELED,
-    ] or (
+        invalidate_batch_request_info(batch_request_id)
+        JobsPersistence.update_status(job_id, openEOBatchJobStatus.QUEUED.value, batch_request_id=batch_request_id)
+    elif batch_request_info.status in FINAL_BATCH_REQUEST_STATUSES or (
         batch_request_info.status == BatchRequestStatus.ANALYSING
         and batch_request_info.user_action == BatchUserAction.ANALYSE
     ):
-        return start_new_batch_job(sentinel_hub, process, job_id)
+        return start_new_batch_job(sentinel_hub, process, job_id, batch_request_info)
 
 
 def get_batch_request_info(batch_request_id, deployment_endpoint):
-    return new_sentinel_hub(deployment_endpoint=deployment_endpoint).get_batch_request_info(batch_request_id)
+    """
+    Batch request info is memoized for the duration of the API request and additionally cached
+    for a short time (BATCH_REQUEST_INFO_CACHE_TTL) across API requests.
+    """
+    memo = g.setdefault("batch_request_infos", {}) if has_app_context() else {}
+    if batch_request_id in memo:
+        return memo[batch_request_id]
+
+    batch_request_info = batch_request_info_cache.get(batch_request_id)
+    if batch_request_info is None:
+        batch_request_info = new_sentinel_hub(deployment_endpoint=deployment_endpoint).get_batch_request_info(
+            batch_request_id
+        )
+        # batch request info is None also when fetching it failed, so we don't cache that
+        if batch_request_info is not None:
+            batch_request_info_cache.set(batch_request_id, batch_request_info)
+
+    memo[batch_request_id] = batch_request_info
+    return batch_request_info
+
+
+def invalidate_batch_request_info(batch_request_id):
+    """
+    Should be called whenever we change the state of a batch request (start, restart, cancel, ...).
+    """
+    batch_request_info_cache.delete(batch_request_id)
+    if has_app_context():
+        g.get("batch_request_infos", {}).pop(batch_request_id, None)
 
 
 def cancel_batch_job(batch_request_id, process, deployment_endpoint):
     new_sentinel_hub(deployment_endpoint=deployment_endpoint).cancel_batch_job(batch_request_id)
+    invalidate_batch_request_info(batch_request_id)
     return create_batch_job(process)
 
 
@@ -153,28 +235,7 @@ def modify_batch_job(process):
     return create_batch_job(process)
 
 
-def get_batch_job_estimate(batch_request_id, process, deployment_endpoint):
-    sentinel_hub = new_sentinel_hub(deployment_endpoint=deployment_endpoint)
-
-    batch_request = sentinel_hub.get_batch_request_info(batch_request_id)
-
-    if batch_request.value_estimate is None:
-        analysis_sleep_time_s = 5
-        total_sleep_time = 0
-        MAX_TOTAL_TIME = 29
-        sentinel_hub.start_batch_job_analysis(batch_request_id)
-
-    while batch_request.value_estimate is None and batch_request.status in [
-        BatchRequestStatus.CREATED,
-        BatchRequestStatus.ANALYSING,
-    ]:
-        if total_sleep_time + analysis_sleep_time_s > MAX_TOTAL_TIME:
-            raise Timeout()
-
-        time.sleep(analysis_sleep_time_s)
-        total_sleep_time += analysis_sleep_time_s
-        batch_request = sentinel_hub.get_batch_request_info(batch_request_id)
-
+def compute_batch_job_estimate(batch_request, process):
     default_temporal_interval = 3
 
     # Note that the cost estimate does not take the multiplication factor of 1/3
@@ -186,7 +247,7 @@ def get_batch_job_estimate(batch_request_id, process, deployment_endpoint):
     # multiply by 2 to be on the safe side
     estimate_secure_factor = actual_pu_to_estimate_ratio * 2
 
-    user_defined_processes_graphs = get_user_defined_processes_graphs()
+    user_defined_processes_graphs = get_user_defined_processes_graphs(process["process_graph"])
     p = Process(
         process,
         user=g.get("user"),
@@ -211,37 +272,209 @@ def get_batch_job_estimate(batch_request_id, process, deployment_endpoint):
     return estimated_pu, estimated_file_size
 
 
-def get_batch_job_status(batch_request_id, deployment_endpoint):
-    batch_request_info = get_batch_request_info(batch_request_id, deployment_endpoint)
-    if batch_request_info is not None:
-        error = batch_request_info.error if batch_request_info.status == BatchRequestStatus.FAILED else None
-        return (
-            openEOBatchJobStatus.from_sentinelhub_batch_job_status(
-                batch_request_info.status, batch_request_info.user_action
-            ),
-            error,
+def get_batch_job_estimate(batch_request_id, process, deployment_endpoint):
+    """
+    Returns the estimate if the analysis of the batch request is done, otherwise None. It doesn't wait for the
+    analysis, but starts it if it hasn't been started yet.
+    """
+    batch_request = get_batch_request_info(batch_request_id, deployment_endpoint)
+    if batch_request is None:
+        return None
+
+    if batch_request.value_estimate is None:
+        if batch_request.status == BatchRequestStatus.CREATED:
+            new_sentinel_hub(deployment_endpoint=deployment_endpoint).start_batch_job_analysis(batch_request_id)
+            invalidate_batch_request_info(batch_request_id)
+        return None
+
+    return compute_batch_job_estimate(batch_request, process)
+
+
+def estimate_batch_job(job_id, started):
+    """
+    Background task which saves the estimate to the job record once the analysis of its batch request is done.
+    Returns the number of seconds after which it should be run again or None when it is finished.
+    """
+    job = JobsPersistence.get_by_id(job_id)
+    if JobsPersistence.is_deleted(job) or get_estimate_values_from_db(job) is not None:
+        return None
+
+    batch_request_info = get_batch_request_info(job["batch_request_id"], job["deployment_endpoint"])
+    if batch_request_info is None:
+        return None
+
+    if batch_request_info.value_estimate is not None:
+        save_estimate_values(job, compute_batch_job_estimate(batch_request_info, json.loads(job["process"])))
+        return None
+
+    if batch_request_info.status == BatchRequestStatus.CREATED:
+        new_sentinel_hub(deployment_endpoint=job["deployment_endpoint"]).start_batch_job_analysis(
+            job["batch_request_id"]
         )
+        invalidate_batch_request_info(job["batch_request_id"])
+    elif batch_request_info.status not in [BatchRequestStatus.ANALYSING, BatchRequestStatus.PROCESSING]:
+        # analysis failed or the batch request was canceled, the estimate will never be available
+        return None
+
+    if time.monotonic() - started > BATCH_ESTIMATE_TIMEOUT:
+        return None
+
+    return BATCH_ESTIMATE_CHECK_INTERVAL
+
+
+def start_batch_job_estimation(job_id, delay=0):
+    """
+    Saves the estimate of the job's batch request once its analysis is done, the job record has to reference
+    the batch request already.
+    """
+    run_in_background(f"estimate-{job_id}", estimate_batch_job, job_id, time.monotonic(), delay=delay)
+
+
+def get_status_from_batch_request_info(batch_request_info):
+    """
+    Returns openEO status and error of the batch request and whether the status is final.
+    """
+    if batch_request_info is None:
+        return openEOBatchJobStatus.FINISHED, None, False
+
+    error = batch_request_info.error if batch_request_info.status == BatchRequestStatus.FAILED else None
+    status = openEOBatchJobStatus.from_sentinelhub_batch_job_status(
+        batch_request_info.status, batch_request_info.user_action
+    )
+    return status, error, batch_request_info.status in FINAL_BATCH_REQUEST_STATUSES
+
+
+def has_saved_status(job):
+    return job.get("current_status") is not None and job.get("status_batch_request_id") == job["batch_request_id"]
+
+
+def save_batch_job_status(job, status, error, is_final):
+    """
+    Saves the status to the job record, but only if it differs from the one which is already saved.
+    """
+    if has_saved_status(job) and job["current_status"] == status.value and bool(job.get("status_final")) == is_final:
+        return
+
+    JobsPersistence.update_status(
+        job["id"], status.value, batch_request_id=job["batch_request_id"], error_msg=error, is_final=is_final
+    )
+
+
+def get_batch_job_status(job, post_process=True):
+    """
+    Returns openEO status and error of the job.
+    Once the batch request of the job reaches a final state, the status is saved to the job record
+    and Sentinel Hub is not asked about it anymore. When batch jobs poller is running, it keeps statuses
+    in job records up to date, so they are used for the other states as well.
+    Post-processing of results is only started with `post_process` (not when jobs are listed).
+    """
+    if has_saved_status(job) and (job.get("status_final") or BATCH_JOBS_POLLER_ENABLED):
+        status = openEOBatchJobStatus(job["current_status"])
+        error = job.get("error_msg") if status == openEOBatchJobStatus.ERROR else None
+        is_final = bool(job.get("status_final"))
     else:
+        batch_request_info = get_batch_request_info(job["batch_request_id"], job["deployment_endpoint"])
+        status, error, is_final = get_status_from_batch_request_info(batch_request_info)
+
+        if is_final or (BATCH_JOBS_POLLER_ENABLED and batch_request_info is not None):
+            save_batch_job_status(job, status, error, is_final)
+
+    if status == openEOBatchJobStatus.FINISHED and is_final:
+        return get_status_after_post_processing(job, post_process)
+
+    return status, error
+
+
+def get_status_after_post_processing(job, post_process=True):
+    """
+    Job whose batch request is done is reported as running until its results are post-processed.
+    With `post_process`, post-processing is started in the background if it isn't running yet.
+    """
+    post_processing_status = get_post_processing_status(job)
+    if post_processing_status is None and has_legacy_outputs(job):
+        # results were converted by an earlier version, which didn't record it, it is recorded now
+        JobsPersistence.mark_post_processed(job["id"], job["batch_request_id"])
+        post_processing_status = PostProcessingStatus.DONE
+
+    if post_processing_status == PostProcessingStatus.DONE:
         return openEOBatchJobStatus.FINISHED, None
+    if post_processing_status == PostProcessingStatus.ERROR:
+        return openEOBatchJobStatus.ERROR, job.get("post_processing_error")
 
+    if post_process:
+        start_post_processing(job)
+    return openEOBatchJobStatus.RUNNING, None
 
-def create_or_get_estimate_values_from_db(job, batch_request_id):
+
+def get_estimate_values_from_db(job):
     if float(job.get("estimated_sentinelhub_pu", 0)) == 0 and float(job.get("estimated_file_size", 0)) == 0:
-        estimated_sentinelhub_pu, estimated_file_size = get_batch_job_estimate(
-            batch_request_id, json.loads(job["process"]), job["deployment_endpoint"]
-        )
-        estimated_platform_credits = round(estimated_sentinelhub_pu * SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE, 3)
-        JobsPersistence.update_key(job["id"], "estimated_sentinelhub_pu", str(round(estimated_sentinelhub_pu, 3)))
-        JobsPersistence.update_key(job["id"], "estimated_platform_credits", str(estimated_platform_credits))
-        JobsPersistence.update_key(job["id"], "estimated_file_size", str(estimated_file_size))
-    else:
-        estimated_sentinelhub_pu = float(job.get("estimated_sentinelhub_pu", 0))
-        estimated_platform_credits = float(job.get("estimated_platform_credits", 0))
-        estimated_file_size = float(job.get("estimated_file_size", 0))
+        return None
+
+    estimated_sentinelhub_pu = float(job.get("estimated_sentinelhub_pu", 0))
+    estimated_platform_credits = float(job.get("estimated_platform_credits", 0))
+    estimated_file_size = float(job.get("estimated_file_size", 0))
+    return estimated_sentinelhub_pu, estimated_platform_credits, estimated_file_size
+
 
+def save_estimate_values(job, estimate):
+    estimated_sentinelhub_pu, estimated_file_size = estimate
+    estimated_platform_credits = round(estimated_sentinelhub_pu * SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE, 3)
+    JobsPersistence.update_fields(
+        job["id"],
+        {
+            "estimated_sentinelhub_pu": str(round(estimated_sentinelhub_pu, 3)),
+            "estimated_platform_credits": str(estimated_platform_credits),
+            "estimated_file_size": str(estimated_file_size),
+        },
+    )
     return estimated_sentinelhub_pu, estimated_platform_credits, estimated_file_size
 
 
+def get_reset_estimate_fields():
+    return {key: "0" for key in ["estimated_sentinelhub_pu", "estimated_platform_credits", "estimated_file_size"]}
+
+
+def create_or_get_estimate_values_from_db(job, batch_request_id):
+    """
+    Returns the estimate from the job record or computes it if the analysis of the batch request is already done.
+    Otherwise the estimation is continued in the background and EstimateNotReady is raised.
+    """
+    estimate_values = get_estimate_values_from_db(job)
+    if estimate_values is not None:
+        return estimate_values
+
+    estimate = get_batch_job_estimate(batch_request_id, json.loads(job["process"]), job["deployment_endpoint"])
+    if estimate is None:
+        start_batch_job_estimation(job["id"])
+        raise EstimateNotReady(retry_after=BATCH_ESTIMATE_CHECK_INTERVAL)
+
+    return save_estimate_values(job, estimate)
+
+
+def get_batch_request_id_fields(job, new_batch_request_id):
+    return {
+        "batch_request_id": new_batch_request_id,
+        "previous_batch_request_ids": [*json.loads(job["previous_batch_request_ids"]), job["batch_request_id"]],
+    }
+
+
+def update_batch_request_id(job_id, job, new_batch_request_id, fields=None):
+    """
+    Replaces the batch request of the job (and sets other `fields` of the job at the same time). If the job was
+    given another batch request in the meantime, the update is repeated with the current record, so that no
+    batch request is missing from previous batch requests.
+    """
+    while not JobsPersistence.update_fields(
+        job_id,
+        {**get_batch_request_id_fields(job, new_batch_request_id), **(fields or {})},
+        condition="batch_request_id = :batch_request_id",
+        condition_values={":batch_request_id": job["batch_request_id"]},
+    ):
+        job = JobsPersistence.get_by_id(job_id)
+        if job is None:
+            return
+
+
 def check_leftover_credits(estimated_pu):
     leftover_credits = g.user.get_leftover_credits()
     estimated_pu_as_credits = estimated_pu * SH_PU_TO_PLATFORM_CREDIT_CONVERSION_RATE
@@ -31,6 +31,8 @@ class ProcessingAPIRequest:
             raise Internal(f"Response does not contain 'x-processingunits-spent' header, {r.content}")
 
         g.user.report_usage(r.headers["x-processingunits-spent"])
+        # used for calibrating local estimates of processing units
+        g.processing_units_spent = float(r.headers["x-processingunits-spent"])
 
         return r.content
 
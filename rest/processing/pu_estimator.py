@@ -0,0 +1,93 @@
+import threading
+
+from openeo_collections.collections import collections
+from processing.const import ProcessingRequestTypes, SampleType
+
+
+# Processing units are computed as described in the Sentinel Hub docs:
+# https://docs.sentinel-hub.com/api/latest/api/overview/processing-unit/
+PU_BASE_AREA_PX = 512 * 512
+PU_BASE_N_BANDS = 3
+PU_MIN_AREA_MULTIPLIER = 0.01
+PU_MIN_PER_REQUEST = 0.005
+PU_FLOAT32_MULTIPLIER = 2
+PU_BATCH_MULTIPLIER = 1 / 3
+
+
+class ProcessingUnitsCalibration:
+    """
+    Keeps an exponential moving average of the ratio between the processing units which were actually spent
+    (`x-processingunits-spent` header of Processing API responses) and the local estimates.
+    """
+
+    def __init__(self, smoothing=0.1, min_factor=0.2, max_factor=5):
+        self.smoothing = smoothing
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self._factor = 1
+        self._lock = threading.Lock()
+
+    @property
+    def factor(self):
+        with self._lock:
+            return self._factor
+
+    def update(self, estimated_pu, spent_pu):
+        if not estimated_pu or spent_pu is None:
+            return
+
+        ratio = min(max(float(spent_pu) / estimated_pu, self.min_factor), self.max_factor)
+        with self._lock:
+            self._factor = (1 - self.smoothing) * self._factor + self.smoothing * ratio
+
+    def reset(self):
+        with self._lock:
+            self._factor = 1
+
+
+pu_calibration = ProcessingUnitsCalibration()
+
+
+def get_number_of_input_bands(process):
+    """
+    Returns the number of input bands of each load_collection node. If bands are not specified, all bands
+    of the collection are used.
+    """
+    load_collection_nodes = process.get_all_load_collection_nodes()
+    n_input_bands = {}
+    for node_id, load_collection_node in load_collection_nodes.items():
+        bands = load_collection_node["arguments"].get("bands")
+        if bands is None:
+            collection = collections.get_collection(load_collection_node["arguments"]["id"])
+            bands = collection["cube:dimensions"]["bands"]["values"]
+        n_input_bands[node_id] = len([band for band in bands if band != "dataMask"])
+    return n_input_bands
+
+
+def estimate_processing_units_uncalibrated(process, width=None, height=None):
+    n_pixels = (width or process.width) * (height or process.height)
+    area_multiplier = max(n_pixels / PU_BASE_AREA_PX, PU_MIN_AREA_MULTIPLIER)
+    sample_type_multiplier = PU_FLOAT32_MULTIPLIER if process.sample_type == SampleType.FLOAT32 else 1
+
+    if process.evalscript.mosaicking == "SIMPLE":
+        n_acquisitions = {node_id: 1 for node_id in process.get_all_load_collection_nodes()}
+    else:
+        n_acquisitions = process.get_number_of_acquisitions()
+
+    # with data fusion, processing units are computed for each collection separately and summed
+    estimated_pu = 0
+    for node_id, n_bands in get_number_of_input_bands(process).items():
+        estimated_pu += area_multiplier * n_bands / PU_BASE_N_BANDS * sample_type_multiplier * n_acquisitions[node_id]
+
+    if process.request_type == ProcessingRequestTypes.BATCH:
+        estimated_pu *= PU_BATCH_MULTIPLIER
+
+    return max(estimated_pu, PU_MIN_PER_REQUEST)
+
+
+def estimate_processing_units(process, width=None, height=None):
+    """
+    Returns the number of processing units the process is expected to use, without calling Sentinel Hub.
+    The estimate is calibrated against the processing units which were actually spent by previous requests.
+    """
+    return estimate_processing_units_uncalibrated(process, width=width, height=height) * pu_calibration.factor
@@ -1,5 +1,6 @@
 import os
 import json
+from datetime import timezone
 
 from sentinelhub import SentinelHubBatch
 from sentinelhub.exceptions import DownloadFailedException
@@ -154,21 +155,18 @@ class SentinelHub:
         )
         return batch_request.request_id
 
+    # Batch API calls below accept the batch request ID directly, so there is no need to fetch the batch request first
     def start_batch_job(self, batch_request_id):
-        batch_request = self.get_batch_request_info(batch_request_id)
-        self.batch.start_job(batch_request)
+        self.batch.start_job(batch_request_id)
 
     def restart_batch_job(self, batch_request_id):
-        batch_request = self.get_batch_request_info(batch_request_id)
-        self.batch.restart_job(batch_request)
+        self.batch.restart_job(batch_request_id)
 
     def cancel_batch_job(self, batch_request_id):
-        batch_request = self.get_batch_request_info(batch_request_id)
-        self.batch.cancel_job(batch_request)
+        self.batch.cancel_job(batch_request_id)
 
     def delete_batch_job(self, batch_request_id):
-        batch_request = self.get_batch_request_info(batch_request_id)
-        self.batch.delete_request(batch_request)
+        self.batch.delete_request(batch_request_id)
 
     def get_batch_request_info(self, batch_request_id):
         try:
@@ -176,9 +174,29 @@ class SentinelHub:
         except DownloadFailedException as e:
             return None
 
+    def iter_batch_requests(self, batch_request_ids, created_after=None):
+        """
+        Lists batch requests of the account (newest first) and yields the ones with given IDs.
+        Listing stops once all of them are found or when it reaches batch requests created before `created_after`.
+        """
+        remaining_batch_request_ids = set(batch_request_ids)
+        for batch_request in self.batch.iter_requests(sort="created:desc"):
+            if not remaining_batch_request_ids:
+                return
+
+            if created_after is not None and batch_request.created is not None:
+                created = batch_request.created
+                if created.tzinfo is None:
+                    created = created.replace(tzinfo=timezone.utc)
+                if created < created_after:
+                    return
+
+            if batch_request.request_id in remaining_batch_request_ids:
+                remaining_batch_request_ids.remove(batch_request.request_id)
+                yield batch_request
+
     def start_batch_job_analysis(self, batch_request_id):
-        batch_request = self.batch.get_request(batch_request_id)
-        self.batch.start_analysis(batch_request)
+        self.batch.start_analysis(batch_request_id)
 
     def get_utm_tiling_grids(self):
         tiling_grids = []
@@ -4,9 +4,10 @@ import copy
 from pyproj import CRS, Transformer
 from shapely.geometry import shape, mapping
 from pg_to_evalscript.process_graph_utils import get_dependencies, get_dependents
-from sentinelhub import ResamplingType
+from sentinelhub import ResamplingType, MimeType
 
-from openeoerrors import UnsupportedGeometry
+from openeoerrors import UnsupportedGeometry, ProcessParameterInvalid
+from processing.const import CustomMimeType
 
 
 def iterate(obj):
@@ -295,6 +296,119 @@ def get_node_by_process_id(process_graph, process_id):
             return node
 
 
+def get_gtiff_options(process_graph):
+    """
+    Returns options of GeoTIFF outputs of batch jobs from the save_result node:
+    - cog: write Cloud Optimized GeoTIFFs (with internal overviews),
+    - compression: "deflate", "zstd", "lzw" or None,
+    - predictor: 1 (none), 2 (horizontal differencing) or 3 (floating point),
+    - overviews: decimation factors of overviews or None (chosen automatically for COGs, none otherwise).
+    """
+    options = get_node_by_process_id(process_graph, "save_result")["arguments"].get("options") or {}
+
+    compression = options.get("compression")
+    if compression is not None:
+        compression = compression.lower()
+        if compression == "none":
+            compression = None
+        elif compression not in ["deflate", "zstd", "lzw"]:
+            raise ProcessParameterInvalid("options", "save_result", f"{compression} is not a supported 'compression'.")
+
+    predictor = options.get("predictor", 1)
+    if predictor not in [1, 2, 3]:
+        raise ProcessParameterInvalid("options", "save_result", f"{predictor} is not a supported 'predictor'.")
+    if predictor != 1 and compression is None:
+        raise ProcessParameterInvalid("options", "save_result", "'predictor' can only be used with 'compression'.")
+    if predictor == 3 and options.get("datatype", "float32").lower() != "float32":
+        raise ProcessParameterInvalid(
+            "options", "save_result", "'predictor' 3 (floating point) can only be used with 'datatype' float32."
+        )
+
+    overviews = options.get("overviews")
+    if overviews is not None and (
+        not isinstance(overviews, list)
+        or not all(isinstance(factor, int) and factor > 1 for factor in overviews)
+        or overviews != sorted(set(overviews))
+    ):
+        raise ProcessParameterInvalid(
+            "options", "save_result", "'overviews' must be a list of increasing decimation factors greater than 1."
+        )
+
+    return {
+        "cog": bool(options.get("cog", False)),
+        "compression": compression,
+        "predictor": predictor,
+        "overviews": overviews,
+    }
+
+
+def get_datacube_encoding_options(process_graph):
+    """
+    Returns encoding options of NetCDF and Zarr outputs of batch jobs from the save_result node:
+    - compression: "zlib", "zstd", "none" or None (format's default: NetCDF isn't compressed, Zarr is compressed
+      with Blosc LZ4),
+    - compression_level: 1 (fastest) - 9 (smallest),
+    - shuffle: whether bytes of values are shuffled before compression (usually compresses better),
+    - chunking: "spatial" (chunks hold a block of pixels of one timestamp), "time_series" (chunks hold a smaller
+      block of pixels of all timestamps) or None (format's default).
+    """
+    options = get_node_by_process_id(process_graph, "save_result")["arguments"].get("options") or {}
+
+    compression = options.get("compression")
+    if compression is not None:
+        compression = compression.lower()
+        if compression not in ["none", "zlib", "zstd"]:
+            raise ProcessParameterInvalid("options", "save_result", f"{compression} is not a supported 'compression'.")
+
+    compression_level = options.get("compression_level", 4)
+    if not isinstance(compression_level, int) or not 1 <= compression_level <= 9:
+        raise ProcessParameterInvalid("options", "save_result", "'compression_level' must be an integer from 1 to 9.")
+
+    chunking = options.get("chunking")
+    if chunking is not None and chunking not in ["spatial", "time_series"]:
+        raise ProcessParameterInvalid("options", "save_result", f"{chunking} is not a supported 'chunking'.")
+
+    return {
+        "compression": compression,
+        "compression_level": compression_level,
+        "shuffle": bool(options.get("shuffle", True)),
+        "chunking": chunking,
+    }
+
+
+def get_output_options(process_graph, mimetype):
+    """
+    Returns options of the output format which are applied in post-processing of batch job results.
+    """
+    if mimetype == MimeType.TIFF:
+        return get_gtiff_options(process_graph)
+    if mimetype in [CustomMimeType.NETCDF, CustomMimeType.ZARR]:
+        return get_datacube_encoding_options(process_graph)
+    return None
+
+
+def get_spatial_extent_geometry(process_graph):
+    """
+    Returns GeoJSON geometry (in EPSG:4326) of the spatial extent of load_collection and its bbox, or None (for both)
+    if the extent is not given.
+    """
+    load_collection_node = get_node_by_process_id(process_graph, "load_collection")
+    spatial_extent = load_collection_node["arguments"].get("spatial_extent") if load_collection_node else None
+    if not spatial_extent:
+        return None, None
+
+    if is_geojson(spatial_extent):
+        geometry = shape(parse_geojson(spatial_extent))
+    elif all(
+        isinstance(spatial_extent.get(direction), (int, float)) for direction in ["west", "south", "east", "north"]
+    ):
+        geometry = shape(convert_extent_to_geojson(convert_extent_to_epsg4326(spatial_extent)))
+    else:
+        # extent is given by parameters (e.g. of XYZ services)
+        return None, None
+    return mapping(geometry), list(geometry.bounds)
+
+
 def get_all_load_collection_nodes(process_graph):
     nodes = {}
     for node_id, node in process_graph.items():
@@ -10,7 +10,7 @@ from marshmallow import Schema, fields, validates, ValidationError, validate, va
 from openeo_pg_parser.validate import validate_process_graph
 from openeo_collections.collections import collections
 from processing.processing import check_process_graph_conversion_validity
-from dynamodb.utils import get_all_user_defined_processes
+from dynamodb.utils import get_user_defined_processes
 from const import global_parameters_xyz
 from utils import get_all_process_definitions, get_parameter_defs_dict, enrich_user_defined_processes_with_parameters
 
@@ -20,7 +20,7 @@ def validate_graph_with_known_processes(graph, parameters=None):
     current_directory = os.path.dirname(path_to_current_file)
     collections_src = collections.get_collections()
     process_definitions = get_all_process_definitions()
-    user_defined_processes = get_all_user_defined_processes()
+    user_defined_processes = get_user_defined_processes(graph)
     user_defined_processes = enrich_user_defined_processes_with_parameters(user_defined_processes)
     process_definitions += user_defined_processes
 
@@ -1,7 +1,12 @@
 import os
 import json
 import glob
+import queue
+import threading
+import time
+import traceback
 import warnings
+from logging import log, ERROR
 
 from sentinelhub.time_utils import parse_time
 
@@ -114,3 +119,143 @@ def get_roles(object_key):
     if object_key.lower().endswith(".json"):
         return ["metadata"]
     return ["data"]
+
+
+def get_zarr_store_key(object_key):
+    """
+    Returns the key of the Zarr store the object belongs to or None if it isn't a part of a Zarr store.
+    """
+    store_key, separator, _ = object_key.partition(".zarr/")
+    if not separator:
+        return None
+    return f"{store_key}.zarr"
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache. Entries expire `ttl` seconds after they were set. If `max_size` is given, entries
+    which were set the longest time ago are evicted to make room for new ones.
+    """
+
+    def __init__(self, ttl, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            # entries are kept in the order they were set in, expired entries are dropped from the oldest on
+            # (until the first one which is still valid), so that keys which are never read again don't pile up
+            while self._entries:
+                oldest_key = next(iter(self._entries))
+                if self._entries[oldest_key][1] > now:
+                    break
+                del self._entries[oldest_key]
+            self._entries.pop(key, None)
+            while self.max_size is not None and self._entries and len(self._entries) >= self.max_size:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (value, now + (self.ttl if ttl is None else ttl))
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BackgroundTasks:
+    """
+    Runs tasks in a pool of daemon threads, so they don't hold the threads which serve API requests.
+    A task can ask to be run again by returning the number of seconds to wait before the next run.
+    Only one task with the same key is scheduled at a time.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._queue = queue.Queue()
+        self._keys = set()
+        self._timers = {}
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args, delay=0):
+        """
+        Returns False if a task with the same key is already scheduled.
+        """
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+
+            # workers are started lazily so that importing the module doesn't start any threads
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+        self._schedule((key, func, args), delay)
+        return True
+
+    def _schedule(self, task, delay):
+        key = task[0]
+        with self._lock:
+            if key not in self._keys:
+                return
+
+            if not delay:
+                self._queue.put(task)
+                return
+
+            timer = threading.Timer(delay, self._queue.put, args=(task,))
+            timer.daemon = True
+            self._timers[key] = timer
+            timer.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            key, func, args = task
+            with self._lock:
+                self._timers.pop(key, None)
+                if key not in self._keys:
+                    continue
+
+            try:
+                delay = func(*args)
+            except Exception:
+                log(ERROR, f"Background task {key} failed: {traceback.format_exc()}")
+                delay = None
+
+            if delay is None:
+                with self._lock:
+                    self._keys.discard(key)
+            else:
+                self._schedule(task, delay)
+
+    def clear(self):
+        """
+        Drops all scheduled tasks. Tasks which are already running are not interrupted, but won't be run again.
+        """
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._keys.clear()
+            while not self._queue.empty():
+                self._queue.get_nowait()
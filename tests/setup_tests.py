@@ -20,15 +20,22 @@ from mocked_batch_request import create_mocked_batch_request
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rest"))
 from app import app
-from dynamodb import JobsPersistence, ProcessGraphsPersistence, ServicesPersistence
+from dynamodb import (
+    JobsPersistence,
+    ProcessGraphsPersistence,
+    ServicesPersistence,
+    PostProcessingTasksPersistence,
+    PostProcessingStatus,
+)
 from openeo_collections.collections import collections, CollectionsProvider
 from authentication.authentication import AuthenticationProvider, authentication_provider
 from authentication.user import SHUser, User
 from processing.process import Process
 from processing.sentinel_hub import SentinelHub
-from processing.processing import delete_batch_job
+from processing.processing import delete_batch_job, batch_request_info_cache, background_tasks
 from openeoerrors import ProcessGraphComplexity, ImageDimensionInvalid
-from buckets import get_bucket
+from buckets import get_bucket, utils as buckets_utils
+from buckets.purge import purge_job, purge_tasks
 
 
 FIXTURES_FOLDER = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -316,6 +323,7 @@ def setup_function(function):
     ProcessGraphsPersistence.ensure_table_exists()
     JobsPersistence.ensure_table_exists()
     ServicesPersistence.ensure_table_exists()
+    PostProcessingTasksPersistence.ensure_table_exists()
     collections.set_collections(load_collections_fixtures("fixtures/collection_information/"))
 
 
@@ -323,4 +331,7 @@ def teardown_function(function):
     ProcessGraphsPersistence.clear_table()
     JobsPersistence.clear_table()
     ServicesPersistence.clear_table()
+    PostProcessingTasksPersistence.clear_table()
     collections.set_collections(None)
+    batch_request_info_cache.clear()
+    background_tasks.clear()
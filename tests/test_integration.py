@@ -1420,6 +1420,38 @@ def test_batch_job_estimate(
     assert data["size"] == expected_file_size
 
 
+@with_mocked_auth
+def test_batch_job_estimate_pending(app_client, example_process_graph, example_authorization_header_with_oidc):
+    responses.add(
+        responses.POST,
+        re.compile("https://(services|creodias)(-uswest2)?.sentinel-hub.com/api/v1/batch/process"),
+        body=json.dumps({"id": "example", "processRequest": {}, "status": "CREATED", "tileCount": 1}),
+    )
+    responses.add(
+        responses.GET,
+        re.compile("https://(services|creodias)(-uswest2)?.sentinel-hub.com/api/v1/batch/tilinggrids"),
+        body=json.dumps(tilinggrids_response),
+    )
+    responses.add(
+        responses.GET,
+        re.compile("https://(services|creodias)(-uswest2)?.sentinel-hub.com/api/v1/batch/process/example"),
+        body=json.dumps(
+            {"id": "example", "processRequest": {}, "status": "ANALYSING", "userAction": "ANALYSE", "tileCount": 1}
+        ),
+    )
+
+    data = {"process": {"process_graph": example_process_graph}}
+    r = app_client.post(
+        "/jobs", data=json.dumps(data), headers=example_authorization_header_with_oidc, content_type="application/json"
+    )
+    assert r.status_code == 201, r.data
+    job_id = r.headers["OpenEO-Identifier"]
+
+    r = app_client.get(f"/jobs/{job_id}/estimate", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 202, r.data
+    assert int(r.headers["Retry-After"]) > 0
+
+
 @responses.activate
 def test_user_workspace(app_client, example_authorization_header_with_oidc, example_process_graph):
     """
@@ -1691,6 +1723,8 @@ def test_job_with_deleted_batch_request(app_client, example_process_graph):
     # but the signed url for it is added to the "links" in the response to /jobs/<job_id>/results
     expected_num_assets = 0
     assert len(actual["assets"]) == expected_num_assets
+    # batch requests which don't exist anymore have no results to post-process
+    assert JobsPersistence.get_by_id(record_id).get("post_processing_status") is None
 
     r = app_client.post(f"/jobs/{record_id}/results", headers=headers)
     assert r.status_code == 202, r.data
@@ -1699,6 +1733,203 @@ def test_job_with_deleted_batch_request(app_client, example_process_graph):
     assert r.status_code == 204, r.data
 
 
+@with_mocked_auth
+def test_job_results_after_post_processing(app_client, example_process_graph, example_authorization_header_with_oidc):
+    """
+    Job whose batch request is done is reported as finished only once its results are post-processed
+    """
+    batch_request_id = "9d5f8a84-7a53-4d5b-9c39-5a2f6d4e1b01"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "example-id",
+            "process": {"process_graph": example_process_graph},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    JobsPersistence.update_status(job_id, "finished", batch_request_id=batch_request_id, is_final=True)
+    # post-processing is in progress (claimed by another worker)
+    assert JobsPersistence.claim_post_processing(job_id, batch_request_id, 600)
+
+    r = app_client.get(f"/jobs/{job_id}", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 200, r.data
+    assert r.json["status"] == "running"
+    r = app_client.get(f"/jobs/{job_id}/results", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 400, r.data
+    assert r.json["code"] == "JobNotFinished"
+
+    JobsPersistence.update_post_processing_status(
+        job_id, batch_request_id, PostProcessingStatus.ERROR, error_msg="Post-processing of results failed."
+    )
+    r = app_client.get(f"/jobs/{job_id}", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 200, r.data
+    assert r.json["status"] == "error"
+    assert r.json["error"] == "Post-processing of results failed."
+    r = app_client.get(f"/jobs/{job_id}/results", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 424, r.data
+    assert r.json["message"] == "Post-processing of results failed."
+
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+    r = app_client.get("/jobs", headers=example_authorization_header_with_oidc)
+    assert r.status_code == 200, r.data
+    assert [job["status"] for job in r.json["jobs"] if job["id"] == job_id] == ["finished"]
+    bucket = get_bucket(JobsPersistence.get_by_id(job_id)["deployment_endpoint"])
+    try:
+        r = app_client.get(f"/jobs/{job_id}/results", headers=example_authorization_header_with_oidc)
+        assert r.status_code == 200, r.data
+        assert r.json["assets"] == {}
+    finally:
+        bucket.delete_objects(bucket.get_data_from_bucket(prefix=batch_request_id))
+
+
+@with_mocked_auth
+def test_job_with_legacy_results(app_client, example_process_graph, example_authorization_header_with_oidc):
+    """
+    Results which were converted before post-processing was recorded are not converted again
+    """
+    batch_request_id = "0b8e1c55-3f0e-4d49-8f0a-6c1e2d7b9a02"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "example-id",
+            "process": {"process_graph": example_process_graph},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    JobsPersistence.update_status(job_id, "finished", batch_request_id=batch_request_id, is_final=True)
+    bucket = get_bucket(JobsPersistence.get_by_id(job_id)["deployment_endpoint"])
+    output_key = f"{batch_request_id}/tile_0/output_2019-08-16.tif"
+    bucket.put_file_to_bucket("", prefix=f"{batch_request_id}/tile_0", file_name="output_2019-08-16.tif")
+
+    try:
+        r = app_client.get(f"/jobs/{job_id}", headers=example_authorization_header_with_oidc)
+        assert r.status_code == 200, r.data
+        assert r.json["status"] == "finished"
+        job = JobsPersistence.get_by_id(job_id)
+        assert job["post_processing_batch_request_id"] == batch_request_id
+        assert job["post_processing_status"] == PostProcessingStatus.DONE.value
+
+        r = app_client.get(f"/jobs/{job_id}/results", headers=example_authorization_header_with_oidc)
+        assert r.status_code == 200, r.data
+        assert list(r.json["assets"]) == [output_key]
+    finally:
+        bucket.delete_objects(bucket.get_data_from_bucket(prefix=batch_request_id))
+
+
+@with_mocked_auth
+def test_job_results_asset(app_client, example_process_graph, example_authorization_header_with_oidc):
+    """
+    Assets of job results are only signed once the job is finished and only if they belong to the job
+    """
+    batch_request_id = "7c2e9b14-1d4f-4a8e-b5c3-8e0f6a2d9c04"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "example-id",
+            "process": {"process_graph": example_process_graph},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    JobsPersistence.update_status(job_id, "finished", batch_request_id=batch_request_id, is_final=True)
+    assert JobsPersistence.claim_post_processing(job_id, batch_request_id, 600)
+    asset_url = f"/jobs/{job_id}/results/assets/{batch_request_id}/tile_0/output.zarr/.zmetadata"
+
+    r = app_client.get(asset_url, headers=example_authorization_header_with_oidc)
+    assert r.status_code == 400, r.data
+    assert r.json["code"] == "JobNotFinished"
+
+    JobsPersistence.update_post_processing_status(
+        job_id, batch_request_id, PostProcessingStatus.ERROR, error_msg="Post-processing of results failed."
+    )
+    r = app_client.get(asset_url, headers=example_authorization_header_with_oidc)
+    assert r.status_code == 424, r.data
+    assert r.json["message"] == "Post-processing of results failed."
+
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+    r = app_client.get(asset_url, headers=example_authorization_header_with_oidc)
+    assert r.status_code == 302, r.data
+    assert f"/{batch_request_id}/tile_0/output.zarr/.zmetadata" in r.headers["Location"]
+
+    for object_key in [
+        "0b8e1c55-3f0e-4d49-8f0a-6c1e2d7b9a02/tile_0/output.nc",
+        f"{batch_request_id}/../0b8e1c55-3f0e-4d49-8f0a-6c1e2d7b9a02/tile_0/output.nc",
+        f"{batch_request_id}//output.nc",
+    ]:
+        r = app_client.get(
+            f"/jobs/{job_id}/results/assets/{object_key}", headers=example_authorization_header_with_oidc
+        )
+        assert r.status_code == 404, r.data
+        assert r.json["code"] == "AssetNotFound"
+
+
+class PurgedBucket:
+    """
+    Results bucket whose objects can't be deleted until `deletable` is set.
+    """
+
+    def __init__(self, object_keys):
+        self.object_keys = list(object_keys)
+        self.deletable = False
+        self.n_delete_attempts = 0
+
+    def get_data_from_bucket(self, prefix=None, max_keys=None):
+        return [{"Key": key} for key in self.object_keys if key.startswith(prefix)]
+
+    def delete_objects(self, objects_to_delete, max_workers=1):
+        self.n_delete_attempts += 1
+        if not self.deletable:
+            return len(objects_to_delete)
+        keys = [obj["Key"] for obj in objects_to_delete]
+        self.object_keys = [key for key in self.object_keys if key not in keys]
+        return 0
+
+
+@with_mocked_auth
+def test_delete_job_keeps_job_until_results_are_purged(
+    app_client, example_process_graph, example_authorization_header_with_oidc
+):
+    """
+    Deleted job is hidden from its user, but kept until all of its results are deleted
+    """
+    deployment_endpoint = "https://purge-test.sentinel-hub.com"
+    batch_request_id = "5d6a0f9e-0c1e-4b5e-9a57-2f8f5c3d1e03"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "example-id",
+            "process": {"process_graph": example_process_graph},
+            "batch_request_id": batch_request_id,
+            "deployment_endpoint": deployment_endpoint,
+        }
+    )
+    bucket = PurgedBucket([f"{batch_request_id}/tile_0/output.nc", f"{batch_request_id}/manifest.json"])
+    buckets_utils.buckets[deployment_endpoint] = bucket
+
+    try:
+        r = app_client.delete(f"/jobs/{job_id}", headers=example_authorization_header_with_oidc)
+        assert r.status_code == 204, r.data
+
+        r = app_client.get(f"/jobs/{job_id}", headers=example_authorization_header_with_oidc)
+        assert r.status_code == 404
+        r = app_client.get("/jobs", headers=example_authorization_header_with_oidc)
+        assert job_id not in [job["id"] for job in r.json["jobs"]]
+
+        # results couldn't be deleted, the purge is retried later
+        for _ in range(100):
+            if bucket.n_delete_attempts > 0:
+                break
+            time.sleep(0.05)
+        assert bucket.n_delete_attempts > 0
+        assert JobsPersistence.get_by_id(job_id)["user_id"] == JobsPersistence.PURGE_PENDING_USER_ID
+        assert job_id in [job["id"] for job in JobsPersistence.query_purge_pending()]
+        assert job_id not in [job["id"] for job in JobsPersistence.scan_jobs_without_final_status()]
+
+        bucket.deletable = True
+        assert purge_job(job_id, deployment_endpoint, [batch_request_id]) is None
+        assert bucket.object_keys == []
+        assert JobsPersistence.get_by_id(job_id) is None
+    finally:
+        purge_tasks.clear()
+        buckets_utils.buckets.pop(deployment_endpoint, None)
+        JobsPersistence.delete(job_id)
+
+
 @with_mocked_auth
 @with_mocked_reporting
 @with_mocked_batch_request_info
@@ -1,7 +1,17 @@
 from setup_tests import *
 from datetime import datetime, timedelta, timezone
+import io
+import pickle
+import threading
+from types import SimpleNamespace
 
 from shapely.geometry import shape, mapping
+import xarray as xr
+import rioxarray
+import rasterio
+import zarr
+from rasterio.transform import from_origin
+from botocore.exceptions import ClientError
 
 from openeoerrors import (
     AuthenticationRequired,
@@ -12,15 +22,46 @@ from openeoerrors import (
     TokenInvalid,
     UnsupportedGeometry,
     TemporalExtentError,
+    EstimateNotReady,
+)
+from processing.utils import (
+    inject_variables_in_process_graph,
+    validate_geojson,
+    parse_geojson,
+    get_gtiff_options,
+    get_datacube_encoding_options,
+    get_spatial_extent_geometry,
 )
-from processing.utils import inject_variables_in_process_graph, validate_geojson, parse_geojson
 from processing.sentinel_hub import SentinelHub
 from processing.partially_supported_processes import FilterBBox, FilterSpatial, ResampleSpatial
 from processing.processing_api_request import ProcessingAPIRequest
 from processing.openeo_process_errors import NoDataAvailable
-from processing.const import ProcessingRequestTypes
+from processing.const import ProcessingRequestTypes, CustomMimeType
 from fixtures.geojson_fixtures import GeoJSON_Fixtures
-from utils import get_roles
+from utils import get_roles, get_zarr_store_key, TTLCache, BackgroundTasks
+from buckets.results_bucket import ResultsBucket, CreodiasResultsBucket, S3_MAX_POOL_CONNECTIONS
+from processing.pu_estimator import estimate_processing_units, ProcessingUnitsCalibration, pu_calibration
+from processing.processing import get_batch_job_status, batch_request_info_cache
+from const import openEOBatchJobStatus
+from dynamodb import PostProcessingStatus
+from post_processing.post_processing import update_queued_post_processing, upload_output_to_bucket, upload_pool
+from post_processing.mosaic import MosaicGrid, get_aligned_chunk_size, mosaic_multitemporal_gtiffs_to_format
+from post_processing.gtiff_parser import (
+    get_output_chunks,
+    open_multitemporal_gtiff,
+    parse_multitemporal_gtiff_to_format,
+)
+from post_processing.const import parsed_output_file_name
+from app import group_job_result_items, get_service_record, service_records_cache, handle_exception
+from dynamodb.utils import get_process_ids, get_user_defined_processes_graphs
+from post_processing.manifest import (
+    create_manifest,
+    get_pending_tiles,
+    complete_tile,
+    complete_manifest,
+    get_manifest_result_keys,
+    is_output_key,
+)
 
 from flask import g
 from authentication.user import User
@@ -996,6 +1037,169 @@ def test_get_roles(filename, expected_roles):
     assert roles == expected_roles
 
 
+@pytest.mark.parametrize(
+    "object_key,expected_store_key",
+    [
+        ("1235467/tile/output.zarr/.zmetadata", "1235467/tile/output.zarr"),
+        ("1235467/tile/output.zarr/__xarray_dataarray_variable__/0.0.0", "1235467/tile/output.zarr"),
+        ("1235467/output_32633.zarr/x/0", "1235467/output_32633.zarr"),
+        ("1235467/tile/output.zarr.zip", None),
+        ("1235467/tile/output.nc", None),
+    ],
+)
+def test_get_zarr_store_key(object_key, expected_store_key):
+    assert get_zarr_store_key(object_key) == expected_store_key
+
+
+def test_group_job_result_items():
+    result_assets = [
+        ("1235467/output_32633.nc", "1235467/output_32633.nc"),
+        ("1235467/tile_0/default.tif", "1235467/tile_0/default.tif"),
+        ("1235467/tile_0/output.zarr", None),
+        ("1235467/tile_1/output_2020-01-01.tif", "1235467/tile_1/output_2020-01-01.tif"),
+    ]
+    assert group_job_result_items("1235467", result_assets) == {
+        "output_32633": [result_assets[0]],
+        "tile_0": result_assets[1:3],
+        "tile_1": [result_assets[3]],
+    }
+
+
+@pytest.mark.parametrize(
+    "spatial_extent,expected_geometry,expected_bbox",
+    [
+        (None, None, None),
+        ({"from_parameter": "spatial_extent_west"}, None, None),
+        (
+            {"west": 12.0, "south": 46.0, "east": 13.0, "north": 47.0},
+            {
+                "type": "Polygon",
+                "coordinates": (((12.0, 46.0), (13.0, 46.0), (13.0, 47.0), (12.0, 47.0), (12.0, 46.0)),),
+            },
+            [12.0, 46.0, 13.0, 47.0],
+        ),
+        (
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[12.0, 46.0], [13.0, 46.0], [12.5, 47.0], [12.0, 46.0]]],
+                },
+            },
+            {"type": "Polygon", "coordinates": (((12.0, 46.0), (13.0, 46.0), (12.5, 47.0), (12.0, 46.0)),)},
+            [12.0, 46.0, 13.0, 47.0],
+        ),
+    ],
+)
+def test_get_spatial_extent_geometry(spatial_extent, expected_geometry, expected_bbox):
+    process_graph = {
+        "loadco1": {
+            "process_id": "load_collection",
+            "arguments": {"id": "sentinel-2-l1c", "spatial_extent": spatial_extent, "temporal_extent": None},
+        },
+        "result1": {
+            "process_id": "save_result",
+            "arguments": {"data": {"from_node": "loadco1"}, "format": "gtiff"},
+            "result": True,
+        },
+    }
+    geometry, bbox = get_spatial_extent_geometry(process_graph)
+    assert geometry == expected_geometry
+    assert bbox == expected_bbox
+
+
+@pytest.mark.parametrize(
+    "options,expected_gtiff_options,should_raise_error",
+    [
+        (None, {"cog": False, "compression": None, "predictor": 1, "overviews": None}, False),
+        ({"datatype": "uint16"}, {"cog": False, "compression": None, "predictor": 1, "overviews": None}, False),
+        (
+            {"cog": True, "compression": "ZSTD", "predictor": 3, "overviews": [2, 4, 8]},
+            {"cog": True, "compression": "zstd", "predictor": 3, "overviews": [2, 4, 8]},
+            False,
+        ),
+        (
+            {"compression": "none", "overviews": [2]},
+            {"cog": False, "compression": None, "predictor": 1, "overviews": [2]},
+            False,
+        ),
+        ({"compression": "jpeg"}, None, True),
+        ({"predictor": 2}, None, True),
+        ({"compression": "deflate", "predictor": 4}, None, True),
+        ({"compression": "deflate", "predictor": 3, "datatype": "uint16"}, None, True),
+        ({"overviews": [4, 2]}, None, True),
+        ({"overviews": [1, 2]}, None, True),
+        ({"overviews": 2}, None, True),
+    ],
+)
+def test_get_gtiff_options(options, expected_gtiff_options, should_raise_error):
+    arguments = {"data": {"from_node": "loadco1"}, "format": "gtiff"}
+    if options is not None:
+        arguments["options"] = options
+    process_graph = {"result1": {"process_id": "save_result", "arguments": arguments, "result": True}}
+
+    if should_raise_error:
+        with pytest.raises(ProcessParameterInvalid):
+            get_gtiff_options(process_graph)
+    else:
+        assert get_gtiff_options(process_graph) == expected_gtiff_options
+
+
+@pytest.mark.parametrize(
+    "options,expected_encoding_options,should_raise_error",
+    [
+        (None, {"compression": None, "compression_level": 4, "shuffle": True, "chunking": None}, False),
+        (
+            {"compression": "ZSTD", "compression_level": 9, "shuffle": False, "chunking": "time_series"},
+            {"compression": "zstd", "compression_level": 9, "shuffle": False, "chunking": "time_series"},
+            False,
+        ),
+        (
+            {"compression": "none", "chunking": "spatial"},
+            {"compression": "none", "compression_level": 4, "shuffle": True, "chunking": "spatial"},
+            False,
+        ),
+        ({"compression": "lz4"}, None, True),
+        ({"compression": "zlib", "compression_level": 0}, None, True),
+        ({"compression": "zlib", "compression_level": "9"}, None, True),
+        ({"chunking": "temporal"}, None, True),
+    ],
+)
+def test_get_datacube_encoding_options(options, expected_encoding_options, should_raise_error):
+    arguments = {"data": {"from_node": "loadco1"}, "format": "netcdf"}
+    if options is not None:
+        arguments["options"] = options
+    process_graph = {"result1": {"process_id": "save_result", "arguments": arguments, "result": True}}
+
+    if should_raise_error:
+        with pytest.raises(ProcessParameterInvalid):
+            get_datacube_encoding_options(process_graph)
+    else:
+        assert get_datacube_encoding_options(process_graph) == expected_encoding_options
+
+
+@pytest.mark.parametrize(
+    "dims,shape,itemsize,chunking,expected_chunks",
+    [
+        (("t", "band", "y", "x"), (10, 1, 2048, 2048), 4, "spatial", (1, 1, 1024, 1024)),
+        (("t", "band", "y", "x"), (10, 4, 2048, 2048), 4, "time_series", (10, 4, 161, 161)),
+        (("band", "y", "x"), (2, 300, 5000), 1, "spatial", (2, 300, 1448)),
+        (("t", "y", "x"), (100000, 100, 100), 8, "time_series", (100000, 16, 16)),
+    ],
+)
+def test_get_output_chunks(dims, shape, itemsize, chunking, expected_chunks):
+    assert get_output_chunks(dims, shape, itemsize, chunking) == expected_chunks
+
+
+@pytest.mark.parametrize(
+    "tile_size,chunk_size,expected_chunk_size",
+    [(10000, 1024, 1000), (2048, 1024, 1024), (256, 1024, 256), (1031, 512, 512)],
+)
+def test_get_aligned_chunk_size(tile_size, chunk_size, expected_chunk_size):
+    assert get_aligned_chunk_size(tile_size, chunk_size) == expected_chunk_size
+
+
 @pytest.mark.parametrize(
     "endpoint,access_token,api_responses,min_exec_time,should_raise_error,expected_error",
     [
@@ -1867,3 +2071,957 @@ def test_bands_metadata(process_graph):
     bands_metadata = collections.get_collection(collection_id)["summaries"]["eo:bands"]
     process = Process({"process_graph": process_graph}, request_type=ProcessingRequestTypes.SYNC)
     assert process.evalscript.bands_metadata["node_1"] == bands_metadata
+
+
+def test_ttl_cache():
+    cache = TTLCache(ttl=0.2)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    assert cache.get("a") == 1
+    assert cache.get("c") is None
+    time.sleep(0.3)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    cache.delete("b")
+    assert cache.get("b", "default") == "default"
+
+    # entries which were set the longest time ago are evicted first
+    cache = TTLCache(ttl=10, max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 3)
+    cache.set("c", 4)
+    assert cache.get("b") is None
+    assert cache.get("a") == 3
+    assert cache.get("c") == 4
+
+    # expired entries are dropped when new ones are set
+    cache = TTLCache(ttl=0.1, max_size=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    time.sleep(0.2)
+    cache.set("c", 3)
+    assert list(cache._entries) == ["c"]
+
+
+def test_background_tasks():
+    background_tasks = BackgroundTasks(max_workers=2)
+    runs = []
+    done = threading.Event()
+
+    def task(n_runs):
+        runs.append(len(runs))
+        if len(runs) < n_runs:
+            return 0.05
+        done.set()
+
+    assert background_tasks.submit("task", task, 3)
+    # tasks with the same key are not scheduled twice
+    assert not background_tasks.submit("task", task, 3)
+    assert done.wait(timeout=5)
+    assert runs == [0, 1, 2]
+
+    time.sleep(0.1)
+    done.clear()
+    assert background_tasks.submit("task", task, 4)
+    assert done.wait(timeout=5)
+    assert runs == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "bands,file_format,request_type,expected_pu_per_acquisition",
+    [
+        (["B01", "B02", "B03"], "gtiff", ProcessingRequestTypes.SYNC, 2),
+        (["B01", "B02", "B03", "B04", "B05", "B06"], "png", ProcessingRequestTypes.SYNC, 2),
+        (["B01", "B02", "B03"], "gtiff", ProcessingRequestTypes.BATCH, 2 / 3),
+    ],
+)
+def test_processing_units_estimate(get_process_graph, bands, file_format, request_type, expected_pu_per_acquisition):
+    pu_calibration.reset()
+    process = Process(
+        {
+            "process_graph": get_process_graph(
+                collection_id="sentinel-2-l1c",
+                bands=bands,
+                file_format=file_format,
+                spatial_extent={"west": 12.32271, "east": 12.33572, "north": 42.07112, "south": 42.06347},
+            )
+        },
+        width=512,
+        height=512,
+        request_type=request_type,
+    )
+    n_acquisitions = process.get_number_of_acquisitions()["loadco1"]
+    assert n_acquisitions > 1
+    assert estimate_processing_units(process) == pytest.approx(expected_pu_per_acquisition * n_acquisitions)
+    assert estimate_processing_units(process, width=5, height=5) == pytest.approx(
+        0.01 * expected_pu_per_acquisition * n_acquisitions
+    )
+
+
+def test_processing_units_calibration():
+    calibration = ProcessingUnitsCalibration(smoothing=0.5, min_factor=0.5, max_factor=2)
+    assert calibration.factor == 1
+    calibration.update(10, 15)
+    assert calibration.factor == pytest.approx(1.25)
+    # outliers are clipped
+    calibration.update(10, 1000)
+    assert calibration.factor == pytest.approx(1.625)
+    calibration.update(0, 10)
+    calibration.update(10, None)
+    assert calibration.factor == pytest.approx(1.625)
+
+
+@responses.activate
+@pytest.mark.parametrize(
+    "sh_status,expected_status,expected_error,is_final",
+    [
+        ("PROCESSING", openEOBatchJobStatus.RUNNING, None, False),
+        ("DONE", openEOBatchJobStatus.FINISHED, None, True),
+        ("FAILED", openEOBatchJobStatus.ERROR, "Something went wrong", True),
+        ("PARTIAL", openEOBatchJobStatus.ERROR, None, False),
+    ],
+)
+def test_batch_job_status_persisting(get_process_graph, sh_status, expected_status, expected_error, is_final):
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    batch_request = create_mocked_batch_request(batch_request_id)
+    batch_request["status"] = sh_status
+    batch_request["error"] = "Something went wrong"
+    responses.add(
+        responses.GET,
+        f"https://services.sentinel-hub.com/api/v1/batch/process/{batch_request_id}",
+        json=batch_request,
+    )
+
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    # results are already post-processed, so that finished jobs are reported as such
+    JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+
+        status, error = get_batch_job_status(JobsPersistence.get_by_id(job_id))
+        assert status == expected_status
+        assert error == expected_error
+        assert len(responses.calls) == 1
+
+    batch_request_info_cache.clear()
+
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+
+        status, error = get_batch_job_status(JobsPersistence.get_by_id(job_id))
+        assert status == expected_status
+        assert error == expected_error
+        # final statuses are read from the job record, Sentinel Hub is asked again only for the others
+        assert len(responses.calls) == (1 if is_final else 2)
+
+
+def test_scan_jobs_without_final_status(get_process_graph):
+    def create_job(batch_request_id, status=None, is_final=False):
+        job_id = JobsPersistence.create(
+            {
+                "user_id": "mocked_id",
+                "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+                "batch_request_id": batch_request_id,
+            }
+        )
+        if status is not None:
+            JobsPersistence.update_status(job_id, status.value, batch_request_id=batch_request_id, is_final=is_final)
+        return job_id
+
+    create_job("never-started")
+    create_job("analysed", openEOBatchJobStatus.CREATED)
+    running_job_id = create_job("running", openEOBatchJobStatus.RUNNING)
+    create_job("finished", openEOBatchJobStatus.FINISHED, is_final=True)
+    restarted_job_id = create_job("first-run", openEOBatchJobStatus.FINISHED, is_final=True)
+    JobsPersistence.update_key(restarted_job_id, "batch_request_id", "second-run")
+
+    jobs = list(JobsPersistence.scan_jobs_without_final_status())
+    assert sorted(job["id"] for job in jobs) == sorted([running_job_id, restarted_job_id])
+    # only attributes needed to update statuses are read
+    assert all("process" not in job and "deployment_endpoint" in job for job in jobs)
+
+
+def test_job_error_msg(get_process_graph):
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    job = JobsPersistence.get_by_id(job_id)
+    assert "error_msg" not in job and "error_code" not in job
+
+    JobsPersistence.update_status(
+        job_id, openEOBatchJobStatus.ERROR.value, batch_request_id=batch_request_id, error_msg="Processing failed."
+    )
+    assert JobsPersistence.get_by_id(job_id)["error_msg"] == "Processing failed."
+    # error of an earlier status is removed
+    JobsPersistence.update_status(job_id, openEOBatchJobStatus.QUEUED.value, batch_request_id=batch_request_id)
+    assert "error_msg" not in JobsPersistence.get_by_id(job_id)
+
+    assert JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    JobsPersistence.update_post_processing_status(
+        job_id, batch_request_id, PostProcessingStatus.ERROR, error_msg="Post-processing of results failed."
+    )
+    assert JobsPersistence.get_by_id(job_id)["post_processing_error"] == "Post-processing of results failed."
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+    assert "post_processing_error" not in JobsPersistence.get_by_id(job_id)
+
+
+def test_batch_job_post_processing_status(get_process_graph):
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    JobsPersistence.update_status(
+        job_id, openEOBatchJobStatus.FINISHED.value, batch_request_id=batch_request_id, is_final=True
+    )
+
+    assert JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    # post-processing can't be claimed twice until the lease expires
+    assert not JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    assert get_batch_job_status(JobsPersistence.get_by_id(job_id)) == (openEOBatchJobStatus.RUNNING, None)
+
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.DONE)
+    assert not JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    assert get_batch_job_status(JobsPersistence.get_by_id(job_id)) == (openEOBatchJobStatus.FINISHED, None)
+
+    JobsPersistence.update_post_processing_status(
+        job_id, batch_request_id, PostProcessingStatus.ERROR, error_msg="Post-processing of results failed."
+    )
+    assert get_batch_job_status(JobsPersistence.get_by_id(job_id)) == (
+        openEOBatchJobStatus.ERROR,
+        "Post-processing of results failed.",
+    )
+
+    # results of another batch request have to be post-processed again
+    assert JobsPersistence.claim_post_processing(job_id, "another-batch-request-id", -1)
+    # expired lease can be claimed
+    assert JobsPersistence.claim_post_processing(job_id, "another-batch-request-id", 60)
+
+
+@pytest.mark.parametrize(
+    "object_key,expected_is_output",
+    [
+        ("req/tile_0/output.nc", True),
+        ("req/tile_0/output.zarr/.zmetadata", True),
+        ("req/tile_0/output_2020-01-01.tif", True),
+        ("req/tile_0/default.tif", False),
+        ("req/tile_0/userdata.json", False),
+        ("req/request-req.json", False),
+        ("req/post_processing_manifest.json", False),
+    ],
+)
+def test_is_output_key(object_key, expected_is_output):
+    assert is_output_key(object_key) == expected_is_output
+
+
+def test_update_fields(get_process_graph):
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+            "batch_request_id": "first-batch-request",
+        }
+    )
+    new_process = {"process_graph": get_process_graph(collection_id="sentinel-2-l2a")}
+    assert JobsPersistence.update_fields(
+        job_id, {"title": "New title", "process": new_process, "status_final": True, "plan": "new-plan"}
+    )
+    job = JobsPersistence.get_by_id(job_id)
+    assert job["title"] == "New title"
+    assert json.loads(job["process"]) == new_process
+    assert job["status_final"] is True
+    assert job["plan"] == "new-plan"
+
+    # fields are only updated if the condition holds
+    condition = "batch_request_id = :batch_request_id"
+    assert not JobsPersistence.update_fields(
+        job_id, {"title": "Other title"}, condition=condition, condition_values={":batch_request_id": "other"}
+    )
+    assert JobsPersistence.get_by_id(job_id)["title"] == "New title"
+    assert JobsPersistence.update_fields(
+        job_id,
+        {"title": "Other title"},
+        condition=condition,
+        condition_values={":batch_request_id": "first-batch-request"},
+    )
+    assert JobsPersistence.get_by_id(job_id)["title"] == "Other title"
+
+    # nothing is updated without fields
+    assert JobsPersistence.update_fields(job_id, {})
+    assert JobsPersistence.get_by_id(job_id)["title"] == "Other title"
+
+    # fields which are None are removed
+    assert JobsPersistence.update_fields(job_id, {"title": None, "plan": None})
+    job = JobsPersistence.get_by_id(job_id)
+    assert "title" not in job and "plan" not in job
+    assert job["status_final"] is True
+
+
+def test_batch_operations(get_process_graph):
+    job_ids = [
+        JobsPersistence.create(
+            {
+                "user_id": "mocked_id",
+                "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+                "batch_request_id": f"batch-request-{i}",
+            }
+        )
+        for i in range(120)
+    ]
+
+    # more records than fit into a single request, missing records are left out
+    jobs = JobsPersistence.batch_get([*job_ids, "non-existing-id"])
+    assert sorted(job["id"] for job in jobs) == sorted(job_ids)
+    assert all(job["user_id"] == "mocked_id" for job in jobs)
+
+    assert sorted(job["id"] for job in JobsPersistence.parallel_scan(total_segments=4)) == sorted(job_ids)
+
+    JobsPersistence.batch_write(delete_ids=job_ids[:50])
+    assert sorted(job["id"] for job in JobsPersistence.items()) == sorted(job_ids[50:])
+
+    JobsPersistence.clear_table()
+    assert list(JobsPersistence.items()) == []
+
+
+def test_query_list_by_user_id(get_process_graph):
+    job_ids = [
+        JobsPersistence.create(
+            {
+                "user_id": "mocked_id",
+                "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+                "batch_request_id": f"batch-request-{i}",
+                "title": f"Job {i}",
+            }
+        )
+        for i in range(5)
+    ]
+    JobsPersistence.create({"user_id": "other_id", "process": {"process_graph": {}}})
+
+    listed_job_ids = []
+    after_job_id = None
+    for expected_n_jobs in [2, 2, 1]:
+        jobs, after_job_id = JobsPersistence.query_list_by_user_id("mocked_id", limit=2, after_job_id=after_job_id)
+        assert len(jobs) == expected_n_jobs
+        # large attributes which aren't needed for listing are left out
+        assert all("process" not in job and job["title"].startswith("Job") for job in jobs)
+        listed_job_ids.extend(job["id"] for job in jobs)
+    assert after_job_id is None
+    assert sorted(listed_job_ids) == sorted(job_ids)
+
+    jobs, after_job_id = JobsPersistence.query_list_by_user_id("mocked_id")
+    assert sorted(job["id"] for job in jobs) == sorted(job_ids)
+    assert after_job_id is None
+
+    indexes = JobsPersistence.dynamodb.describe_table(TableName=JobsPersistence.TABLE_NAME)["Table"][
+        "GlobalSecondaryIndexes"
+    ]
+    list_index = next(index for index in indexes if index["IndexName"] == JobsPersistence.LIST_INDEX_NAME)
+    assert list_index["Projection"]["ProjectionType"] == "INCLUDE"
+
+
+def test_get_service_record():
+    service_id = ServicesPersistence.create(
+        {"user_id": "mocked_id", "type": "xyz", "process": {"process_graph": {}}, "configuration": {"tile_size": 512}}
+    )
+    assert get_service_record(service_id)["user_id"] == "mocked_id"
+    assert get_service_record("unknown-service-id") is None
+
+    # records and unknown ids are cached, so the table isn't read for every tile
+    ServicesPersistence.dynamodb.delete_item(TableName=ServicesPersistence.TABLE_NAME, Key={"id": {"S": service_id}})
+    assert get_service_record(service_id)["user_id"] == "mocked_id"
+    assert get_service_record("unknown-service-id") is None
+
+    service_records_cache.delete(service_id)
+    assert get_service_record(service_id) is None
+    service_records_cache.clear()
+
+
+def test_get_user_defined_processes():
+    def udp_node(process_id, **arguments):
+        return {"process_id": process_id, "arguments": arguments}
+
+    ProcessGraphsPersistence.create(
+        {"user_id": "mocked_id", "process_graph": {"node": udp_node("absolute", x=5)}}, "udp_leaf"
+    )
+    ProcessGraphsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process_graph": {
+                "node": udp_node(
+                    "apply",
+                    data={"from_parameter": "data"},
+                    process={"process_graph": {"leaf": udp_node("udp_leaf"), "self": udp_node("udp_nested")}},
+                )
+            },
+        },
+        "udp_nested",
+    )
+    ProcessGraphsPersistence.create(
+        {"user_id": "mocked_id", "process_graph": {"node": udp_node("absolute", x=1)}}, "udp_unused"
+    )
+    ProcessGraphsPersistence.create(
+        {"user_id": "other_id", "process_graph": {"node": udp_node("absolute", x=1)}}, "udp_of_other_user"
+    )
+    process_graph = {
+        "load": udp_node("load_collection", id="sentinel-2-l1c"),
+        "nested": udp_node("udp_nested", data={"from_node": "load"}),
+        "other": udp_node("udp_of_other_user"),
+    }
+
+    assert get_process_ids(process_graph) == {"load_collection", "udp_nested", "udp_of_other_user"}
+
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+        # processes used by user-defined processes are resolved too, processes of other users are left out
+        udp_graphs = get_user_defined_processes_graphs(process_graph)
+        assert set(udp_graphs) == {"udp_nested", "udp_leaf"}
+        assert udp_graphs["udp_leaf"] == {"node": udp_node("absolute", x=5)}
+
+    # process graphs are cached until user's processes change
+    ProcessGraphsPersistence.dynamodb.delete_item(
+        TableName=ProcessGraphsPersistence.TABLE_NAME, Key={"id": {"S": "udp_leaf"}}
+    )
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+        assert set(get_user_defined_processes_graphs(process_graph)) == {"udp_nested", "udp_leaf"}
+
+    ProcessGraphsPersistence.delete("udp_unused")
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+        assert set(get_user_defined_processes_graphs(process_graph)) == {"udp_nested"}
+
+
+def test_process_graph_versions_are_not_process_graphs():
+    ProcessGraphsPersistence.create(
+        {"user_id": "other_id", "process_graph": {"node": {"process_id": "absolute", "arguments": {"x": 1}}}},
+        "udp_of_other_user",
+    )
+    version_id = ProcessGraphsPersistence.get_version_id("other_id")
+    version = ProcessGraphsPersistence.get_version("other_id")
+    assert version is not None
+
+    assert ProcessGraphsPersistence.get_by_id(version_id) is None
+    assert ProcessGraphsPersistence.batch_get([version_id]) == []
+    ProcessGraphsPersistence.delete(version_id)
+    assert ProcessGraphsPersistence.get_version("other_id") == version
+
+    with app.test_request_context("/"):
+        g.user = SHUser(user_id="mocked_id", sh_access_token="<some-token>", sh_userinfo={"d": {"1": {"t": 11000}}})
+        assert get_user_defined_processes_graphs({"node": {"process_id": version_id, "arguments": {}}}) == {}
+
+
+def test_post_processing_queue(get_process_graph):
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    job_id = JobsPersistence.create(
+        {
+            "user_id": "mocked_id",
+            "process": {"process_graph": get_process_graph(collection_id="sentinel-2-l1c")},
+            "batch_request_id": batch_request_id,
+        }
+    )
+    assert JobsPersistence.claim_post_processing(job_id, batch_request_id, 60)
+    tiles = {
+        f"tile_{i}": {
+            "data_key": f"{batch_request_id}/tile_{i}/default.tif",
+            "metadata_key": f"{batch_request_id}/tile_{i}/userdata.json",
+        }
+        for i in range(2)
+    }
+    PostProcessingTasksPersistence.create_tasks(job_id, batch_request_id, tiles)
+    JobsPersistence.update_post_processing_status(job_id, batch_request_id, PostProcessingStatus.QUEUED)
+
+    first_task = PostProcessingTasksPersistence.claim_task(60)
+    second_task = PostProcessingTasksPersistence.claim_task(60)
+    assert {first_task["subfolder_id"], second_task["subfolder_id"]} == set(tiles)
+    # claimed tasks can't be claimed again until their lease expires
+    assert PostProcessingTasksPersistence.claim_task(60) is None
+
+    output_keys = [f"{batch_request_id}/{first_task['subfolder_id']}/output.nc"]
+    PostProcessingTasksPersistence.complete_task(first_task["id"], output_keys)
+    completed_tasks = [
+        task
+        for task in PostProcessingTasksPersistence.query_by_batch_request_id(batch_request_id)
+        if task["id"] == first_task["id"]
+    ]
+    assert completed_tasks[0]["output_keys"] == output_keys
+    # enqueuing the same tiles again doesn't reset them
+    PostProcessingTasksPersistence.create_tasks(job_id, batch_request_id, tiles)
+    update_queued_post_processing(job_id, batch_request_id)
+    job = JobsPersistence.get_by_id(job_id)
+    assert job["post_processing_status"] == PostProcessingStatus.QUEUED.value
+    assert job["post_processing_tiles_done"] == "1"
+
+    # failed task is retried until it runs out of attempts
+    PostProcessingTasksPersistence.fail_task(second_task["id"], "Conversion failed.", max_attempts=2)
+    second_task = PostProcessingTasksPersistence.claim_task(60)
+    assert second_task is not None and second_task["attempts"] == 2
+    PostProcessingTasksPersistence.fail_task(second_task["id"], "Conversion failed.", max_attempts=2)
+    assert PostProcessingTasksPersistence.claim_task(60) is None
+
+    update_queued_post_processing(job_id, batch_request_id)
+    job = JobsPersistence.get_by_id(job_id)
+    assert job["post_processing_status"] == PostProcessingStatus.ERROR.value
+    assert job["post_processing_error"] == "Post-processing of results failed: Conversion failed."
+
+
+def test_post_processing_task_lease():
+    batch_request_id = "4f5e3c2a-7b1d-4c9e-8a6f-2d3b1e0c9a87"
+    tiles = {
+        "tile_0": {
+            "data_key": f"{batch_request_id}/tile_0/default.tif",
+            "metadata_key": f"{batch_request_id}/tile_0/userdata.json",
+        }
+    }
+    PostProcessingTasksPersistence.create_tasks("mocked_job_id", batch_request_id, tiles)
+
+    # task whose lease has expired can be claimed again
+    task = PostProcessingTasksPersistence.claim_task(-1)
+    assert PostProcessingTasksPersistence.claim_task(-1)["id"] == task["id"]
+    # extended lease keeps the task claimed
+    PostProcessingTasksPersistence.extend_lease(task["id"], 60)
+    assert PostProcessingTasksPersistence.claim_task(60) is None
+
+    # lease of a completed task isn't extended anymore
+    PostProcessingTasksPersistence.complete_task(task["id"])
+    PostProcessingTasksPersistence.extend_lease(task["id"], 60)
+    (task,) = PostProcessingTasksPersistence.query_by_batch_request_id(batch_request_id)
+    assert task["task_status"] == "done"
+
+
+def test_post_processing_manifest():
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    results = [
+        {"Key": f"{batch_request_id}/request-{batch_request_id}.json"},
+        {"Key": f"{batch_request_id}/post_processing_manifest.json"},
+    ]
+    subfolder_groups = {}
+    for i in range(2):
+        data_key = f"{batch_request_id}/tile_{i}/default.tif"
+        metadata_key = f"{batch_request_id}/tile_{i}/userdata.json"
+        results.extend([{"Key": data_key}, {"Key": metadata_key}])
+        subfolder_groups[f"tile_{i}"] = {"default": data_key, "userdata": metadata_key}
+
+    manifest = create_manifest(batch_request_id, results, subfolder_groups)
+    assert manifest["status"] == "running"
+    assert set(get_pending_tiles(manifest)) == {"tile_0", "tile_1"}
+
+    complete_tile(manifest, "tile_0", [f"{batch_request_id}/tile_0/output.zarr/.zmetadata"])
+    # tiles which are already done are not converted again
+    assert set(get_pending_tiles(manifest)) == {"tile_1"}
+    assert get_pending_tiles(manifest)["tile_1"]["data_key"] == f"{batch_request_id}/tile_1/default.tif"
+
+    complete_tile(manifest, "tile_1", [f"{batch_request_id}/tile_1/output.zarr/.zmetadata"])
+    complete_manifest(manifest)
+    assert manifest["status"] == "done"
+    assert get_pending_tiles(manifest) == {}
+    # manifest itself is not one of the results
+    assert get_manifest_result_keys(manifest) == [
+        *[result["Key"] for result in results if not result["Key"].endswith("post_processing_manifest.json")],
+        f"{batch_request_id}/tile_0/output.zarr/.zmetadata",
+        f"{batch_request_id}/tile_1/output.zarr/.zmetadata",
+    ]
+
+
+def test_post_processing_manifest_of_legacy_results():
+    batch_request_id = "d01a6b07-6b1b-4bb5-9f9e-a5e5e1d0a0c0"
+    results = [{"Key": f"{batch_request_id}/request-{batch_request_id}.json"}]
+    subfolder_groups = {}
+    for i in range(3):
+        data_key = f"{batch_request_id}/tile_{i}/default.tif"
+        metadata_key = f"{batch_request_id}/tile_{i}/userdata.json"
+        results.extend([{"Key": data_key}, {"Key": metadata_key}])
+        subfolder_groups[f"tile_{i}"] = {"default": data_key, "userdata": metadata_key}
+    # earlier versions converted tiles without writing manifests, conversion of tile_2 was interrupted
+    results.extend(
+        [
+            {"Key": f"{batch_request_id}/tile_0/output.zarr/.zmetadata"},
+            {"Key": f"{batch_request_id}/tile_0/output.zarr/data/0.0.0"},
+            {"Key": f"{batch_request_id}/tile_1/output.zarr/.zmetadata"},
+            {"Key": f"{batch_request_id}/tile_2/output.zarr/data/0.0.0"},
+        ]
+    )
+
+    manifest = create_manifest(batch_request_id, results, subfolder_groups)
+    # already converted tiles are not converted (and uploaded) again
+    assert set(get_pending_tiles(manifest)) == {"tile_2"}
+    assert manifest["tiles"]["tile_0"]["output_keys"] == [f"{batch_request_id}/tile_0/output.zarr/.zmetadata"]
+
+    complete_tile(manifest, "tile_2", [f"{batch_request_id}/tile_2/output.zarr/.zmetadata"])
+    complete_manifest(manifest)
+    result_keys = get_manifest_result_keys(manifest)
+    assert len(result_keys) == len(set(result_keys))
+    assert [key for key in result_keys if is_output_key(key)] == [
+        f"{batch_request_id}/tile_{i}/output.zarr/.zmetadata" for i in range(3)
+    ]
+
+
+@pytest.mark.parametrize(
+    "bucket_class,bucket_name,endpoint_url,expected_path,expected_endpoint_config",
+    [
+        (ResultsBucket, "results", None, "/vsis3/results/req/tile/default.tif", {}),
+        (
+            CreodiasResultsBucket,
+            "project:results",
+            "https://s3.waw2-1.cloudferro.com",
+            "/vsis3/results/req/tile/default.tif",
+            {"AWS_S3_ENDPOINT": "s3.waw2-1.cloudferro.com", "AWS_HTTPS": "YES", "AWS_VIRTUAL_HOSTING": "FALSE"},
+        ),
+        (
+            ResultsBucket,
+            "results",
+            "http://localhost:9000",
+            "/vsis3/results/req/tile/default.tif",
+            {"AWS_S3_ENDPOINT": "localhost:9000", "AWS_HTTPS": "NO", "AWS_VIRTUAL_HOSTING": "FALSE"},
+        ),
+    ],
+)
+def test_results_bucket_gdal_config(bucket_class, bucket_name, endpoint_url, expected_path, expected_endpoint_config):
+    bucket = bucket_class(bucket_name, "eu-central-1", endpoint_url, "access-key-id", "secret-access-key")
+    assert bucket.get_gdal_path("req/tile/default.tif") == expected_path
+
+    gdal_config = bucket.get_gdal_config()
+    assert gdal_config["AWS_ACCESS_KEY_ID"] == "access-key-id"
+    assert gdal_config["AWS_SECRET_ACCESS_KEY"] == "secret-access-key"
+    assert gdal_config["AWS_REGION"] == "eu-central-1"
+    for key in ["AWS_S3_ENDPOINT", "AWS_HTTPS", "AWS_VIRTUAL_HOSTING"]:
+        assert gdal_config.get(key) == expected_endpoint_config.get(key)
+
+
+def test_results_bucket_restored_once_per_process():
+    bucket = CreodiasResultsBucket(
+        "project:results", "eu-central-1", "https://s3.waw2-1.cloudferro.com", "access-key-id", "secret-access-key"
+    )
+    restored_bucket = pickle.loads(pickle.dumps(bucket))
+    assert restored_bucket is not bucket
+    assert restored_bucket.bucket_name == "results"
+    # tasks passed to the same process share the bucket and its pool of connections
+    assert pickle.loads(pickle.dumps(bucket)) is restored_bucket
+
+    client_config = restored_bucket.client.meta.config
+    assert client_config.max_pool_connections == S3_MAX_POOL_CONNECTIONS
+    assert client_config.retries["mode"] == "adaptive"
+
+
+def test_mosaic_grid():
+    def create_tile(left, top, size=4, resolution=10):
+        tile = xr.DataArray(
+            np.zeros((1, size, size)),
+            dims=("band", "y", "x"),
+            coords={
+                "x": left + (np.arange(size) + 0.5) * resolution,
+                "y": top - (np.arange(size) + 0.5) * resolution,
+            },
+        )
+        return [tile.rio.write_crs("EPSG:32633")]
+
+    tiles = [create_tile(500000, 5000000), create_tile(500040, 5000000), create_tile(500000, 4999960)]
+    grid = MosaicGrid(tiles)
+
+    assert (grid.width, grid.height) == (8, 8)
+    assert grid.x[0] == 500005 and grid.y[0] == 4999995
+    assert [grid.get_tile_offset(tile) for tile in tiles] == [(0, 0), (0, 4), (4, 0)]
+
+
+class InMemoryResultsBucket:
+    """
+    Results bucket which keeps objects in memory, with the parts of the S3 client used by post-processing.
+    """
+
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self):
+        self.bucket_name = "results"
+        self.objects = {}
+        self.put_keys = []
+        self.client = SimpleNamespace(
+            put_object=self.put_object,
+            get_object=self.get_object,
+            head_object=self.head_object,
+            delete_object=self.delete_object,
+            exceptions=SimpleNamespace(NoSuchKey=self.NoSuchKey),
+        )
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = bytes(Body)
+        self.put_keys.append(Key)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def upload_file_to_bucket(self, local_file_path, prefix=None, file_name="file", transfer_config=None):
+        with open(local_file_path, "rb") as f:
+            self.put_object(self.bucket_name, f"{prefix}/{file_name}" if prefix else file_name, f.read())
+
+    def get_data_from_bucket(self, prefix=None, max_keys=None):
+        return [{"Key": key} for key in sorted(self.objects) if key.startswith(prefix or "")]
+
+
+tile_datacube_metadata = {
+    "outputDimensions": [
+        {"name": "t", "type": "temporal", "labels": ["2020-01-01T00:00:00Z", "2020-01-06T00:00:00Z"]},
+        {"name": "bands", "type": "bands", "labels": ["B01", "B02"]},
+    ]
+}
+
+
+def write_tile_gtiff(file_path, crs="EPSG:32633", left=500000, top=5000000, width=40, height=30, offset=0):
+    # 2 timestamps with 2 bands each, as returned by batch processing
+    data = (np.arange(4 * height * width) + offset).astype(np.uint16).reshape(4, height, width)
+    with rasterio.open(
+        file_path,
+        "w",
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=4,
+        dtype="uint16",
+        crs=crs,
+        transform=from_origin(left, top, 10, 10),
+        nodata=0,
+    ) as dataset:
+        dataset.write(data)
+    return str(file_path)
+
+
+def open_baseline_datacube(input_tiff, output_format):
+    # datacube as it was written at once, before outputs were written window by window
+    _, list_of_timestamp_arrays = open_multitemporal_gtiff(input_tiff, tile_datacube_metadata, output_format)
+    return xr.combine_by_coords([array.expand_dims(dim="t").load() for array in list_of_timestamp_arrays])
+
+
+@pytest.mark.parametrize(
+    "output_options", [None, {"compression": "zlib", "compression_level": 4, "shuffle": True, "chunking": "spatial"}]
+)
+def test_parse_gtiff_to_netcdf(tmp_path, output_options):
+    input_tiff = write_tile_gtiff(tmp_path / "default.tif")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    output_file_paths = parse_multitemporal_gtiff_to_format(
+        input_tiff,
+        tile_datacube_metadata,
+        str(output_dir),
+        parsed_output_file_name[CustomMimeType.NETCDF],
+        CustomMimeType.NETCDF,
+        output_options=output_options,
+    )
+    assert output_file_paths == [str(output_dir / "output.nc")]
+
+    baseline_file_path = tmp_path / "baseline.nc"
+    open_baseline_datacube(input_tiff, CustomMimeType.NETCDF).to_netcdf(baseline_file_path)
+    with xr.open_dataset(output_file_paths[0]) as output, xr.open_dataset(baseline_file_path) as baseline:
+        xr.testing.assert_identical(output, baseline)
+        assert output["__xarray_dataarray_variable__"].dims == ("t", "band", "y", "x")
+        assert list(output["band"].values) == ["B01", "B02"]
+        assert output["spatial_ref"].attrs["crs_wkt"] == baseline["spatial_ref"].attrs["crs_wkt"]
+    # values are encoded (e.g. nodata as fill value) the same way
+    with xr.open_dataset(output_file_paths[0], decode_cf=False) as output, xr.open_dataset(
+        baseline_file_path, decode_cf=False
+    ) as baseline:
+        xr.testing.assert_identical(output, baseline)
+
+
+def test_parse_gtiff_to_zarr(tmp_path):
+    input_tiff = write_tile_gtiff(tmp_path / "default.tif")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    output_file_paths = parse_multitemporal_gtiff_to_format(
+        input_tiff,
+        tile_datacube_metadata,
+        str(output_dir),
+        parsed_output_file_name[CustomMimeType.ZARR],
+        CustomMimeType.ZARR,
+    )
+    # local store is zipped
+    assert output_file_paths == [str(output_dir / "output.zarr.zip")]
+
+    baseline_store = tmp_path / "baseline.zarr"
+    open_baseline_datacube(input_tiff, CustomMimeType.ZARR).to_zarr(baseline_store)
+    with xr.open_zarr(output_dir / "output.zarr") as output, xr.open_zarr(baseline_store) as baseline:
+        xr.testing.assert_identical(output, baseline)
+    with zarr.ZipStore(output_file_paths[0], mode="r") as zip_store:
+        with xr.open_zarr(zip_store) as output, xr.open_zarr(baseline_store) as baseline:
+            xr.testing.assert_identical(output, baseline)
+
+
+def test_parse_gtiff_to_zarr_in_bucket(tmp_path):
+    input_tiff = write_tile_gtiff(tmp_path / "default.tif")
+    bucket = InMemoryResultsBucket()
+
+    output_file_paths = parse_multitemporal_gtiff_to_format(
+        input_tiff,
+        tile_datacube_metadata,
+        str(tmp_path),
+        parsed_output_file_name[CustomMimeType.ZARR],
+        CustomMimeType.ZARR,
+        output_bucket=bucket,
+        output_prefix="batch-request-id/tile_0",
+        output_options={"compression": "zstd", "compression_level": 4, "shuffle": True, "chunking": "spatial"},
+    )
+    # nothing is left to upload, nothing is written locally
+    assert output_file_paths == []
+    assert not os.path.exists(tmp_path / "output.zarr")
+
+    store_prefix = "batch-request-id/tile_0/output.zarr/"
+    assert all(key.startswith(store_prefix) for key in bucket.objects)
+    # consolidated metadata is uploaded once all objects it lists are
+    assert bucket.put_keys[-1] == f"{store_prefix}.zmetadata"
+
+    store = {key[len(store_prefix) :]: value for key, value in bucket.objects.items()}
+    baseline_store = tmp_path / "baseline.zarr"
+    open_baseline_datacube(input_tiff, CustomMimeType.ZARR).to_zarr(baseline_store)
+    with xr.open_zarr(store) as output, xr.open_zarr(baseline_store) as baseline:
+        xr.testing.assert_identical(output, baseline)
+
+
+def test_parse_gtiff_to_cog(tmp_path):
+    input_tiff = write_tile_gtiff(tmp_path / "default.tif")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    output_file_paths = parse_multitemporal_gtiff_to_format(
+        input_tiff,
+        tile_datacube_metadata,
+        str(output_dir),
+        parsed_output_file_name[MimeType.TIFF],
+        MimeType.TIFF,
+        output_options={"cog": True, "compression": "deflate", "predictor": 2, "overviews": [2]},
+    )
+    assert output_file_paths == [
+        str(output_dir / "output_2020-01-01T00:00:00Z.tif"),
+        str(output_dir / "output_2020-01-06T00:00:00Z.tif"),
+    ]
+
+    _, list_of_timestamp_arrays = open_multitemporal_gtiff(input_tiff, tile_datacube_metadata, MimeType.TIFF)
+    for i, (output_file_path, timestamp_array) in enumerate(zip(output_file_paths, list_of_timestamp_arrays)):
+        baseline_file_path = str(tmp_path / f"baseline_{i}.tif")
+        timestamp_array.rio.to_raster(baseline_file_path, tiled=True, windowed=True)
+
+        with rasterio.open(output_file_path) as output, rasterio.open(baseline_file_path) as baseline:
+            assert output.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") == "COG"
+            assert output.compression.name.lower() == "deflate"
+            assert output.overviews(1) == [2]
+            assert output.crs == baseline.crs
+            assert output.transform == baseline.transform
+            assert output.nodata == baseline.nodata
+            assert output.descriptions == baseline.descriptions
+            np.testing.assert_array_equal(output.read(), baseline.read())
+
+
+def test_mosaic_gtiffs_to_netcdf(tmp_path):
+    # two neighbouring tiles in one UTM zone and one tile in the next zone
+    input_tiffs = [
+        write_tile_gtiff(tmp_path / "tile_0.tif", left=500000),
+        write_tile_gtiff(tmp_path / "tile_1.tif", left=500400, offset=1000),
+        write_tile_gtiff(tmp_path / "tile_2.tif", crs="EPSG:32634", offset=2000),
+    ]
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    output_file_paths = mosaic_multitemporal_gtiffs_to_format(
+        input_tiffs,
+        tile_datacube_metadata,
+        str(output_dir),
+        parsed_output_file_name[CustomMimeType.NETCDF],
+        CustomMimeType.NETCDF,
+    )
+    assert output_file_paths == [str(output_dir / "output_32633.nc"), str(output_dir / "output_32634.nc")]
+
+    for i, (output_file_path, tiffs) in enumerate(zip(output_file_paths, [input_tiffs[:2], input_tiffs[2:]])):
+        baseline_file_path = tmp_path / f"baseline_{i}.nc"
+        xr.combine_by_coords(
+            [open_baseline_datacube(input_tiff, CustomMimeType.NETCDF) for input_tiff in tiffs]
+        ).to_netcdf(baseline_file_path)
+        with xr.open_dataset(output_file_path) as output, xr.open_dataset(baseline_file_path) as baseline:
+            output_variable = output["__xarray_dataarray_variable__"]
+            assert output_variable.dims == ("t", "band", "y", "x")
+            xr.testing.assert_equal(output_variable, baseline["__xarray_dataarray_variable__"])
+            assert output["spatial_ref"].attrs["crs_wkt"] == baseline["spatial_ref"].attrs["crs_wkt"]
+    with xr.open_dataset(output_file_paths[0]) as output:
+        assert output.sizes["x"] == 80 and output.sizes["y"] == 30
+
+
+def test_upload_output_to_bucket(tmp_path):
+    local_dir = tmp_path / "tile_0"
+    (local_dir / "output.zarr").mkdir(parents=True)
+    local_file_paths = [str(local_dir / "output.nc"), str(local_dir / "output.zarr" / ".zmetadata")]
+    for i, path in enumerate(local_file_paths):
+        with open(path, "wb") as f:
+            f.write(bytes([i]))
+    bucket = InMemoryResultsBucket()
+
+    upload_pool.submit(upload_output_to_bucket, local_file_paths, bucket, str(tmp_path), "batch-request-id").result()
+
+    assert bucket.objects == {
+        "batch-request-id/tile_0/output.nc": bytes([0]),
+        "batch-request-id/tile_0/output.zarr/.zmetadata": bytes([1]),
+    }
+
+
+def test_delete_objects_retries_failed_objects():
+    bucket = ResultsBucket("results", "eu-central-1", None, "access-key-id", "secret-access-key")
+    objects_to_delete = [
+        {"Key": f"batch-request-id/tile_0/{i}.tif"} for i in range(ResultsBucket.MAX_DELETE_OBJECTS + 1)
+    ]
+    requests = []
+
+    def delete_objects(Bucket, Delete):
+        keys = [obj["Key"] for obj in Delete["Objects"]]
+        requests.append(keys)
+        if len(requests) == 1:
+            raise ConnectionError("Connection was closed")
+        if len(requests) == 2:
+            return {"Errors": [{"Key": keys[0], "Code": "InternalError", "Message": "Please try again"}]}
+        return {}
+
+    bucket.client = SimpleNamespace(delete_objects=delete_objects)
+
+    # first batch failed as a whole and one object of the second one, all of them are deleted again
+    assert bucket.delete_objects(objects_to_delete, max_attempts=2) == 0
+    assert [len(keys) for keys in requests] == [1000, 1, 1000, 1]
+    assert sorted(requests[2] + requests[3]) == sorted(requests[0] + requests[1])
+
+    # objects which couldn't be deleted in any of the attempts are counted
+    bucket.client = SimpleNamespace(
+        delete_objects=lambda Bucket, Delete: {"Errors": [{**Delete["Objects"][0], "Message": "Please try again"}]}
+    )
+    assert bucket.delete_objects(objects_to_delete, max_attempts=2) == 1
+
+
+def test_estimate_not_ready_response():
+    # the estimate is being computed, clients are told when to ask again
+    with app.test_request_context("/jobs/job-id/results", method="POST"):
+        response = handle_exception(EstimateNotReady(retry_after=5))
+
+    assert response.status_code == 202
+    assert response.headers["Retry-After"] == "5"
+    assert response.json["code"] == "EstimateNotReady"